@@ -3,9 +3,13 @@ import numpy as np
 from funasr import AutoModel
 from funasr.utils.postprocess_utils import rich_transcription_postprocess
 from TTS_record_audio import record_audio
+from TTS_vad import Utterance, SEGMENT_END, UTTERANCE_END, UTTERANCE_DROP
+from TTS_audio_frame import AudioFrame
 import asyncio
 import logging
-from TTS_audio_state import audio_state  # 引入音频状态管理
+import queue
+import threading
+import time
 
 # 初始化日志
 logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(message)s")
@@ -30,27 +34,203 @@ model = AutoModel(
 
 print(f"模型已加载: {model}")
 
-async def transcribe_audio(audio_buffer):
-    """异步使用 FunASR 模型从音频数据流中提取文本"""
-    try:
-        # 如果是bytes类型，转换为BytesIO对象
-        if isinstance(audio_buffer, bytes):
-            import io
-            audio_buffer = io.BytesIO(audio_buffer)
-            
-        audio_data = np.frombuffer(audio_buffer.getvalue(), dtype=np.int16)
-        audio_data = audio_data.astype(np.float32) / np.iinfo(np.int16).max  # 归一化处理
+# ASR 批处理设置
+ASR_BATCH_SIZE_S = 60  # 单批音频总时长上限 (秒)，与 batch_size_s 含义一致
+ASR_MAX_BATCH_WAIT_MS = 20  # 收到第一个请求后最多等待多久以凑成一批 (毫秒)
+SAMPLE_RATE = 16000
+
+
+def _set_future(future, result=None, error=None):
+    """在事件循环线程中设置 future 的结果"""
+    if future.done():
+        return  # 请求方已取消
+    if error is not None:
+        future.set_exception(error)
+    else:
+        future.set_result(result)
+
+
+class ASRWorker:
+    """ASR 工作线程
+
+    所有识别请求放入队列，由单独的线程执行，事件循环不会被 model 推理阻塞。
+    已切分好语音段的请求会被动态合批：收到第一个请求后在 max_batch_wait_ms 内
+    继续收集并发请求，直到音频总时长达到 batch_size_s，再用一次 inference 调用识别。
+    """
+
+    def __init__(self, batch_size_s=ASR_BATCH_SIZE_S, max_batch_wait_ms=ASR_MAX_BATCH_WAIT_MS):
+        self.batch_size_s = batch_size_s
+        self.max_batch_wait = max_batch_wait_ms / 1000
+        self.requests = queue.Queue()
+        self.pending = None  # 超出上一批容量、留给下一批的请求
+        self.batches = 0
+        self.completed = 0
+        self.thread = threading.Thread(target=self._run, name="asr-worker", daemon=True)
+        self.thread.start()
+
+    def submit(self, segments=None, audio=None):
+        """提交识别请求，返回可等待的 future
+
+        segments 为已切分的 float32 语音段列表（合批识别）；
+        audio 为未切分的完整音频（使用 FunASR 自带的 VAD 单独识别）。
+        """
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self.requests.put((segments, audio, loop, future))
+        return future
+
+    @staticmethod
+    def _duration(request):
+        segments, audio = request[0], request[1]
+        if segments is None:
+            return len(audio) / SAMPLE_RATE
+        return sum(len(segment) for segment in segments) / SAMPLE_RATE
+
+    def _next_batch(self):
+        """取出下一批请求"""
+        first = self.pending if self.pending is not None else self.requests.get()
+        self.pending = None
+        if first[0] is None:
+            return [first]
+
+        batch = [first]
+        total = self._duration(first)
+        deadline = time.monotonic() + self.max_batch_wait
+        while total < self.batch_size_s:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                request = self.requests.get(timeout=timeout)
+            except queue.Empty:
+                break
+            duration = self._duration(request)
+            if request[0] is None or total + duration > self.batch_size_s:
+                self.pending = request
+                break
+            batch.append(request)
+            total += duration
+        return batch
+
+    @staticmethod
+    def _deliver(request, result=None, error=None):
+        loop, future = request[2], request[3]
+        try:
+            loop.call_soon_threadsafe(_set_future, future, result, error)
+        except RuntimeError:
+            pass  # 请求方的事件循环已关闭
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            try:
+                if batch[0][0] is None:
+                    results = [self._transcribe_with_vad(batch[0][1])]
+                else:
+                    results = self._transcribe_batch([request[0] for request in batch])
+            except Exception as e:
+                for request in batch:
+                    self._deliver(request, error=e)
+            else:
+                for request, text in zip(batch, results):
+                    self._deliver(request, result=text)
+            self.batches += 1
+            self.completed += len(batch)
+
+    def _transcribe_batch(self, requests):
+        """把多个请求的语音段合并为一次 inference 调用，再按请求拆分结果"""
+        flat = [segment for segments in requests for segment in segments]
+        if not flat:
+            return ["" for _ in requests]
+        start = time.perf_counter()
+        res = model.inference(
+            flat,
+            language="auto",
+            use_itn=True,
+            batch_size=len(flat),
+            disable_pbar=True,
+        )
+        logger.info(f"ASR 批处理: {len(requests)} 个请求, {len(flat)} 段, "
+                    f"耗时 {(time.perf_counter() - start) * 1000:.0f} ms")
+        texts = [rich_transcription_postprocess(r["text"]) for r in res]
+        results = []
+        offset = 0
+        for segments in requests:
+            results.append("".join(texts[offset:offset + len(segments)]))
+            offset += len(segments)
+        return results
+
+    def _transcribe_with_vad(self, audio_data):
         res = model.generate(
             input=audio_data,
             cache={},
             language="auto",
             use_itn=True,
-            batch_size_s=60,
+            batch_size_s=self.batch_size_s,
             merge_vad=True,
             merge_length_s=15,
         )
-        text = rich_transcription_postprocess(res[0]["text"])
-        return text
+        return rich_transcription_postprocess(res[0]["text"])
+
+
+asr_worker = ASRWorker()
+
+
+async def transcribe_segments(utterance, segments=None):
+    """按端点检测给出的语音段边界识别，跳过 FunASR 自带的 VAD"""
+    if segments is None:
+        segments = utterance.segments
+    if not segments:
+        return ""
+    # 只转换需要识别的部分，每段归一化时只分配一次
+    segment_data = [frame.as_float32() for frame in utterance.segment_frames(segments)]
+    return await asr_worker.submit(segments=segment_data)
+
+async def transcribe_stream(speech_events):
+    """流式识别：每个语音段结束就立即识别，产出 ("partial", 文本) 和 ("final", 文本)
+
+    speech_events 为端点检测事件流，例如 microphone.speech_events()。
+    已识别的语音段及其文本保存在滚动缓存中，说话结束时只需识别最后一段。
+    """
+    cache = {"decoded": 0, "texts": []}
+    async for event, utterance in speech_events:
+        if event == UTTERANCE_DROP:
+            cache = {"decoded": 0, "texts": []}
+            continue
+        if event not in (SEGMENT_END, UTTERANCE_END):
+            continue
+
+        # 识别尚未识别过的语音段
+        pending = utterance.segments[cache["decoded"]:]
+        if pending:
+            try:
+                cache["texts"].append(await transcribe_segments(utterance, pending))
+            except Exception as e:
+                logger.error(f"语音识别出错: {e}")
+            cache["decoded"] = len(utterance.segments)
+
+        text = "".join(cache["texts"])
+        if event == UTTERANCE_END:
+            cache = {"decoded": 0, "texts": []}
+            if text:
+                yield "final", text
+        elif pending and text:
+            yield "partial", text
+
+async def transcribe_audio(audio):
+    """异步使用 FunASR 模型从音频中提取文本
+
+    audio 为 AudioFrame（或带语音段边界的 Utterance）；
+    为兼容旧接口也接受 WAV 格式的 bytes/BytesIO。
+    """
+    try:
+        # 端点检测已给出语音段边界，无需再跑一遍 VAD
+        if isinstance(audio, Utterance):
+            return await transcribe_segments(audio)
+
+        if not isinstance(audio, AudioFrame):
+            audio = AudioFrame.from_wav(audio)
+        return await asr_worker.submit(audio=audio.as_float32())
     except Exception as e:
         logger.error(f"语音识别出错: {e}")
         return None
@@ -63,9 +243,7 @@ async def transcribe_audio(audio_buffer):
 #         print("等待语音输入......")
 
 #         # 停止当前音频播放
-#         with audio_state.sound_lock:
-#             if audio_state.current_sound is not None:
-#                 audio_state.current_sound.stop()
+#         playback_scheduler.stop_now()
 
 #         audio_buffer = await record_audio()  # 录制音频
 #         if audio_buffer is not None:
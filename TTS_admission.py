@@ -0,0 +1,141 @@
+# TTS_admission.py
+# 服务端准入控制：负载过高时逐级降级，仍然过载时延迟或拒绝新请求
+import asyncio
+import contextlib
+import logging
+import time
+from TTS_scheduler import request_scheduler, STAGE_LLM, STAGE_TTS
+
+logger = logging.getLogger(__name__)
+
+# 准入设置
+MAX_ACTIVE_REQUESTS = 8  # 负载为 1.0 时同时处理的请求数
+TARGET_STAGE_WAIT_S = {STAGE_LLM: 2.0, STAGE_TTS: 3.0}  # 负载为 1.0 时各阶段的预计排队时间 (秒)
+REJECT_LOAD = 1.5  # 负载超过该值时不再接收新请求
+MAX_DEFER_S = 2.0  # 拒绝前最多等待负载下降的时间 (秒)
+DEFER_POLL_S = 0.2
+
+# 降级步骤，负载达到 load 时启用该步骤及之前的所有步骤
+#   max_tokens: 限制模型回复长度
+#   sample_rate: 发送给客户端的音频降采样
+#   cache_only: 只播放已缓存的句子，不再占用合成器
+#   text_only: 跳过语音合成，只返回文本
+DEGRADATION_STEPS = [
+    {"name": "short_reply", "load": 0.6, "max_tokens": 150},
+    {"name": "low_sample_rate", "load": 0.8, "sample_rate": 16000},
+    {"name": "cache_only", "load": 1.0, "cache_only": True},
+    {"name": "text_only", "load": 1.2, "text_only": True},
+]
+
+
+class Overloaded(Exception):
+    """服务端过载，请求被拒绝"""
+
+    def __init__(self, retry_after):
+        super().__init__(f"服务器繁忙，请在 {retry_after:.0f} 秒后重试")
+        self.retry_after = retry_after
+
+
+class AdmissionController:
+    """根据实时排队深度和各阶段实测耗时决定是否接收请求、以什么模式处理
+
+    负载 = max(进行中的请求数 / MAX_ACTIVE_REQUESTS,
+               各阶段预计排队时间 / 目标排队时间)
+    其中预计排队时间 = 排队任务数 * 平均占用时间 / 并发上限。
+    """
+
+    def __init__(self, scheduler=request_scheduler, steps=DEGRADATION_STEPS, max_active=MAX_ACTIVE_REQUESTS,
+                 target_wait=TARGET_STAGE_WAIT_S, reject_load=REJECT_LOAD, max_defer_s=MAX_DEFER_S):
+        self.scheduler = scheduler
+        self.steps = sorted(steps, key=lambda step: step["load"])
+        self.max_active = max_active
+        self.target_wait = target_wait
+        self.reject_load = reject_load
+        self.max_defer_s = max_defer_s
+        self.active = 0
+        self.admitted = 0
+        self.deferred = 0
+        self.rejected = 0
+        self.degraded = {step["name"]: 0 for step in self.steps}  # 每个步骤生效的请求数
+        self.current_steps = ()
+
+    def estimated_wait(self, stage_name):
+        """按排队任务数和平均占用时间估计新任务的排队时间 (秒)"""
+        stage = self.scheduler.stages[stage_name]
+        if not stage.service_times:
+            return 0.0
+        average = sum(stage.service_times) / len(stage.service_times)
+        return stage.queue_depth() * average / stage.capacity
+
+    def load(self):
+        load = self.active / self.max_active
+        for stage_name, target in self.target_wait.items():
+            load = max(load, self.estimated_wait(stage_name) / target)
+        return load
+
+    def mode(self, load):
+        """返回该负载下的处理模式"""
+        mode = {"steps": [], "max_tokens": None, "sample_rate": None, "cache_only": False, "text_only": False}
+        for step in self.steps:
+            if load < step["load"]:
+                break
+            mode["steps"].append(step["name"])
+            for key, value in step.items():
+                if key not in ("name", "load"):
+                    mode[key] = value
+        steps = tuple(mode["steps"])
+        if steps != self.current_steps:
+            logger.warning(f"负载 {load:.2f}，降级步骤: {list(steps) or '无'}")
+            self.current_steps = steps
+        return mode
+
+    def retry_after(self):
+        """建议客户端重试的等待时间 (秒)"""
+        return max(1.0, max(self.estimated_wait(stage_name) for stage_name in self.target_wait))
+
+    @contextlib.asynccontextmanager
+    async def admit(self):
+        """接收一个请求：async with admission.admit() as mode: ...
+
+        负载过高时最多等待 max_defer_s，仍未下降则抛出 Overloaded。
+        """
+        start = time.perf_counter()
+        load = self.load()
+        if load >= self.reject_load:
+            self.deferred += 1
+            while load >= self.reject_load and time.perf_counter() - start < self.max_defer_s:
+                await asyncio.sleep(DEFER_POLL_S)
+                load = self.load()
+            if load >= self.reject_load:
+                self.rejected += 1
+                retry_after = self.retry_after()
+                logger.warning(f"负载 {load:.2f}，拒绝请求，建议 {retry_after:.0f} 秒后重试")
+                raise Overloaded(retry_after)
+        mode = self.mode(load)
+        for name in mode["steps"]:
+            self.degraded[name] += 1
+        self.admitted += 1
+        self.active += 1
+        try:
+            yield mode
+        finally:
+            self.active -= 1
+
+    def stats(self):
+        return {"load": self.load(),
+                "active": self.active,
+                "admitted": self.admitted,
+                "deferred": self.deferred,
+                "rejected": self.rejected,
+                "current_steps": list(self.current_steps),
+                "degraded": dict(self.degraded)}
+
+    def summary(self):
+        stats = self.stats()
+        degraded = ", ".join(f"{name} {count}" for name, count in stats["degraded"].items())
+        return (f"准入控制: 负载 {stats['load']:.2f}, 进行中 {stats['active']}, 已接收 {stats['admitted']}, "
+                f"延迟 {stats['deferred']}, 拒绝 {stats['rejected']}, 降级 [{degraded}]")
+
+
+# 全局准入控制
+admission = AdmissionController()
@@ -0,0 +1,208 @@
+# TTS_audio_cache.py
+# 基于内容寻址的 TTS 音频磁盘缓存，按 LRU 淘汰
+import os
+import json
+import hashlib
+import logging
+import threading
+import time
+from collections import OrderedDict
+import numpy as np
+from TTS_audio_frame import AudioFrame
+
+logger = logging.getLogger(__name__)
+
+# 缓存设置
+CACHE_DIR = os.path.join(os.getcwd(), "cache", "tts_audio")
+TRAINED_DIR = os.path.join(os.getcwd(), "trained")
+MAX_CACHE_BYTES = 512 * 1024 * 1024  # 缓存容量上限，512MB
+# 角色目录中参与版本计算的文件：配置和模型权重
+VERSION_FILES = ("infer_config.json",)
+WEIGHT_EXTENSIONS = (".ckpt", ".pth")
+VERSION_CHECK_INTERVAL_S = 2.0  # 两次遍历角色目录计算版本的最小间隔，期间的读写直接使用上次的版本
+
+
+def _short_hash(text, length=12):
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()[:length]
+
+
+class AudioCache:
+    """TTS 音频缓存
+
+    键为 (文本, 角色, 情感, 合成参数) 与角色模型版本的哈希，
+    值为原始 PCM，以 .npy 格式保存，读取时整体读入内存，不做解码。
+    不使用内存映射：Windows 上被映射的文件无法删除或替换，淘汰和覆盖写入都会失败。
+    删除失败的文件（例如被杀毒软件短暂占用）仍计入容量，之后淘汰时重试。
+    文件名格式: <角色哈希>-<版本哈希>-<内容哈希>-<采样率>.npy
+    """
+
+    def __init__(self, cache_dir=CACHE_DIR, trained_dir=TRAINED_DIR, max_bytes=MAX_CACHE_BYTES):
+        self.cache_dir = cache_dir
+        self.trained_dir = trained_dir
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()  # 缓存键 -> (文件名, 文件大小)，按最近使用排序
+        self.total_bytes = 0
+        self.character_versions = {}  # 角色哈希 -> 最近一次看到的版本哈希
+        self.version_memo = {}  # 角色名 -> (计算时间, 版本哈希)
+        self.pending_removals = {}  # 删除失败、等待重试的文件名 -> 文件大小
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        os.makedirs(self.cache_dir, exist_ok=True)
+        self._load_index()
+
+    def _load_index(self):
+        """扫描缓存目录，按修改时间恢复 LRU 顺序"""
+        files = []
+        for entry in os.scandir(self.cache_dir):
+            if entry.is_file() and entry.name.endswith(".npy"):
+                stat = entry.stat()
+                files.append((stat.st_mtime, entry.name, stat.st_size))
+        for _, name, size in sorted(files):
+            self.entries[name[:-len(".npy")].rsplit("-", 1)[0]] = (name, size)
+            self.total_bytes += size
+        logger.info(f"TTS 音频缓存: {len(self.entries)} 条, {self.total_bytes / 1024 / 1024:.1f} MB")
+
+    def character_version(self, character):
+        """根据角色配置和权重文件的大小与修改时间计算模型版本，VERSION_CHECK_INTERVAL_S 内复用上次的结果"""
+        if not character:
+            return "default"
+        now = time.monotonic()
+        memo = self.version_memo.get(character)
+        if memo is not None and now - memo[0] < VERSION_CHECK_INTERVAL_S:
+            return memo[1]
+        character_dir = os.path.join(self.trained_dir, character)
+        signature = []
+        for root, _, files in os.walk(character_dir):
+            for name in sorted(files):
+                if name in VERSION_FILES or name.endswith(WEIGHT_EXTENSIONS):
+                    path = os.path.join(root, name)
+                    try:
+                        stat = os.stat(path)
+                    except OSError:
+                        continue
+                    signature.append(f"{os.path.relpath(path, character_dir)}:{stat.st_size}:{stat.st_mtime_ns}")
+        version = _short_hash("|".join(signature), 8)
+        self.version_memo[character] = (now, version)
+        return version
+
+    def _cache_key(self, data):
+        character = data.get("character", "")
+        character_hash = _short_hash(character, 8)
+        version = self.character_version(character)
+        content = json.dumps(data, ensure_ascii=False, sort_keys=True, default=str)
+        self._check_version(character_hash, version)
+        return f"{character_hash}-{version}-{_short_hash(content, 32)}"
+
+    def _check_version(self, character_hash, version):
+        """角色模型变化时删除该角色旧版本的全部缓存"""
+        with self.lock:
+            previous = self.character_versions.get(character_hash)
+            self.character_versions[character_hash] = version
+            if previous == version:
+                return
+            prefix = f"{character_hash}-"
+            stale = [key for key in self.entries
+                     if key.startswith(prefix) and not key.startswith(f"{prefix}{version}-")]
+            for key in stale:
+                self._remove(key)
+            if stale:
+                logger.info(f"角色模型已变化，清除 {len(stale)} 条旧缓存")
+
+    def _remove(self, key):
+        name, size = self.entries.pop(key)
+        self.pending_removals[name] = size
+        self._retry_removals()
+
+    def _retry_removals(self):
+        """删除待删除的文件；仍然失败的保留在 pending_removals 中并继续计入容量"""
+        for name, size in list(self.pending_removals.items()):
+            try:
+                os.remove(os.path.join(self.cache_dir, name))
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                logger.debug(f"删除缓存文件失败，稍后重试 {name}: {e}")
+                continue
+            del self.pending_removals[name]
+            self.total_bytes -= size
+
+    def get(self, data):
+        """查找缓存，命中返回 AudioFrame，否则返回 None"""
+        key = self._cache_key(data)
+        with self.lock:
+            if key not in self.entries:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            name = self.entries[key][0]
+            self.hits += 1
+        path = os.path.join(self.cache_dir, name)
+        try:
+            os.utime(path)  # 更新修改时间，重启后仍能恢复 LRU 顺序
+            audio = np.load(path)
+        except (OSError, ValueError) as e:
+            logger.warning(f"读取缓存失败 {name}: {e}")
+            with self.lock:
+                if key in self.entries:
+                    self._remove(key)
+            return None
+        sample_rate = int(name[:-len(".npy")].rsplit("-", 1)[1])
+        return AudioFrame(audio, sample_rate)
+
+    def put(self, data, audio_frame):
+        """写入缓存，audio_frame 为 AudioFrame"""
+        key = self._cache_key(data)
+        name = f"{key}-{audio_frame.sample_rate}.npy"
+        path = os.path.join(self.cache_dir, name)
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        try:
+            with open(tmp_path, "wb") as f:
+                np.save(f, np.ascontiguousarray(audio_frame.samples))
+            os.replace(tmp_path, path)
+            size = os.path.getsize(path)
+        except OSError as e:
+            logger.warning(f"写入缓存失败 {name}: {e}")
+            return
+        with self.lock:
+            if key in self.entries:
+                self.total_bytes -= self.entries.pop(key)[1]
+            if name in self.pending_removals:
+                # 删除失败的旧文件已被新内容覆盖
+                self.total_bytes -= self.pending_removals.pop(name)
+            self.entries[key] = (name, size)
+            self.total_bytes += size
+            self._evict()
+
+    def _evict(self):
+        """超过容量上限时淘汰最久未使用的条目"""
+        self._retry_removals()
+        # 删除失败的文件淘汰再多条目也释放不了，不计入淘汰判断
+        while self.total_bytes - sum(self.pending_removals.values()) > self.max_bytes and len(self.entries) > 1:
+            self._remove(next(iter(self.entries)))
+            self.evictions += 1
+
+    def stats(self):
+        """返回缓存统计信息"""
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self.entries),
+                "bytes": self.total_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "pending_removals": len(self.pending_removals),
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
+
+    def summary(self):
+        stats = self.stats()
+        return (f"TTS 音频缓存: 命中 {stats['hits']}, 未命中 {stats['misses']}, "
+                f"命中率 {stats['hit_rate']:.1%}, {stats['entries']} 条, "
+                f"{stats['bytes'] / 1024 / 1024:.1f} MB, 淘汰 {stats['evictions']} 条")
+
+
+# 全局缓存实例
+audio_cache = AudioCache()
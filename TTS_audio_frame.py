@@ -0,0 +1,93 @@
+# TTS_audio_frame.py
+# 录音、识别、缓存、播放和网络传输之间统一传递的 PCM 音频对象
+import io
+import wave
+import numpy as np
+
+INT16_SCALE = np.float32(1.0 / np.iinfo(np.int16).max)
+
+
+class AudioFrame:
+    """单声道 PCM 音频：numpy 数组（int16 或 float32）加采样率
+
+    samples 可以是预分配缓冲区、内存映射文件或网络缓冲区上的视图，
+    构造和切片都不会复制数据。
+    """
+
+    __slots__ = ("samples", "sample_rate")
+
+    def __init__(self, samples, sample_rate):
+        self.samples = samples
+        self.sample_rate = int(sample_rate)
+
+    @classmethod
+    def from_bytes(cls, data, sample_rate, dtype=np.int16):
+        """把原始 PCM 字节包装为音频帧（不复制）"""
+        return cls(np.frombuffer(data, dtype=dtype), sample_rate)
+
+    @classmethod
+    def from_wav(cls, data):
+        """解析 WAV 容器，跳过文件头，只保留 PCM 数据"""
+        if isinstance(data, (bytes, bytearray, memoryview)):
+            data = io.BytesIO(data)
+        data.seek(0)
+        with wave.open(data, "rb") as wf:
+            if wf.getsampwidth() != 2:
+                raise ValueError("只支持 16 位 PCM 的 WAV 数据")
+            frames = wf.readframes(wf.getnframes())
+            samples = np.frombuffer(frames, dtype=np.int16)
+            if wf.getnchannels() > 1:
+                # 多声道只取第一个声道
+                samples = samples[::wf.getnchannels()]
+            return cls(samples, wf.getframerate())
+
+    @classmethod
+    def from_tuple(cls, audio_data):
+        """从合成器返回的 (采样率, 数组) 元组构造"""
+        sample_rate, samples = audio_data
+        return cls(np.asarray(samples), sample_rate)
+
+    @classmethod
+    def concat(cls, frames):
+        """按顺序拼接采样率相同的多段音频（复制）"""
+        return cls(np.concatenate([frame.samples for frame in frames]), frames[0].sample_rate)
+
+    def __len__(self):
+        return len(self.samples)
+
+    @property
+    def duration(self):
+        return len(self.samples) / self.sample_rate
+
+    def slice(self, start, end):
+        """按样本下标截取（返回视图）"""
+        return AudioFrame(self.samples[start:end], self.sample_rate)
+
+    def downsample(self, sample_rate):
+        """按整数倍降采样到 sample_rate（相邻样本取平均），不能整除时返回原音频"""
+        factor = self.sample_rate // sample_rate
+        if factor <= 1 or self.sample_rate % sample_rate:
+            return self
+        count = len(self.samples) // factor * factor
+        averaged = self.samples[:count].reshape(-1, factor).mean(axis=1)
+        return AudioFrame(averaged.astype(self.samples.dtype), sample_rate)
+
+    def as_float32(self):
+        """返回归一化到 [-1, 1] 的 float32 数组，已是 float32 时直接返回原数组"""
+        if self.samples.dtype == np.float32:
+            return self.samples
+        if self.samples.dtype.kind == "f":
+            return self.samples.astype(np.float32)
+        out = self.samples.astype(np.float32)
+        out *= INT16_SCALE
+        return out
+
+    def as_int16(self):
+        """返回 int16 数组，已是 int16 时直接返回原数组"""
+        if self.samples.dtype == np.int16:
+            return self.samples
+        return (np.clip(self.samples, -1.0, 1.0) * np.iinfo(np.int16).max).astype(np.int16)
+
+    def buffer(self):
+        """返回底层数据的 memoryview，用于写入套接字或文件（不复制）"""
+        return memoryview(np.ascontiguousarray(self.samples)).cast("B")
@@ -0,0 +1,208 @@
+# TTS_audio_output.py
+# 常驻的原始 PCM 输出流，替代逐句 WAV 编码 + pygame 解码播放
+import collections
+import logging
+import threading
+import time
+import numpy as np
+import pyaudio
+
+logger = logging.getLogger(__name__)
+
+# 输出设置
+OUTPUT_RATE = 32000  # 默认采样率，与 GPT-SoVITS 输出一致
+OUTPUT_CHUNK = 512  # 每次回调输出的帧数，32kHz 下为 16ms
+OUTPUT_RING_SECONDS = 60  # 环形缓冲区可容纳的音频时长 (秒)
+
+
+class AudioOutput:
+    """常驻音频输出
+
+    设备按合成器的原生采样率打开一次，numpy PCM 直接写入环形缓冲区，
+    由 PortAudio 回调线程读取播放。每段音频播放完时通过回调通知，不需要轮询；
+    音频流尚未写完而缓冲区已被读空时记为一次欠载 (underrun)。
+    """
+
+    def __init__(self, sample_rate=OUTPUT_RATE, chunk=OUTPUT_CHUNK, ring_seconds=OUTPUT_RING_SECONDS):
+        self.sample_rate = sample_rate
+        self.chunk = chunk
+        self.ring_seconds = ring_seconds
+        self.ring = np.zeros(sample_rate * ring_seconds, dtype=np.int16)
+        self.read_pos = 0  # 累计播放的样本数
+        self.write_pos = 0  # 累计写入的样本数
+        self.marks = collections.deque()  # (样本位置, 回调)，播放到该位置时调用 回调(True)
+        self.stream_open = False  # 最近写入的音频是否还有后续数据
+        self.underruns = 0
+        self.cleared_at = None  # 最近一次 clear 的时刻，回调输出静音后清空
+        self.last_clear_latency = 0.0  # 最近一次 clear 到回调开始输出静音的时间 (秒)
+        self.silenced = threading.Event()
+        self.silenced.set()
+        self.silence_callbacks = []  # clear 之后回调开始输出静音时调用 回调(清空延迟)
+        self.cond = threading.Condition()
+        self.drained = threading.Event()
+        self.drained.set()
+        self._pa = None
+        self._stream = None
+
+    def start(self, sample_rate=None):
+        """打开输出设备；采样率变化时等待已写入的音频播放完再重新打开"""
+        if sample_rate is not None and sample_rate != self.sample_rate:
+            self.wait_drained()
+            self._close()
+            with self.cond:
+                self.sample_rate = sample_rate
+                self.ring = np.zeros(sample_rate * self.ring_seconds, dtype=np.int16)
+                self.read_pos = self.write_pos = 0
+        with self.cond:
+            if self._stream is not None:
+                return
+            self._pa = pyaudio.PyAudio()
+            self._stream = self._pa.open(format=pyaudio.paInt16,
+                                         channels=1,
+                                         rate=self.sample_rate,
+                                         output=True,
+                                         frames_per_buffer=self.chunk,
+                                         stream_callback=self._callback)
+            self._stream.start_stream()
+        logger.info(f"音频输出已启动，采样率 {self.sample_rate}")
+
+    def _close(self):
+        # 不能持有 self.cond：停止流时会等待回调线程结束，而回调需要获取该锁
+        stream, pa = self._stream, self._pa
+        self._stream = None
+        self._pa = None
+        if stream is not None:
+            stream.stop_stream()
+            stream.close()
+            pa.terminate()
+
+    def close(self):
+        """关闭输出设备"""
+        self.clear()
+        self._close()
+
+    def _callback(self, in_data, frame_count, time_info, status):
+        """PortAudio 回调线程：从环形缓冲区取出音频"""
+        silence_callbacks = ()
+        with self.cond:
+            if self.cleared_at is not None:
+                self.last_clear_latency = time.perf_counter() - self.cleared_at
+                self.cleared_at = None
+                self.silenced.set()
+                silence_callbacks, self.silence_callbacks = self.silence_callbacks, []
+            available = self.write_pos - self.read_pos
+            count = min(frame_count, available)
+            if count < frame_count and self.stream_open:
+                self.underruns += 1
+            size = len(self.ring)
+            offset = self.read_pos % size
+            first = min(count, size - offset)
+            if count == frame_count and first == count:
+                out = self.ring[offset:offset + count].tobytes()
+            else:
+                buffer = np.zeros(frame_count, dtype=np.int16)
+                buffer[:first] = self.ring[offset:offset + first]
+                buffer[first:count] = self.ring[:count - first]
+                out = buffer.tobytes()
+            self.read_pos += count
+            finished = self._pop_marks()
+            if self.read_pos == self.write_pos:
+                self.drained.set()
+            self.cond.notify_all()
+        for callback in finished:
+            callback(True)
+        for callback in silence_callbacks:
+            callback(self.last_clear_latency)
+        return (out, pyaudio.paContinue)
+
+    def _pop_marks(self):
+        finished = []
+        while self.marks and self.marks[0][0] <= self.read_pos:
+            finished.append(self.marks.popleft()[1])
+        return finished
+
+    def write(self, frame, final=True, on_done=None):
+        """写入一段 AudioFrame；缓冲区已满时阻塞等待
+
+        final=False 表示同一段音频还有后续数据，期间读空缓冲区会计为欠载。
+        on_done(played) 在这段音频播放完 (played=True) 或被 clear 丢弃 (played=False) 时调用。
+        """
+        self.start(frame.sample_rate)
+        samples = frame.as_int16()
+        size = len(self.ring)
+        written = 0
+        while written < len(samples):
+            with self.cond:
+                while self.write_pos - self.read_pos >= size:
+                    self.cond.wait()
+                space = size - (self.write_pos - self.read_pos)
+                count = min(space, len(samples) - written)
+                offset = self.write_pos % size
+                first = min(count, size - offset)
+                self.ring[offset:offset + first] = samples[written:written + first]
+                self.ring[:count - first] = samples[written + first:written + count]
+                self.write_pos += count
+                written += count
+                self.drained.clear()
+        with self.cond:
+            self.stream_open = not final
+            if on_done is not None:
+                self.marks.append((self.write_pos, on_done))
+            return self.write_pos
+
+    def clear(self, on_silenced=None):
+        """立即丢弃所有未播放的音频，返回被丢弃的样本数
+
+        on_silenced(清空延迟) 在回调线程开始输出静音时调用；没有丢弃音频时不会调用。
+        """
+        with self.cond:
+            dropped = self.write_pos - self.read_pos
+            if dropped and self._stream is not None:
+                # 记录时刻，由下一次回调计算打断延迟
+                if self.cleared_at is None:
+                    self.cleared_at = time.perf_counter()
+                self.silenced.clear()
+                if on_silenced is not None:
+                    self.silence_callbacks.append(on_silenced)
+            self.read_pos = self.write_pos
+            self.stream_open = False
+            finished = [callback for _, callback in self.marks]
+            self.marks.clear()
+            self.drained.set()
+            self.cond.notify_all()
+        for callback in finished:
+            callback(False)
+        return dropped
+
+    def interrupt_latency(self, timeout=0.5):
+        """等待 clear 生效，返回从 clear 到扬声器静音的时间 (秒)
+
+        包括等待下一次回调的时间和设备自身的输出延迟。
+        """
+        if not self.silenced.wait(timeout):
+            return None
+        return self.last_clear_latency + self.output_latency()
+
+    def output_latency(self):
+        """设备自身的输出延迟 (秒)：回调输出的数据到达扬声器的时间"""
+        stream = self._stream
+        return stream.get_output_latency() if stream is not None else 0.0
+
+    def wait_below(self, samples, timeout=None):
+        """等待缓冲区中未播放的样本数低于 samples"""
+        with self.cond:
+            return self.cond.wait_for(lambda: self.write_pos - self.read_pos < samples, timeout)
+
+    def queued_samples(self):
+        """缓冲区中尚未播放的样本数"""
+        with self.cond:
+            return self.write_pos - self.read_pos
+
+    def wait_drained(self, timeout=None):
+        """等待所有已写入的音频播放完毕"""
+        return self.drained.wait(timeout)
+
+
+# 全局输出实例
+audio_output = AudioOutput()
+
@@ -0,0 +1,170 @@
+# TTS_batching.py
+# TTS 合批工作线程：把不同会话同时提交的句子按长度分组，一次合成一批
+import asyncio
+import logging
+import queue
+import threading
+import time
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+# TTS 批处理设置
+TTS_MAX_BATCH_SIZE = 4  # 单批最多句子数
+TTS_MAX_BATCH_WAIT_MS = 10  # 收到第一个请求后最多等待多久以凑成一批 (毫秒)
+TTS_LENGTH_RATIO = 2.0  # 同一批中最长句子与最短句子的长度比上限，避免过多填充
+LATENCY_SAMPLES = 500
+
+
+def _set_future(future, result=None, error=None):
+    """在事件循环线程中设置 future 的结果"""
+    if future.done():
+        return  # 请求方已取消
+    if error is not None:
+        future.set_exception(error)
+    else:
+        future.set_result(result)
+
+
+class TTSBatcher:
+    """TTS 合批工作线程
+
+    所有合成请求放入队列，由单独的线程执行，单线程保证合成器串行使用；
+    合成在工作进程中执行时可以用 concurrency 个线程同时提交多批。
+    收到第一个请求后在 max_batch_wait_ms 内继续收集并发请求，
+    从中选出与最早请求同一角色和情感、长度相近的句子组成一批，交给 synthesize_batch 一次合成；
+    其余请求留给下一批，仍按到达顺序优先。
+
+    synthesize_batch(请求列表) 返回与请求一一对应的结果，某一项为异常对象时只有该请求失败。
+    线程在第一次提交时启动，只导入模块的进程（例如 TTS 工作进程）不会创建线程。
+    """
+
+    def __init__(self, synthesize_batch, max_batch_size=TTS_MAX_BATCH_SIZE,
+                 max_batch_wait_ms=TTS_MAX_BATCH_WAIT_MS, length_ratio=TTS_LENGTH_RATIO,
+                 group_key=None, length=None, concurrency=1, name="tts-batcher"):
+        self.synthesize_batch = synthesize_batch
+        self.max_batch_size = max_batch_size
+        self.max_batch_wait = max_batch_wait_ms / 1000
+        self.length_ratio = length_ratio
+        self.group_key = group_key or (lambda data: (data.get("character", ""), data.get("emotion", "default")))
+        self.length = length or (lambda data: len(data.get("text", "")))
+        self.requests = queue.Queue()
+        self.pending = deque()  # 已取出、留给后续批次的请求
+        self.lock = threading.Lock()  # 同一时刻只有一个线程收集下一批
+        self.batches = 0
+        self.completed = 0
+        self.latencies = deque(maxlen=LATENCY_SAMPLES)  # 提交到完成的时间 (秒)
+        self.name = name
+        self.concurrency = concurrency
+        self.threads = []
+
+    def start(self):
+        """启动合批线程（只在第一次调用时生效）"""
+        with self.lock:
+            if self.threads:
+                return
+            self.threads = [threading.Thread(target=self._run, name=f"{self.name}-{index}", daemon=True)
+                            for index in range(self.concurrency)]
+        for thread in self.threads:
+            thread.start()
+
+    def submit(self, data):
+        """提交一个合成请求，返回可等待的 future"""
+        if not self.threads:
+            self.start()
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self.requests.put((data, loop, future, time.perf_counter()))
+        return future
+
+    def _compatible(self, first, request):
+        if self.group_key(request[0]) != self.group_key(first[0]):
+            return False
+        lengths = (max(1, self.length(first[0])), max(1, self.length(request[0])))
+        return max(lengths) <= min(lengths) * self.length_ratio
+
+    def _collect(self):
+        """把等待窗口内到达的请求都取到 pending 中"""
+        if not self.pending:
+            self.pending.append(self.requests.get())
+        deadline = time.monotonic() + self.max_batch_wait
+        compatible = sum(1 for request in self.pending if self._compatible(self.pending[0], request))
+        while compatible < self.max_batch_size and len(self.pending) < self.max_batch_size * 4:
+            try:
+                # 已在队列中的请求不用等待，超过等待时间后也照样取出
+                request = self.requests.get_nowait()
+            except queue.Empty:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    request = self.requests.get(timeout=timeout)
+                except queue.Empty:
+                    break
+            self.pending.append(request)
+            if self._compatible(self.pending[0], request):
+                compatible += 1
+
+    def _next_batch(self):
+        """取出下一批：最早的请求加上与它兼容的请求，已被取消的请求直接丢弃"""
+        self._collect()
+        first = self.pending[0]
+        batch = []
+        remaining = deque()
+        for request in self.pending:
+            if request[2].cancelled():
+                continue
+            if len(batch) < self.max_batch_size and self._compatible(first, request):
+                batch.append(request)
+            else:
+                remaining.append(request)
+        self.pending = remaining
+        return batch
+
+    def _deliver(self, request, result=None, error=None):
+        loop, future = request[1], request[2]
+        self.latencies.append(time.perf_counter() - request[3])
+        try:
+            loop.call_soon_threadsafe(_set_future, future, result, error)
+        except RuntimeError:
+            pass  # 请求方的事件循环已关闭
+
+    def _run(self):
+        while True:
+            with self.lock:
+                batch = self._next_batch()
+            if not batch:
+                continue
+            try:
+                results = self.synthesize_batch([request[0] for request in batch])
+            except Exception as e:
+                for request in batch:
+                    self._deliver(request, error=e)
+            else:
+                for request, result in zip(batch, results):
+                    if isinstance(result, Exception):
+                        self._deliver(request, error=result)
+                    else:
+                        self._deliver(request, result=result)
+            with self.lock:
+                self.batches += 1
+                self.completed += len(batch)
+
+    def stats(self):
+        latencies = sorted(self.latencies)
+        stats = {"batches": self.batches,
+                 "completed": self.completed,
+                 "average_batch_size": self.completed / self.batches if self.batches else 0.0,
+                 "queued": self.requests.qsize() + len(self.pending)}
+        if latencies:
+            stats["latency_p50_ms"] = latencies[len(latencies) // 2] * 1000
+            stats["latency_p95_ms"] = latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))] * 1000
+        return stats
+
+    def summary(self):
+        stats = self.stats()
+        summary = (f"TTS 合批: {stats['batches']} 批, {stats['completed']} 句, "
+                   f"平均每批 {stats['average_batch_size']:.2f} 句, 排队 {stats['queued']}")
+        if "latency_p50_ms" in stats:
+            summary += f", 延迟 p50 {stats['latency_p50_ms']:.0f} ms / p95 {stats['latency_p95_ms']:.0f} ms"
+        return summary
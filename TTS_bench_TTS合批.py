@@ -0,0 +1,94 @@
+# TTS_bench_TTS合批.py
+# 测量 TTS 合批的吞吐量和延迟曲线：多个并发会话逐句提交合成，扫描单批句子数和等待时间
+#
+# 使用模拟合成器，只在 CPU 上运行：每次调用有固定开销，按批内最长句子填充后计算，
+# 批内每多一句只增加一小部分耗时，近似 GPU 上批量推理的特点。
+import argparse
+import asyncio
+import logging
+import random
+import time
+import numpy as np
+from TTS_audio_frame import AudioFrame
+from TTS_batching import TTSBatcher
+
+logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(message)s")
+logger = logging.getLogger(__name__)
+
+SAMPLE_RATE = 32000
+SAMPLES_PER_CHAR = SAMPLE_RATE // 5  # 模拟语速：每字 0.2 秒
+
+
+class StubSynthesizer:
+    """模拟合成器：耗时 = 固定开销 + 每字耗时 × 最长句子字数 × (1 + 批内额外系数 × (句子数 - 1))"""
+
+    def __init__(self, overhead_ms, per_char_ms, batch_cost):
+        self.overhead = overhead_ms / 1000
+        self.per_char = per_char_ms / 1000
+        self.batch_cost = batch_cost
+
+    def synthesize_batch(self, batch):
+        longest = max(len(data["text"]) for data in batch)
+        time.sleep(self.overhead + self.per_char * longest * (1 + self.batch_cost * (len(batch) - 1)))
+        # 按最长句子填充生成，再按各句长度截取
+        t = np.arange(longest * SAMPLES_PER_CHAR) / SAMPLE_RATE
+        padded = (np.sin(2 * np.pi * 220 * t) * 8000).astype(np.int16)
+        return [AudioFrame(padded[:len(data["text"]) * SAMPLES_PER_CHAR], SAMPLE_RATE) for data in batch]
+
+
+def make_sentences(count, rng):
+    return ["字" * rng.randint(6, 24) for _ in range(count)]
+
+
+async def session(batcher, index, sentences, characters, latencies):
+    data_character = f"角色{index % characters}"
+    for sentence in sentences:
+        start = time.perf_counter()
+        frame = await batcher.submit({"text": sentence, "character": data_character, "emotion": "default"})
+        assert len(frame.samples) == len(sentence) * SAMPLES_PER_CHAR
+        latencies.append(time.perf_counter() - start)
+
+
+async def run(args, max_batch_size, max_batch_wait_ms):
+    stub = StubSynthesizer(args.overhead, args.per_char, args.batch_cost)
+    batcher = TTSBatcher(stub.synthesize_batch, max_batch_size=max_batch_size,
+                         max_batch_wait_ms=max_batch_wait_ms, name=f"bench-{max_batch_size}-{max_batch_wait_ms}")
+    rng = random.Random(0)
+    workload = [make_sentences(args.sentences, rng) for _ in range(args.sessions)]
+    latencies = []
+    start = time.perf_counter()
+    await asyncio.gather(*(session(batcher, index, sentences, args.characters, latencies)
+                           for index, sentences in enumerate(workload)))
+    elapsed = time.perf_counter() - start
+    latencies.sort()
+    stats = batcher.stats()
+    return {"throughput": len(latencies) / elapsed,
+            "p50": latencies[len(latencies) // 2] * 1000,
+            "p95": latencies[int(len(latencies) * 0.95)] * 1000,
+            "batch": stats["average_batch_size"]}
+
+
+def main(args):
+    logger.info(f"{args.sessions} 个会话 x {args.sentences} 句, {args.characters} 个角色, "
+                f"固定开销 {args.overhead} ms, 每字 {args.per_char} ms, 批内额外系数 {args.batch_cost}")
+    logger.info(f"{'单批上限':>6} {'等待ms':>6} {'句/秒':>8} {'p50 ms':>8} {'p95 ms':>8} {'平均每批':>6}")
+    for max_batch_size in args.batch_sizes:
+        for max_batch_wait_ms in args.waits:
+            if max_batch_size == 1 and max_batch_wait_ms != args.waits[0]:
+                continue  # 不合批时等待时间没有意义
+            result = asyncio.run(run(args, max_batch_size, max_batch_wait_ms))
+            logger.info(f"{max_batch_size:>10} {max_batch_wait_ms:>8} {result['throughput']:>10.1f} "
+                        f"{result['p50']:>8.0f} {result['p95']:>8.0f} {result['batch']:>10.2f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="TTS 合批吞吐量/延迟基准测试")
+    parser.add_argument("--sessions", type=int, default=8, help="并发会话数")
+    parser.add_argument("--sentences", type=int, default=10, help="每个会话的句子数")
+    parser.add_argument("--characters", type=int, default=2, help="角色数，不同角色不能合成一批")
+    parser.add_argument("--overhead", type=float, default=20.0, help="每次调用的固定开销 (毫秒)")
+    parser.add_argument("--per-char", type=float, default=1.0, help="每字耗时 (毫秒)")
+    parser.add_argument("--batch-cost", type=float, default=0.15, help="批内每多一句增加的耗时比例")
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 2, 4, 8], help="扫描的单批句子数上限")
+    parser.add_argument("--waits", type=int, nargs="+", default=[0, 10, 30, 60], help="扫描的等待时间 (毫秒)")
+    main(parser.parse_args())
@@ -0,0 +1,137 @@
+# TTS_bench_协议吞吐.py
+# 对比旧的逗号分隔协议和分帧协议的吞吐量
+#
+# 在本机启动两个回显服务器，服务端对每条请求等待 --delay 毫秒（模拟模型和合成耗时）后返回回复。
+# 旧协议没有消息边界，只能一问一答；分帧协议可以在同一连接上连续发送多条请求，回复乱序返回。
+import argparse
+import asyncio
+import logging
+import time
+from TTS_protocol import MSG_CHAT, MSG_RESULT, read_frame, write_frame
+
+logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(message)s")
+logger = logging.getLogger(__name__)
+
+
+async def legacy_server(reader, writer, delay):
+    """旧协议：每次 read(1024) 当作一条消息，按第一个逗号之后的内容回复"""
+    while True:
+        data = await reader.read(1024)
+        if not data:
+            break
+        try:
+            character, emotion, content = data.decode('utf-8').split(',', 2)
+        except (UnicodeDecodeError, ValueError):
+            # 消息被截断或粘连时无法解析
+            continue
+        await asyncio.sleep(delay)
+        writer.write(content.encode('utf-8'))
+        await writer.drain()
+    writer.close()
+
+
+async def framed_server(reader, writer, delay):
+    """分帧协议：每个请求在独立的任务中处理"""
+    async def reply(request_id, request):
+        await asyncio.sleep(delay)
+        write_frame(writer, MSG_RESULT, request_id, {"text": request["text"]})
+        await writer.drain()
+
+    tasks = set()
+    while True:
+        frame = await read_frame(reader)
+        if frame is None:
+            break
+        _, request_id, payload = frame
+        task = asyncio.create_task(reply(request_id, payload))
+        tasks.add(task)
+        task.add_done_callback(tasks.discard)
+    writer.close()
+
+
+async def run_legacy(port, messages):
+    """一问一答，回复没有边界，只能按已知长度读取"""
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    errors = 0
+    for text in messages:
+        writer.write(f"角色,default,{text}".encode('utf-8'))
+        await writer.drain()
+        expected = text.encode('utf-8')
+        try:
+            data = await asyncio.wait_for(reader.readexactly(len(expected)), timeout=2)
+        except (asyncio.TimeoutError, asyncio.IncompleteReadError):
+            errors += 1
+            break
+        if data != expected:
+            errors += 1
+    writer.close()
+    await writer.wait_closed()
+    return errors
+
+
+async def run_framed(port, messages, window):
+    """同一连接上最多 window 条请求同时在途"""
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    pending = {}
+    errors = 0
+    next_id = 1
+    sent = 0
+    while sent < len(messages) or pending:
+        while sent < len(messages) and len(pending) < window:
+            pending[next_id] = messages[sent]
+            write_frame(writer, MSG_CHAT, next_id, {"character": "角色", "emotion": "default",
+                                                    "text": messages[sent]})
+            next_id += 1
+            sent += 1
+        await writer.drain()
+        frame = await read_frame(reader)
+        if frame is None:
+            break
+        _, request_id, payload = frame
+        if pending.pop(request_id, None) != payload.get("text"):
+            errors += 1
+    writer.close()
+    await writer.wait_closed()
+    return errors
+
+
+def report(name, count, elapsed, errors):
+    logger.info(f"{name:<16} {count / elapsed:10.1f} 请求/秒, 平均 {elapsed / count * 1000:7.2f} ms/请求, 错误 {errors}")
+
+
+async def main(args):
+    delay = args.delay / 1000
+    legacy = await asyncio.start_server(lambda r, w: legacy_server(r, w, delay), '127.0.0.1', 0)
+    framed = await asyncio.start_server(lambda r, w: framed_server(r, w, delay), '127.0.0.1', 0)
+    legacy_port = legacy.sockets[0].getsockname()[1]
+    framed_port = framed.sockets[0].getsockname()[1]
+
+    text = ("你好，请介绍一下你自己。" * (args.size // 12 + 1))[:args.size]
+    messages = [f"{i}:{text}" for i in range(args.count)]
+    logger.info(f"{args.count} 条请求, 每条约 {len(text.encode('utf-8'))} 字节, 服务端处理 {args.delay} ms")
+
+    start = time.perf_counter()
+    errors = await run_legacy(legacy_port, messages)
+    report("旧协议", args.count, time.perf_counter() - start, errors)
+
+    start = time.perf_counter()
+    errors = await run_framed(framed_port, messages, 1)
+    report("分帧(一问一答)", args.count, time.perf_counter() - start, errors)
+
+    start = time.perf_counter()
+    errors = await run_framed(framed_port, messages, args.window)
+    report(f"分帧(并发 {args.window})", args.count, time.perf_counter() - start, errors)
+
+    legacy.close()
+    framed.close()
+    await legacy.wait_closed()
+    await framed.wait_closed()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="对比旧协议与分帧协议的吞吐量")
+    parser.add_argument("--count", type=int, default=500, help="请求数")
+    parser.add_argument("--size", type=int, default=60, help="每条消息的字符数")
+    parser.add_argument("--delay", type=float, default=2.0, help="服务端每条请求的处理时间 (毫秒)")
+    parser.add_argument("--window", type=int, default=16, help="分帧协议同时在途的请求数")
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,108 @@
+# TTS_bench_文本前端.py
+# 测量文本前端每个字的处理时间，对比不使用缓存和使用词级/句级缓存
+#
+# 优先使用 GPT-SoVITS 的 text.cleaner.clean_text；不可用时用 jieba + pypinyin；
+# 两者都没有安装时用一个按字计算耗时的模拟前端，只用于比较缓存本身的效果。
+import argparse
+import hashlib
+import logging
+import random
+import time
+from TTS_text_frontend import LRUMemo, TextFrontendMemo, memoize, SENTENCE_CACHE_SIZE
+
+logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(message)s")
+logger = logging.getLogger(__name__)
+
+# 模拟模型回复用到的词汇和句式
+WORDS = ["今天", "天气", "很好", "我们", "可以", "一起", "出去", "散步", "你好", "请问", "有什么",
+         "需要", "帮助", "的吗", "这个", "问题", "非常", "有趣", "首先", "其次", "最后", "总之",
+         "建议", "你", "多喝水", "注意", "休息", "2024年", "3月", "15日", "温度", "25度", "左右"]
+COMMON_SENTENCES = ["你好，请问有什么可以帮助你的吗？", "好的，我明白了。", "当然可以。",
+                    "希望对你有帮助！", "还有其他问题吗？", "没问题，我们继续。"]
+
+
+def make_corpus(count, repeat_ratio, seed=0):
+    """生成句子序列：一部分是常见句子原样重复，其余由常用词随机组合"""
+    rng = random.Random(seed)
+    corpus = []
+    for _ in range(count):
+        if rng.random() < repeat_ratio:
+            corpus.append(rng.choice(COMMON_SENTENCES))
+        else:
+            corpus.append("".join(rng.choice(WORDS) for _ in range(rng.randint(4, 12))) + "。")
+    return corpus
+
+
+def load_frontend():
+    """返回 (名称, 整句前端函数, 词级函数所在模块和名称)；为 None 时使用 TextFrontendMemo 的默认包装列表"""
+    try:
+        from text.cleaner import clean_text
+        return "GPT-SoVITS clean_text", lambda sentence: clean_text(sentence, "zh"), None
+    except Exception:
+        pass
+    try:
+        import jieba
+        import pypinyin
+        jieba.initialize()
+        return ("jieba + pypinyin",
+                lambda sentence: [pypinyin.lazy_pinyin(word) for word in jieba.lcut(sentence)],
+                (pypinyin, "lazy_pinyin"))
+    except Exception:
+        pass
+    return "模拟前端", _simulated_frontend, (None, "_simulated_g2p")
+
+
+def _simulated_g2p(word):
+    """模拟 G2P：每个字做若干次哈希"""
+    digest = word.encode("utf-8")
+    for _ in range(200 * len(word)):
+        digest = hashlib.md5(digest).digest()
+    return digest.hex()[:8]
+
+
+def _simulated_frontend(sentence):
+    words = [sentence[i:i + 2] for i in range(0, len(sentence), 2)]
+    return [_simulated_g2p(word) for word in words]
+
+
+def measure(frontend, corpus):
+    characters = sum(len(sentence) for sentence in corpus)
+    start = time.perf_counter()
+    for sentence in corpus:
+        frontend(sentence)
+    return (time.perf_counter() - start) / characters * 1e6
+
+
+def main(args):
+    name, frontend, word_target = load_frontend()
+    corpus = make_corpus(args.count, args.repeat)
+    logger.info(f"前端: {name}, {len(corpus)} 句, 共 {sum(len(s) for s in corpus)} 字, 整句重复比例 {args.repeat:.0%}")
+
+    # 预热（加载词典等）后再计时
+    for sentence in corpus[:10]:
+        frontend(sentence)
+    before = measure(frontend, corpus)
+    logger.info(f"不使用缓存: {before:8.2f} µs/字")
+
+    frontend_memo = TextFrontendMemo()
+    word_memo = frontend_memo.memos["word"]
+    if word_target is None:
+        frontend_memo.install_modules()
+    else:
+        module, attr = word_target
+        namespace = globals() if module is None else vars(module)
+        namespace[attr] = memoize(namespace[attr], word_memo)
+    sentence_memo = LRUMemo("sentence", SENTENCE_CACHE_SIZE)
+    memoized = memoize(frontend, sentence_memo)
+    after = measure(memoized, corpus)
+    logger.info(f"使用缓存:   {after:8.2f} µs/字, 加速 {before / after:.1f} 倍")
+    for memo in (word_memo, sentence_memo):
+        stats = memo.stats()
+        logger.info(f"  {memo.name:<8} 命中率 {stats['hit_rate']:.1%}, {stats['entries']} 条")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="文本前端缓存基准测试")
+    parser.add_argument("--count", type=int, default=2000, help="句子数")
+    parser.add_argument("--repeat", type=float, default=0.3, help="原样重复的常见句子比例")
+    main(parser.parse_args())
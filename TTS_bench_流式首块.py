@@ -0,0 +1,50 @@
+# TTS_bench_流式首块.py
+# 对每个角色测量流式合成的首块延迟和整句耗时，不使用音频缓存
+import argparse
+import asyncio
+import logging
+import time
+from TTS_gptsovits_voice import get_characters_and_emotions, stream_audio_chunks, stream_latency, STREAM_CHUNK_MS
+
+logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(message)s")
+logger = logging.getLogger(__name__)
+
+SENTENCES = ["你好，很高兴见到你。", "今天天气不错，我们出去走走吧。", "这个问题有点复杂，让我想一想再回答你。"]
+
+
+async def measure(character, emotion, sentence, chunk_ms):
+    start = time.perf_counter()
+    first_chunk = None
+    duration = 0.0
+    async for chunk in stream_audio_chunks({"text": sentence, "character": character, "emotion": emotion},
+                                           chunk_ms, use_cache=False):
+        if first_chunk is None:
+            first_chunk = time.perf_counter() - start
+        duration += chunk.duration
+    return first_chunk, time.perf_counter() - start, duration
+
+
+async def main(args):
+    characters = get_characters_and_emotions()
+    if args.character:
+        characters = {name: characters[name] for name in args.character if name in characters}
+    logger.info(f"{'角色':<12} {'首块 ms':>8} {'整句 ms':>8} {'音频 s':>7} {'首块占比':>6}")
+    for character, emotions in characters.items():
+        emotion = emotions[0] if emotions else "default"
+        # 第一次合成包含模型加载，不计入结果
+        await measure(character, emotion, SENTENCES[0], args.chunk_ms)
+        results = [await measure(character, emotion, sentence, args.chunk_ms)
+                   for _ in range(args.rounds) for sentence in SENTENCES]
+        first = sum(result[0] for result in results) / len(results)
+        full = sum(result[1] for result in results) / len(results)
+        duration = sum(result[2] for result in results) / len(results)
+        logger.info(f"{character:<12} {first * 1000:>8.0f} {full * 1000:>8.0f} {duration:>7.2f} {first / full:>8.0%}")
+    logger.info(stream_latency.summary())
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="流式合成首块延迟基准测试")
+    parser.add_argument("--character", nargs="*", help="只测量这些角色，默认测量全部")
+    parser.add_argument("--rounds", type=int, default=2, help="每个角色重复测量的轮数")
+    parser.add_argument("--chunk-ms", type=int, default=STREAM_CHUNK_MS, help="每块音频的长度 (毫秒)")
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,140 @@
+# TTS_character_registry.py
+# 角色和情感索引：启动时扫描一次 trained 目录，之后按目录和配置文件的修改时间增量刷新
+import os
+import json
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# 索引设置
+TRAINED_DIR = os.path.join(os.getcwd(), "trained")
+CONFIG_NAME = "infer_config.json"
+REFRESH_INTERVAL_S = 2.0  # 两次检查修改时间的最小间隔，频繁查询时只读内存
+
+
+class CharacterRegistry:
+    """角色注册表，服务端和命令行入口共用
+
+    每个目录记录修改时间：目录中增删子目录或文件时只重新扫描该目录，
+    配置文件按自身修改时间重新解析，刷新时不再遍历和解析整个目录树。
+    按角色名查询为字典查找。
+    """
+
+    def __init__(self, trained_dir=TRAINED_DIR, refresh_interval=REFRESH_INTERVAL_S):
+        self.trained_dir = trained_dir
+        self.refresh_interval = refresh_interval
+        self.lock = threading.RLock()
+        self.dir_mtimes = {}  # 目录 -> 修改时间
+        self.configs = {}  # 配置文件路径 -> (修改时间, 角色名)，解析失败时角色名为 None
+        self.emotions = {}  # 角色名 -> 情感列表
+        self.paths = {}  # 角色名 -> 角色目录
+        self.checked_at = None
+        self.reloads = 0  # 解析配置文件的次数
+
+    def _stat_mtime(self, path):
+        try:
+            return os.stat(path).st_mtime_ns
+        except OSError:
+            return None
+
+    def _scan_dir(self, path):
+        """扫描一个目录及其中尚未记录的子目录"""
+        mtime = self._stat_mtime(path)
+        if mtime is None:
+            return
+        self.dir_mtimes[path] = mtime
+        try:
+            entries = list(os.scandir(path))
+        except OSError as e:
+            logger.error(f"无法读取目录 {path}: {e}")
+            return
+        for entry in entries:
+            if entry.is_dir() and entry.path not in self.dir_mtimes:
+                self._scan_dir(entry.path)
+            elif entry.name == CONFIG_NAME and entry.path not in self.configs:
+                self._load_config(entry.path)
+
+    def _load_config(self, config_file):
+        mtime = self._stat_mtime(config_file)
+        character_dir = os.path.dirname(config_file)
+        character_name = os.path.basename(character_dir)
+        self.reloads += 1
+        try:
+            with open(config_file, 'r', encoding='utf-8') as f:
+                config = json.load(f)
+            emotion_list = list(config.get('emotion_list', {}).keys()) or ["default"]
+        except Exception as e:
+            logger.error(f"Error loading {config_file}: {e}")
+            # 仍然记录修改时间（例如复制到一半的文件），文件修改后按修改时间重新解析
+            if config_file in self.configs:
+                self._remove_config(config_file)
+            self.configs[config_file] = (mtime, None)
+            return
+        self.configs[config_file] = (mtime, character_name)
+        self.emotions[character_name] = emotion_list
+        self.paths[character_name] = character_dir
+
+    def _remove_config(self, config_file):
+        _, character_name = self.configs.pop(config_file)
+        if character_name is not None and self.paths.get(character_name) == os.path.dirname(config_file):
+            del self.emotions[character_name]
+            del self.paths[character_name]
+
+    def _remove_dir(self, path):
+        """目录被删除：移除它和所有子目录下的记录"""
+        prefix = path + os.sep
+        for directory in [d for d in self.dir_mtimes if d == path or d.startswith(prefix)]:
+            del self.dir_mtimes[directory]
+        for config_file in [c for c in self.configs if c.startswith(prefix)]:
+            self._remove_config(config_file)
+
+    def refresh(self, force=False):
+        """检查修改时间，只重新扫描或解析有变化的部分"""
+        with self.lock:
+            now = time.monotonic()
+            if not force and self.checked_at is not None and now - self.checked_at < self.refresh_interval:
+                return
+            self.checked_at = now
+            if not self.dir_mtimes:
+                self._scan_dir(self.trained_dir)
+                logger.info(f"角色索引: {len(self.emotions)} 个角色")
+                return
+            for config_file, (mtime, _) in list(self.configs.items()):
+                current = self._stat_mtime(config_file)
+                if current is None:
+                    self._remove_config(config_file)
+                elif current != mtime:
+                    logger.info(f"角色配置已修改: {config_file}")
+                    self._load_config(config_file)
+            for directory, mtime in list(self.dir_mtimes.items()):
+                if directory not in self.dir_mtimes:
+                    continue  # 已随上级目录移除
+                current = self._stat_mtime(directory)
+                if current is None:
+                    self._remove_dir(directory)
+                elif current != mtime:
+                    self._scan_dir(directory)
+
+    def characters(self):
+        """返回 {角色名: 情感列表}"""
+        self.refresh()
+        with self.lock:
+            return {name: list(emotions) for name, emotions in self.emotions.items()}
+
+    def get_emotions(self, character, default=None):
+        """返回角色的情感列表，角色不存在时返回 default"""
+        self.refresh()
+        with self.lock:
+            return self.emotions.get(character, default)
+
+    def get_path(self, character):
+        """返回角色目录，角色不存在时返回 None"""
+        self.refresh()
+        with self.lock:
+            return self.paths.get(character)
+
+
+# 全局角色注册表
+character_registry = CharacterRegistry()
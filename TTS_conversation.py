@@ -0,0 +1,197 @@
+# TTS_conversation.py
+# 多轮对话记忆：每个会话一份对话状态，固定前缀 + 按 token 预算截取的近期对话，较早的对话在后台压缩为摘要
+import asyncio
+import logging
+from collections import deque
+from TTS_run_model import get_response, get_response_stream
+from TTS_scheduler import request_scheduler, STAGE_LLM
+
+logger = logging.getLogger(__name__)
+
+# 固定前缀：系统提示词和角色设定放在最前面，每轮都完全相同，模型服务的前缀缓存可以命中
+SYSTEM_PROMPT = "你是一个语音对话助手。回答要口语化、简洁，不要使用 markdown、列表、表格或代码块。"
+PERSONA_TEMPLATE = "你现在扮演「{character}」，用这个角色的口吻和用户对话。"
+SUMMARY_TEMPLATE = "之前对话的摘要：{summary}"
+SUMMARIZE_PROMPT = ("请把下面的对话压缩为一段不超过 200 字的摘要，保留用户的身份、偏好、提到的事实和尚未完成的事项，"
+                    "只输出摘要。\n\n已有摘要：{summary}\n\n新的对话：\n{dialogue}")
+
+# token 预算
+HISTORY_TOKEN_BUDGET = 1500  # 近期对话超过该值时，在后台把较早的对话压缩进摘要
+HISTORY_HARD_LIMIT = 3000  # 摘要来不及完成时，近期对话超过该值直接丢弃最早的几轮
+SUMMARY_KEEP_RATIO = 0.5  # 压缩后近期对话保留到预算的这个比例，摘要不必每轮都更新，前缀更稳定
+SUMMARY_MAX_TOKENS = 300
+MESSAGE_OVERHEAD_TOKENS = 4  # 每条消息的角色标记等额外 token
+TURN_HISTORY = 200  # 每个会话保留的每轮 prompt token 记录数
+
+
+def estimate_tokens(text):
+    """粗略估计 token 数：汉字约 1 个 token，其他字符约 4 个一个 token"""
+    cjk = sum(1 for ch in text if "一" <= ch <= "鿿" or "　" <= ch <= "〿" or "＀" <= ch <= "￯")
+    return cjk + (len(text) - cjk + 3) // 4
+
+
+def message_tokens(messages):
+    return sum(estimate_tokens(message["content"]) + MESSAGE_OVERHEAD_TOKENS for message in messages)
+
+
+class Conversation:
+    """一个会话的对话状态
+
+    发给模型的消息依次为：固定前缀（系统提示词 + 角色设定）、摘要、近期对话、本轮提问。
+    近期对话超过 HISTORY_TOKEN_BUDGET 时启动后台任务，把最早的几轮压缩进摘要；
+    摘要完成前这些对话仍然保留，超过 HISTORY_HARD_LIMIT 才丢弃，每轮的 prompt token 因此保持平稳。
+    回复缓存的键包含完整的上下文：只有没有摘要和历史对话的第一轮（上下文只有固定前缀）读写缓存，
+    之后的轮次明确绕过缓存，"为什么？"、"继续" 这类追问总是带着历史对话请求模型。
+    """
+
+    def __init__(self, session, character=""):
+        self.session = session
+        self.character = character
+        self.summary = ""
+        self.turns = deque()  # (用户消息, 助手回复, token 数)
+        self.history_tokens = 0
+        self.summarizing = None  # 后台摘要任务
+        self.summaries = 0
+        self.dropped_turns = 0
+        self.prompt_tokens = deque(maxlen=TURN_HISTORY)  # 每轮的 (prompt token, 是否为模型服务报告的值)
+
+    def prefix(self):
+        content = SYSTEM_PROMPT
+        if self.character:
+            content += PERSONA_TEMPLATE.format(character=self.character)
+        return [{"role": "system", "content": content}]
+
+    def context(self):
+        """本轮提问之前的全部消息"""
+        messages = self.prefix()
+        if self.summary:
+            messages.append({"role": "system", "content": SUMMARY_TEMPLATE.format(summary=self.summary)})
+        for user, assistant, _ in self.turns:
+            messages.append({"role": "user", "content": user})
+            messages.append({"role": "assistant", "content": assistant})
+        return messages
+
+    async def stream_reply(self, message, max_tokens=None):
+        """带上下文向模型提问，逐个产出回复片段
+
+        回复完成时记录这一轮；被打断（任务取消或调用方提前关闭）时记录已生成的部分；出错时不记录。
+        """
+        context = self.context()
+        # 有历史对话时的回复依赖上下文，其他会话和之后的轮次不会有相同的上下文，不查也不写缓存
+        use_cache = not self.summary and not self.turns
+        usage = {}
+        parts = []
+        try:
+            async for token in get_response_stream(message, max_tokens, context=context, usage=usage,
+                                                   use_cache=use_cache):
+                parts.append(token)
+                yield token
+        except (asyncio.CancelledError, GeneratorExit):
+            self._finish_turn(message, context, usage, parts)
+            raise
+        self._finish_turn(message, context, usage, parts)
+
+    def _finish_turn(self, message, context, usage, parts):
+        """记录这一轮的 prompt token 和已生成的回复"""
+        prompt_tokens = usage.get("prompt_tokens")
+        reported = prompt_tokens is not None
+        if not reported:
+            prompt_tokens = message_tokens(context + [{"role": "user", "content": message}])
+        self.prompt_tokens.append((prompt_tokens, reported))
+        if parts:
+            self.record(message, "".join(parts))
+
+    def record(self, user, assistant):
+        tokens = message_tokens([{"content": user}, {"content": assistant}])
+        self.turns.append((user, assistant, tokens))
+        self.history_tokens += tokens
+        while self.history_tokens > HISTORY_HARD_LIMIT and len(self.turns) > 1:
+            # 摘要跟不上时的兜底：丢弃最早的一轮
+            _, _, dropped = self.turns.popleft()
+            self.history_tokens -= dropped
+            self.dropped_turns += 1
+        if self.history_tokens > HISTORY_TOKEN_BUDGET and self.summarizing is None:
+            self.summarizing = asyncio.create_task(self._summarize())
+
+    async def _summarize(self):
+        """把最早的几轮压缩进摘要，近期对话保留到预算的 SUMMARY_KEEP_RATIO"""
+        try:
+            selected = []
+            remaining = self.history_tokens
+            for turn in self.turns:
+                if remaining <= HISTORY_TOKEN_BUDGET * SUMMARY_KEEP_RATIO or len(selected) == len(self.turns) - 1:
+                    break
+                selected.append(turn)
+                remaining -= turn[2]
+            if not selected:
+                return
+            dialogue = "\n".join(f"用户：{user}\n助手：{assistant}" for user, assistant, _ in selected)
+            prompt = SUMMARIZE_PROMPT.format(summary=self.summary or "无", dialogue=dialogue)
+            async with request_scheduler.slot(STAGE_LLM, self.session):
+                summary = await get_response(prompt, SUMMARY_MAX_TOKENS, use_cache=False)
+            # 摘要期间可能有轮次因超过硬上限被丢弃，只移除仍在最前面的已摘要轮次
+            for turn in selected:
+                if self.turns and self.turns[0] is turn:
+                    self.turns.popleft()
+                    self.history_tokens -= turn[2]
+            self.summary = summary.strip()
+            self.summaries += 1
+            logger.info(f"会话 {self.session} 已压缩 {len(selected)} 轮对话, 摘要约 {estimate_tokens(self.summary)} token")
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.warning(f"会话 {self.session} 对话摘要失败: {e}")
+        finally:
+            self.summarizing = None
+
+    def close(self):
+        if self.summarizing is not None:
+            self.summarizing.cancel()
+
+    def stats(self):
+        values = [tokens for tokens, _ in self.prompt_tokens]
+        return {"character": self.character,
+                "turns": len(self.turns),
+                "history_tokens": self.history_tokens,
+                "summary_tokens": estimate_tokens(self.summary),
+                "summaries": self.summaries,
+                "dropped_turns": self.dropped_turns,
+                "last_prompt_tokens": values[-1] if values else 0,
+                "max_prompt_tokens": max(values) if values else 0,
+                "prompt_tokens": values[-20:]}
+
+
+class ConversationStore:
+    """按会话保存对话状态：服务端每个 TCP 客户端一个会话，命令行程序整个运行期间一个会话"""
+
+    def __init__(self):
+        self.conversations = {}
+
+    def get(self, session, character=""):
+        """取得会话的对话状态；角色变化时固定前缀随之更新，已有的对话保留"""
+        conversation = self.conversations.get(session)
+        if conversation is None:
+            conversation = self.conversations[session] = Conversation(session, character)
+        conversation.character = character
+        return conversation
+
+    def close(self, session):
+        conversation = self.conversations.pop(session, None)
+        if conversation is not None:
+            conversation.close()
+
+    def stats(self):
+        return {session: conversation.stats() for session, conversation in self.conversations.items()}
+
+    def summary(self):
+        stats = list(self.stats().values())
+        if not stats:
+            return "对话记忆: 无会话"
+        last = [item["last_prompt_tokens"] for item in stats]
+        return (f"对话记忆: {len(stats)} 个会话, 每轮 prompt token 平均 {sum(last) / len(last):.0f}, "
+                f"最大 {max(item['max_prompt_tokens'] for item in stats)}, "
+                f"摘要 {sum(item['summaries'] for item in stats)} 次")
+
+
+# 全局对话状态
+conversations = ConversationStore()
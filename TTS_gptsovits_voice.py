@@ -1,16 +1,29 @@
 # Gptsovit-tts.py
-import io
+import os
+import copy
 import numpy as np
 import logging
-import soundfile as sf
-from pygame import mixer
 from Synthesizers.base import Base_TTS_Synthesizer, Base_TTS_Task
 from importlib import import_module
 from src.common_config_manager import app_config
 import torch
 import asyncio
 import threading
-from TTS_audio_state import audio_state  # 引入音频状态管理
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from TTS_text_chunker import chunk_text, chunk_sizer
+from TTS_audio_cache import audio_cache
+from TTS_audio_frame import AudioFrame
+from TTS_audio_output import audio_output
+from TTS_playback_scheduler import playback_scheduler, PRIORITY_NORMAL
+from TTS_scheduler import request_scheduler, STAGE_TTS
+from TTS_character_registry import character_registry
+from TTS_model_residency import ModelResidency
+from TTS_prompt_cache import PromptFeatureCache
+from TTS_text_frontend import text_frontend_memo
+from TTS_batching import TTSBatcher, TTS_MAX_BATCH_SIZE, TTS_MAX_BATCH_WAIT_MS
+from TTS_synthesis_worker import SynthesisWorkerPool, TTS_WORKER_PROCESSES, TTS_WORKER_QUEUE_SIZE
 
 # 初始化日志
 logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(message)s")
@@ -30,30 +43,179 @@ synthesizer_module = import_module(f"Synthesizers.{synthesizer_name}")
 TTS_Synthesizer = synthesizer_module.TTS_Synthesizer
 TTS_Task = synthesizer_module.TTS_Task
 
-# 创建合成器实例
-tts_synthesizer: Base_TTS_Synthesizer = TTS_Synthesizer(debug_mode=True)
+# 合成器不能被多个线程同时使用：在服务进程内合成时，合批线程和流式合成线程共用这把锁；
+# 模型加载线程只在复制合成器和切换角色时短暂持有，读取权重在锁外进行
+synthesis_lock = threading.Lock()
 
-# 初始化音频播放库
-mixer.init()
-characters_and_emotions_dict = {}
+# 共享合成流水线上各角色自己的模型（GPT 和 SoVITS），BERT、CNHubert 等其余模型所有角色共用
+WEIGHT_ATTRIBUTES = ("t2s_model", "vits_model")
+PIPELINE_ATTRIBUTES = ("tts_pipline", "tts_pipeline", "tts_instance", "tts")
+
+shared_synthesizer = None  # 所有角色共用的合成器，第一次加载角色时创建
+default_weights = None  # 合成器创建时加载的默认权重，未指定角色时使用
+active_weights = None  # 当前切换到共享合成器上的角色
+
+def _pipeline(synthesizer):
+    for name in PIPELINE_ATTRIBUTES:
+        pipeline = getattr(synthesizer, name, None)
+        if pipeline is not None:
+            return pipeline
+    return None
+
+class CharacterWeights:
+    """一个角色在共享合成器上的状态：流水线上的 GPT / SoVITS 模型和配置，以及合成器上的角色设置
+
+    加载角色后立即记录，之后切换回该角色只需写回这些引用，不重新读取权重。
+    """
+
+    def __init__(self, character, synthesizer):
+        self.character = character
+        pipeline = _pipeline(synthesizer)
+        self.state = {name: value for name, value in vars(synthesizer).items() if name not in PIPELINE_ATTRIBUTES}
+        self.weights = {name: getattr(pipeline, name) for name in WEIGHT_ATTRIBUTES if hasattr(pipeline, name)}
+        # 加载下一个角色时流水线会原地修改配置（采样率、权重路径等），这里保存副本
+        configs = getattr(pipeline, "configs", None)
+        self.configs = copy.copy(configs) if configs is not None else None
+
+    def apply(self, synthesizer):
+        vars(synthesizer).update(self.state)
+        pipeline = _pipeline(synthesizer)
+        for name, value in self.weights.items():
+            setattr(pipeline, name, value)
+        if self.configs is not None:
+            pipeline.configs = copy.copy(self.configs)
+
+def _loader_copy():
+    """浅复制共享合成器和它的流水线，调用方持有 synthesis_lock
+
+    副本与共享合成器引用同一组共享模型；副本上加载角色时合成器创建新的 GPT / SoVITS 模型
+    并只替换副本上的引用，共享合成器上正在使用的模型不受影响。
+    """
+    loader = copy.copy(shared_synthesizer)
+    pipeline = _pipeline(shared_synthesizer)
+    if pipeline is None:
+        return loader
+    loader_pipeline = copy.copy(pipeline)
+    configs = getattr(pipeline, "configs", None)
+    if configs is not None:
+        loader_pipeline.configs = copy.copy(configs)
+    for name in PIPELINE_ATTRIBUTES:
+        if getattr(loader, name, None) is pipeline:
+            setattr(loader, name, loader_pipeline)
+    return loader
+
+def _load_synthesizer(character):
+    """加载一个角色的权重，返回该角色的 CharacterWeights
+
+    权重读取在共享合成器的副本上进行，不持有 synthesis_lock，其他角色照常合成；
+    之后由 _activate 在锁内把模型引用切换到共享合成器上。
+    被卸载的角色只是不再被引用，它的 GPT / SoVITS 模型随之释放；共享的模型只加载一次。
+    文本前端缓存和参考音频特征也在这里第一次准备：只有实际合成的进程需要它们，
+    使用工作进程时服务进程和导入本模块的子进程都不做这些工作。
+    """
+    global shared_synthesizer, default_weights, active_weights
+    with synthesis_lock:
+        if shared_synthesizer is None:
+            # 文本前端（分词、G2P、数字转写）的结果按词和按句缓存
+            text_frontend_memo.install_modules()
+            prompt_features.preload()
+            shared_synthesizer = TTS_Synthesizer(debug_mode=True)
+            text_frontend_memo.install(shared_synthesizer)
+            default_weights = active_weights = CharacterWeights("", shared_synthesizer)
+        if not character:
+            return default_weights
+        if getattr(shared_synthesizer, "load_character", None) is None:
+            return CharacterWeights(character, shared_synthesizer)
+        loader = _loader_copy()
+    loader.load_character(character)
+    return CharacterWeights(character, loader)
+
+def _activate(weights):
+    """把角色切换到共享合成器上并返回合成器；调用方持有 synthesis_lock"""
+    global active_weights
+    if active_weights is not weights:
+        weights.apply(shared_synthesizer)
+        active_weights = weights
+    return shared_synthesizer
+
+def _weights_size(character):
+    """按角色目录中 GPT / SoVITS 权重文件的大小估计该角色常驻的占用"""
+    character_dir = character_registry.get_path(character)
+    if character_dir is None:
+        return 0
+    size = 0
+    for root, _, files in os.walk(character_dir):
+        for name in files:
+            if name.endswith((".ckpt", ".pth")):
+                size += os.path.getsize(os.path.join(root, name))
+    return size
+
+def _release_cuda_memory():
+    if torch.cuda.is_available():
+        torch.cuda.empty_cache()
+
+# 常驻角色的 GPT / SoVITS 模型在显存预算内按 LRU 卸载。
+# 占用按权重文件大小估计：加载期间其他线程可能正在合成，显存差值不准确，共享模型也不计入
+model_residency = ModelResidency(
+    _load_synthesizer,
+    estimate=_weights_size,
+    after_evict=_release_cuda_memory,
+)
+
+# 各情感的参考音频特征只提取一次，保存在 cache 目录中
+prompt_features = PromptFeatureCache(character_registry, version_of=audio_cache.character_version, device=device)
+
+def prefetch_character(character):
+    """客户端选中角色时在后台预加载，首个请求不再等待加载权重"""
+    if character_registry.get_emotions(character) is None:
+        return False
+    if TTS_WORKER_PROCESSES:
+        return synthesis_workers.prefetch(character)
+    return model_residency.prefetch(character)
 
 # # 当前音频播放对象和锁
 # current_sound = None
 # sound_lock = threading.Lock()
 
 def get_characters_and_emotions():
-    """获取角色和情感信息"""
-    global characters_and_emotions_dict
-    if not characters_and_emotions_dict:
-        characters_and_emotions_dict = tts_synthesizer.get_characters()
-    return characters_and_emotions_dict
+    """获取角色和情感信息，与服务端共用角色注册表，新增的模型无需重启即可看到"""
+    return character_registry.characters()
 
-async def get_audio(data, streaming=False):
-    """生成音频数据"""
+# 流式合成设置
+STREAM_CHUNK_MS = 200  # 流式合成每块音频的长度 (毫秒)
+STREAM_FIRST_SENTENCE = True  # 每次回复的第一句逐块流式合成，尽早开始播放；之后的句子整句合批合成
+STREAM_LATENCY_SAMPLES = 200  # 每个角色保留的延迟记录数
+
+def synthesize(data, use_cache=True):
+    """同步生成一句完整音频"""
     if not data.get("text"):
         raise ValueError("文本不能为空")
 
+    if use_cache:
+        cached = audio_cache.get(data)
+        if cached is not None:
+            logger.info(f"\n命中音频缓存: {data['text']}")
+            return cached
+
+    # 在合成锁之外取得角色权重：等待加载时不占用合成锁，其他角色的合成不受影响
     try:
+        weights = model_residency.get(data.get("character", ""))
+    except Exception as e:
+        logger.error(f"\n错误: {e}")
+        raise RuntimeError(f"\n错误: {e}")
+    with synthesis_lock:
+        return _synthesize_one(_activate(weights), data, use_cache)
+
+def _synthesize_one(tts_synthesizer, data, use_cache):
+    """用已切换到该角色的合成器生成一句完整音频；调用方持有 synthesis_lock"""
+    if not data.get("text"):
+        raise ValueError("文本不能为空")
+    try:
+        character = data.get("character", "")
+        emotion = data.get("emotion", "default")
+        # 切换情感时写回已缓存的参考音频特征，合成器只需处理目标文本
+        prompt_features.prepare(tts_synthesizer, character, emotion)
+
         # 确保 task 在设备上
         task: Base_TTS_Task = tts_synthesizer.params_parser(data)
         
@@ -65,75 +227,501 @@ async def get_audio(data, streaming=False):
         
         # 检查生成器输出
         gen = tts_synthesizer.generate(task, return_type="numpy")
-
-        if not streaming:
-            audio_data = next(gen)
-            logger.info(f"\n生成的音频数据（元组）: {audio_data}, 长度: {len(audio_data)}")
-            return audio_data
-        else:
-            # 流式音频，逐块返回
-            return b''.join(chunk for chunk in gen)
+        audio_frame = AudioFrame.from_tuple(next(gen))
+        prompt_features.store(tts_synthesizer, character, emotion)
+        logger.info(f"\n生成的音频: 采样率 {audio_frame.sample_rate}, 时长 {audio_frame.duration:.2f} s")
+        if use_cache:
+            audio_cache.put(data, audio_frame)
+        return audio_frame
 
     except Exception as e:
         logger.error(f"\n错误: {e}")
         raise RuntimeError(f"\n错误: {e}")
 
-# 初始化音频播放库
-mixer.init(frequency=32000, size=-16, channels=2, buffer=256)  # 调整缓冲区大小
+def synthesize_stream(data, timing=None):
+    """逐段产出合成器生成的音频 (AudioFrame)，不读写音频缓存；合成器不支持流式时只产出一段完整音频
+
+    传入 timing 时，合成器生成音频的耗时（不含等待锁、加载模型和调用方处理每段的时间）写入 timing["seconds"]。
+    """
+    if not data.get("text"):
+        raise ValueError("文本不能为空")
+    character = data.get("character", "")
+    emotion = data.get("emotion", "default")
+    weights = model_residency.get(character)
+    with synthesis_lock:
+        tts_synthesizer = _activate(weights)
+        prompt_features.prepare(tts_synthesizer, character, emotion)
+        # 合成器按 stream 参数逐段生成，每段是一个 (采样率, 数组) 元组
+        task: Base_TTS_Task = tts_synthesizer.params_parser(dict(data, stream=True))
+        if hasattr(task, 'to'):
+            task = task.to(device)
+        seconds = 0.0
+        generating = time.perf_counter()
+        for audio_data in tts_synthesizer.generate(task, return_type="numpy"):
+            seconds += time.perf_counter() - generating
+            yield _to_frame(audio_data, 32000)
+            generating = time.perf_counter()
+        seconds += time.perf_counter() - generating
+        if timing is not None:
+            timing["seconds"] = seconds
+        prompt_features.store(tts_synthesizer, character, emotion)
 
-async def play_audio(audio_data, sample_rate=32000):
-    """播放生成的音频数据"""
-    global current_sound
+def synthesize_batch(batch, use_cache=True, timing=None):
+    """合成一批同一角色和情感的句子，返回与请求一一对应的 AudioFrame 或异常
 
-    logger.info(f"\n音频数据类型: {type(audio_data)}, 长度: {len(audio_data)}")
+    合成器提供 generate_batch 时未命中缓存的句子一次合成（由合成器填充对齐），
+    否则逐句合成，仍然共享合批线程和缓存。
+    传入 timing 时，持有合成锁期间的合成耗时（不含排队和加载模型）写入 timing["seconds"]。
+    """
+    results = [audio_cache.get(data) if use_cache and data.get("text") else None for data in batch]
+    misses = [index for index, result in enumerate(results) if result is None]
+    if not misses:
+        return results
+    try:
+        weights = model_residency.get(batch[0].get("character", ""))
+    except Exception as e:
+        return [RuntimeError(f"\n错误: {e}") if result is None else result for result in results]
+    with synthesis_lock:
+        start = time.perf_counter()
+        results = _synthesize_batch(_activate(weights), batch, results, misses, use_cache)
+        if timing is not None:
+            timing["seconds"] = time.perf_counter() - start
+        return results
 
+def _synthesize_batch(tts_synthesizer, batch, results, misses, use_cache):
+    character = batch[0].get("character", "")
+    emotion = batch[0].get("emotion", "default")
+    generate_batch = getattr(tts_synthesizer, "generate_batch", None)
+    if len(misses) > 1 and generate_batch is not None:
+        try:
+            prompt_features.prepare(tts_synthesizer, character, emotion)
+            tasks = [tts_synthesizer.params_parser(batch[index]) for index in misses]
+            tasks = [task.to(device) if hasattr(task, 'to') else task for task in tasks]
+            outputs = generate_batch(tasks, return_type="numpy")
+            prompt_features.store(tts_synthesizer, character, emotion)
+            for index, output in zip(misses, outputs):
+                results[index] = AudioFrame.from_tuple(output)
+                if use_cache:
+                    audio_cache.put(batch[index], results[index])
+            logger.info(f"\n批量合成 {len(misses)} 句")
+            return results
+        except Exception as e:
+            logger.error(f"\n批量合成失败，改为逐句合成: {e}")
+    for index in misses:
+        try:
+            results[index] = _synthesize_one(tts_synthesizer, batch[index], use_cache)
+        except Exception as e:
+            results[index] = e
+    return results
+
+def _worker_synthesize_batch(batch, timing):
+    """在 TTS 工作进程中执行：只合成，音频缓存由服务进程读写"""
+    return synthesize_batch(batch, use_cache=False, timing=timing)
+
+def _worker_stream(data, timing):
+    """在 TTS 工作进程中执行：流式合成一句"""
+    return synthesize_stream(data, timing)
+
+def _worker_prefetch(character):
+    """在 TTS 工作进程中执行：后台加载角色模型"""
+    model_residency.prefetch(character)
+
+def _worker_stats():
+    """本进程中角色模型常驻、参考音频特征和文本前端缓存的统计；在工作进程中执行时回报给服务进程"""
+    return {"models": model_residency.stats(),
+            "prompt_features": prompt_features.stats(),
+            "text_frontend": text_frontend_memo.stats()}
+
+# 模型加载和推理放在工作进程中，服务进程的事件循环不受推理和 GIL 影响；第一次合成时启动
+synthesis_workers = SynthesisWorkerPool(_worker_synthesize_batch, stream=_worker_stream, prefetch=_worker_prefetch,
+                                        stats=_worker_stats)
+
+def synthesis_stats():
+    """实际执行合成的进程中的统计：使用工作进程时为各工作进程回报的汇总，尚未回报时为 None"""
+    if TTS_WORKER_PROCESSES:
+        return synthesis_workers.stats()["synthesis"]
+    return _worker_stats()
+
+def synthesis_summary():
+    stats = synthesis_stats()
+    if stats is None:
+        return "合成统计: 工作进程尚未回报"
+    return "\n".join([model_residency.summary(stats["models"]),
+                      prompt_features.summary(stats["prompt_features"]),
+                      text_frontend_memo.summary(stats["text_frontend"])])
+
+def _synthesize_cached(batch):
+    """在服务进程的合批线程中执行：先查音频缓存，未命中的句子交给工作进程（或在本进程）合成
+
+    合成线程或工作进程报告的纯合成耗时和音频时长交给 chunk_sizer，用于估计各角色的实时率；
+    在工作进程队列中排队和加载模型的时间不计入。
+    """
+    results = [audio_cache.get(data) if data.get("text") else None for data in batch]
+    misses = [index for index, result in enumerate(results) if result is None]
+    if not misses:
+        return results
+    timing = {}
+    try:
+        if TTS_WORKER_PROCESSES:
+            outputs = synthesis_workers.run([batch[index] for index in misses], timing)
+        else:
+            outputs = synthesize_batch([batch[index] for index in misses], use_cache=False, timing=timing)
+    except Exception as e:
+        outputs = [e] * len(misses)
+    chars = 0
+    duration = 0.0
+    for index, output in zip(misses, outputs):
+        results[index] = output
+        if not isinstance(output, Exception):
+            audio_cache.put(batch[index], output)
+            chars += len(batch[index]["text"])
+            duration += output.duration
+    if "seconds" in timing:
+        chunk_sizer.observe(batch[0].get("character", ""), timing["seconds"], duration, chars)
+    return results
+
+def _stream_synthesis(data, on_chunk, timing):
+    """在流式合成线程中执行：合成器每生成一段音频就调用 on_chunk，阻塞到合成结束
+
+    返回从开始合成到回报最后一段音频的秒数，不受消费方播放速度的影响；
+    合成器本身的耗时由合成线程或工作进程写入 timing["seconds"]。
+    """
+    start = time.perf_counter()
+    reported = [start]
+
+    def report(frame):
+        reported[0] = time.perf_counter()
+        on_chunk(frame)
+
+    if TTS_WORKER_PROCESSES:
+        synthesis_workers.stream(data, report, timing)
+    else:
+        for frame in synthesize_stream(data, timing):
+            report(frame)
+    return reported[0] - start
+
+async def _synthesis_frames(data, timing):
+    """在流式合成线程中合成一句，逐段产出合成器回报的 AudioFrame
+
+    结束后整句耗时写入 timing["full_clip"]，纯合成耗时写入 timing["seconds"]。
+    """
+    loop = asyncio.get_running_loop()
+    frames = asyncio.Queue()
+    done = loop.run_in_executor(stream_executor, _stream_synthesis, data,
+                                lambda frame: loop.call_soon_threadsafe(frames.put_nowait, frame), timing)
+    # 线程中已回报的音频都先于结束标记进入队列
+    done.add_done_callback(lambda _: frames.put_nowait(None))
+    while True:
+        frame = await frames.get()
+        if frame is None:
+            break
+        yield frame
+    # 合成中的异常在这里抛出
+    timing["full_clip"] = await done
+
+class StreamLatency:
+    """按角色记录流式合成的首块延迟和整句耗时"""
+
+    def __init__(self, samples=STREAM_LATENCY_SAMPLES):
+        self.samples = samples
+        self.lock = threading.Lock()
+        self.records = {}  # 角色 -> deque[(首块延迟, 整句耗时, 音频时长)]
+
+    def record(self, character, first_chunk, full_clip, duration):
+        with self.lock:
+            self.records.setdefault(character, deque(maxlen=self.samples)).append((first_chunk, full_clip, duration))
+
+    def stats(self):
+        with self.lock:
+            records = {character: list(values) for character, values in self.records.items()}
+        stats = {}
+        for character, values in records.items():
+            first = sorted(value[0] for value in values)
+            full = sorted(value[1] for value in values)
+            stats[character] = {"count": len(values),
+                                "first_chunk_p50_ms": first[len(first) // 2] * 1000,
+                                "full_clip_p50_ms": full[len(full) // 2] * 1000,
+                                "audio_seconds": sum(value[2] for value in values)}
+        return stats
+
+    def summary(self):
+        stats = self.stats()
+        if not stats:
+            return "流式合成: 无"
+        parts = [f"{character or '默认'} 首块 p50 {item['first_chunk_p50_ms']:.0f} ms / 整句 p50 {item['full_clip_p50_ms']:.0f} ms "
+                 f"({item['count']} 句)" for character, item in stats.items()]
+        return "流式合成: " + "; ".join(parts)
+
+stream_latency = StreamLatency()
+# 流式合成在线程中等待工作进程回报，不占用事件循环；在服务进程内合成时只需一个线程
+stream_executor = ThreadPoolExecutor(max_workers=max(1, TTS_WORKER_PROCESSES * TTS_WORKER_QUEUE_SIZE),
+                                     thread_name_prefix="tts-stream")
+
+async def stream_audio_chunks(data, chunk_ms=STREAM_CHUNK_MS, session=None, use_cache=True):
+    """流式合成一句，按 chunk_ms 逐块产出 AudioFrame，可直接交给播放调度器或发送给客户端
+
+    命中音频缓存时直接切块产出；否则合成器每生成一段就切块产出，只有最后一块可能较短。
+    STAGE_TTS 资源只在合成期间占用，合成完成即释放，不等调用方播放完。
+    整句合成完后写入音频缓存。每个角色的首块延迟和整句耗时记录在 stream_latency 中。
+    音频缓存的读写（读取文件、检查模型版本）在线程池中执行，不阻塞其他会话。
+    """
+    start = time.perf_counter()
+    loop = asyncio.get_running_loop()
+    cached = await loop.run_in_executor(None, audio_cache.get, data) if use_cache else None
+    if cached is not None:
+        size = max(1, cached.sample_rate * chunk_ms // 1000)
+        for offset in range(0, len(cached), size):
+            yield cached.slice(offset, offset + size)
+        return
+
+    timing = {}
+    parts = []
+    pending = None  # 还不够一块的音频
+    first_chunk = None
+    frames = request_scheduler.hold(STAGE_TTS, session, _synthesis_frames(data, timing))
+    try:
+        async for frame in frames:
+            parts.append(frame)
+            pending = frame if pending is None else AudioFrame.concat([pending, frame])
+            size = max(1, pending.sample_rate * chunk_ms // 1000)
+            while len(pending) >= size:
+                if first_chunk is None:
+                    first_chunk = time.perf_counter() - start
+                yield pending.slice(0, size)
+                pending = pending.slice(size, len(pending))
+    finally:
+        # 调用方提前结束时立即释放资源，不等垃圾回收关闭生成器
+        await frames.aclose()
+    if pending is not None and len(pending):
+        if first_chunk is None:
+            first_chunk = time.perf_counter() - start
+        yield pending
+    if not parts:
+        return
+    audio_frame = AudioFrame.concat(parts)
+    full_clip = timing["full_clip"]
+    stream_latency.record(data.get("character", ""), first_chunk, full_clip, audio_frame.duration)
+    if "seconds" in timing:
+        chunk_sizer.observe(data.get("character", ""), timing["seconds"], audio_frame.duration, len(data["text"]))
+    if use_cache:
+        # 写入失败只记录日志，不必等待写完
+        loop.run_in_executor(None, audio_cache.put, data, audio_frame)
+
+async def get_audio(data, streaming=False):
+    """生成一句完整音频，合成在合批线程或工作进程中执行，不阻塞事件循环
+
+    streaming=True 时经流式合成路径生成后拼接；需要逐块处理时直接使用 stream_audio_chunks。
+    """
+    if streaming:
+        chunks = [chunk async for chunk in stream_audio_chunks(data)]
+        return AudioFrame.concat(chunks) if chunks else None
+    return await tts_batcher.submit(data)
+
+def _to_frame(audio_data, sample_rate):
+    """把 AudioFrame / (采样率, 数组) 元组 / 数组统一为 AudioFrame"""
+    if isinstance(audio_data, AudioFrame):
+        return audio_data
     if isinstance(audio_data, tuple):
-        sample_rate, audio_data = audio_data
-        logger.info(f"\n提取音频数据: {audio_data}, 采样率: {sample_rate}")
-
-    audio_data = np.array(audio_data)
-
-    if audio_data.ndim == 1:
-        audio_data = audio_data.reshape(-1, 1)
-    elif audio_data.ndim > 2:
-        raise ValueError("不支持的音频数据维度")
-
-    audio_buffer = io.BytesIO()
-    sf.write(audio_buffer, audio_data, sample_rate, format='WAV')
-    audio_buffer.seek(0)
-
-    # with sound_lock:
-    #     if current_sound is not None:
-    #         current_sound.stop()  # 立即停止当前音频
-    #     current_sound = mixer.Sound(audio_buffer)
-    #     current_sound.play()
-    with audio_state.sound_lock:
-        if audio_state.current_sound is not None:
-            audio_state.current_sound.stop()  # 立即停止当前音频
-        audio_state.current_sound = mixer.Sound(audio_buffer)
-        audio_state.current_sound.play()
-
-    while mixer.get_busy():
-        await asyncio.sleep(0.1)
-
-def play_audio_sync(audio_data, sample_rate=32000):
-    """同步播放生成的音频数据"""
-    asyncio.run(play_audio(audio_data, sample_rate))
+        return AudioFrame.from_tuple(audio_data)
+    audio_data = np.asarray(audio_data)
+    if audio_data.ndim > 1:
+        # 输出流为单声道，取第一个声道
+        audio_data = audio_data[:, 0]
+    return AudioFrame(audio_data, sample_rate)
+
+def _resolve(future, result):
+    if not future.done():
+        future.set_result(result)
+
+def enqueue_audio(audio_data, sample_rate=32000, priority=PRIORITY_NORMAL):
+    """把音频交给播放调度器，返回一个在播放结束时完成的 future
+
+    future 的结果为播放完毕的时刻；被 stop_now 打断时结果为 None。
+    """
+    frame = _to_frame(audio_data, sample_rate)
+    loop = asyncio.get_running_loop()
+    done = loop.create_future()
+
+    def on_done(completed):
+        try:
+            loop.call_soon_threadsafe(_resolve, done, time.perf_counter() if completed else None)
+        except RuntimeError:
+            pass  # 事件循环已关闭
+
+    playback_scheduler.enqueue(frame, priority, on_done)
+    return done
+
+async def play_audio(audio_data, sample_rate=32000, priority=PRIORITY_NORMAL):
+    """播放生成的音频数据，播放完毕返回 True，被打断返回 False"""
+    return await enqueue_audio(audio_data, sample_rate, priority) is not None
+
+class PipelineStats:
+    """记录句间空白时间，用于确认扬声器不会在还有算力时空闲"""
+
+    def __init__(self):
+        self.gaps = []  # 每个句间空白的 (时长, 下一句是否已提前合成好)
+        self.synthesis_time = 0.0
+        self.playback_time = 0.0
+
+    def add_gap(self, gap, was_ready):
+        self.gaps.append((gap, was_ready))
+
+    def summary(self):
+        if not self.gaps:
+            return "句间空白: 无"
+        values = [gap for gap, _ in self.gaps]
+        starved = sum(1 for _, was_ready in self.gaps if not was_ready)
+        return (f"句间空白: 共 {len(values)} 次, 平均 {sum(values) / len(values) * 1000:.1f} ms, "
+                f"最大 {max(values) * 1000:.1f} ms, 等待合成 {starved} 次, "
+                f"合成耗时 {self.synthesis_time:.2f} s, 音频时长 {self.playback_time:.2f} s, "
+                f"输出欠载累计 {audio_output.underruns} 次")
+
+# 预合成队列长度：正在播放第 N 句时最多提前合成好的句子数，保持内存占用平稳
+SYNTHESIS_LOOKAHEAD = 2
+# 合成在单独的合批线程中执行，让事件循环在合成期间仍可驱动播放；不同会话同时提交的句子合成一批。
+# 使用工作进程时每个进程保持 TTS_WORKER_QUEUE_SIZE 批在途，进程空闲时下一批已在其队列中。
+# 合成器没有 generate_batch 时一批中的句子也只能逐句合成，凑批只会增加等待：每批一句、不设等待窗口，
+# 各句分别交给空闲的工作进程
+BATCH_SYNTHESIS = callable(getattr(TTS_Synthesizer, "generate_batch", None))
+tts_batcher = TTSBatcher(_synthesize_cached,
+                         max_batch_size=TTS_MAX_BATCH_SIZE if BATCH_SYNTHESIS else 1,
+                         max_batch_wait_ms=TTS_MAX_BATCH_WAIT_MS if BATCH_SYNTHESIS else 0,
+                         concurrency=max(1, TTS_WORKER_PROCESSES * TTS_WORKER_QUEUE_SIZE))
+
+async def _synthesis_producer(sentences, character, emotion, queue, spoken, stats, session=None, cache_only=False,
+                              stream_first=False, chunk_ms=STREAM_CHUNK_MS):
+    """生产者：逐句合成音频，把 (句子, 音频) 放入有界队列；每句合成前向调度器申请合成资源
+
+    cache_only=True 时只使用音频缓存，未命中的句子不合成、也不放入队列。
+    stream_first=True 时第一句逐块流式合成，同一句的多块音频依次放入队列。
+    """
+    try:
+        async for sentence in sentences:
+            spoken.append(sentence)
+            data = {"text": sentence, "character": character, "emotion": emotion}
+            if cache_only:
+                audio_data = await asyncio.get_running_loop().run_in_executor(None, audio_cache.get, data)
+                if audio_data is None:
+                    logger.info(f"\n仅使用缓存，跳过未缓存的句子: {sentence}")
+                    continue
+                await queue.put((sentence, audio_data))
+                continue
+            logger.info(f"\n开始生成句子音频: {sentence}")
+            start = time.perf_counter()
+            if stream_first:
+                # 首块生成后就交给消费者，不等整句合成完
+                stream_first = False
+                async for chunk in stream_audio_chunks(data, chunk_ms, session):
+                    await queue.put((sentence, chunk))
+                stats.synthesis_time += time.perf_counter() - start
+                continue
+            async with request_scheduler.slot(STAGE_TTS, session):
+                audio_data = await tts_batcher.submit(data)
+            stats.synthesis_time += time.perf_counter() - start
+            await queue.put((sentence, audio_data))
+    except Exception:
+        # 通知消费者结束，异常由 text_to_speech_stream 重新抛出
+        await queue.put(None)
+        raise
+    await queue.put(None)
+
+async def synthesize_sentences(sentences, character="", emotion="default", lookahead=SYNTHESIS_LOOKAHEAD,
+                               session=None, cache_only=False, stream_first=STREAM_FIRST_SENTENCE,
+                               chunk_ms=STREAM_CHUNK_MS):
+    """逐句合成但不在本机播放，依次产出 (句子, AudioFrame)，用于把音频发送给客户端
+
+    与 text_to_speech_stream 共用有界的预合成队列：调用方处理得慢时合成也随之暂停。
+    stream_first=True 时第一句按 chunk_ms 分块产出，连续多项可能属于同一句。
+    """
+    queue = asyncio.Queue(maxsize=lookahead)
+    spoken = []
+    stats = PipelineStats()
+    producer = asyncio.create_task(_synthesis_producer(sentences, character, emotion, queue, spoken, stats,
+                                                       session, cache_only, stream_first, chunk_ms))
+    try:
+        while True:
+            item = await queue.get()
+            if item is None:
+                break
+            stats.playback_time += item[1].duration
+            yield item
+        # 生产者中的异常（例如合成失败）在这里抛出
+        await producer
+    finally:
+        if not producer.done():
+            producer.cancel()
+            await asyncio.gather(producer, return_exceptions=True)
+    logger.info(f"合成耗时 {stats.synthesis_time:.2f} s, 音频时长 {stats.playback_time:.2f} s")
+
+async def text_to_speech_stream(sentences, character="", emotion="default", lookahead=SYNTHESIS_LOOKAHEAD,
+                                session=None, cache_only=False, stream_first=STREAM_FIRST_SENTENCE, interrupt=True):
+    """流式文本转语音：播放第 N 句的同时合成第 N+1 句，返回完整文本
+
+    interrupt=True 时先停止当前播放（新一轮对话打断上一轮）；
+    多个调用方共用扬声器时传入 False，由调用方保证同一时间只有一个回复在播放。
+    """
+    if interrupt:
+        playback_scheduler.stop_now()
+    generation = playback_scheduler.generation  # 之后再有 stop_now 即表示被打断
+
+    queue = asyncio.Queue(maxsize=lookahead)
+    spoken = []
+    stats = PipelineStats()
+    producer = asyncio.create_task(_synthesis_producer(sentences, character, emotion, queue, spoken, stats,
+                                                       session, cache_only, stream_first))
+
+    interrupted = False
+    try:
+        previous = None  # 上一句播放完成的 future
+        while True:
+            was_ready = not queue.empty()
+            item = await queue.get()
+            if item is None or playback_scheduler.generation != generation:
+                break
+            _, audio_data = item
+            # 上一句还在播放时就写入下一句，两句之间没有空白
+            start = time.perf_counter()
+            if previous is not None:
+                stats.add_gap(start - previous.result() if previous.done() else 0.0, was_ready)
+            done = enqueue_audio(audio_data)
+            stats.playback_time += audio_data.duration
+            # 调度器中最多保留正在播放和紧随其后的两句
+            if previous is not None:
+                await previous
+            previous = done
+        if previous is not None and playback_scheduler.generation == generation:
+            await previous
+        interrupted = playback_scheduler.generation != generation
+    except BaseException:
+        producer.cancel()
+        playback_scheduler.stop_now()
+        raise
+
+    if interrupted:
+        # 播放被打断，放弃剩余句子
+        producer.cancel()
+        await asyncio.gather(producer, return_exceptions=True)
+        logger.info("播放被打断，已放弃剩余句子")
+    else:
+        # 生产者中的异常（例如合成失败）在这里抛出
+        await producer
+
+    logger.info(stats.summary())
+    logger.info(audio_cache.summary())
+    logger.info(tts_batcher.summary())
+    logger.info(stream_latency.summary())
+    logger.info(chunk_sizer.summary())
+    if TTS_WORKER_PROCESSES:
+        logger.info(synthesis_workers.summary())
+    # 使用工作进程时模型、参考音频特征和文本前端缓存的统计由工作进程回报
+    logger.info(synthesis_summary())
+    return "".join(spoken)
+
+async def _iterate(items):
+    """将普通序列包装为异步迭代器"""
+    for item in items:
+        yield item
 
 async def text_to_speech(text, character="", emotion="default"):
-    """文本转语音流程"""
-    data = {"text": text, "character": character, "emotion": emotion}
-
-    # # 停止当前音频播放
-    # with sound_lock:
-    #     if current_sound is not None:
-    #         current_sound.stop()
-    # 停止当前音频播放
-    with audio_state.sound_lock:
-        if audio_state.current_sound is not None:
-            audio_state.current_sound.stop()
-
-    logger.info("\n开始生成音频...")
-    audio_data = await get_audio(data)
-    logger.info("\n生成完成，正在播放音频...")
-    threading.Thread(target=play_audio_sync, args=(audio_data,)).start()
+    """文本转语音流程：去掉 markdown、按自适应长度分块后送入流式合成播放管线"""
+    return await text_to_speech_stream(chunk_text(text, character), character, emotion)
@@ -1,9 +1,12 @@
 import asyncio
 import threading
 import logging
-from TTS_gptsovits_voice import get_characters_and_emotions, text_to_speech
-from TTS_run_model import get_response  # 导入 get_response 函数
-from TTS_Funasr import record_audio, transcribe_audio  # 导入录音和转录函数
+from TTS_gptsovits_voice import get_characters_and_emotions, text_to_speech_stream
+from TTS_conversation import conversations  # 带对话记忆的流式模型请求
+from TTS_text_chunker import adaptive_chunks
+from TTS_Funasr import transcribe_stream  # 导入流式转录函数
+from TTS_record_audio import microphone  # 导入常驻麦克风采集服务
+from TTS_playback_scheduler import playback_scheduler
 
 # 初始化日志
 logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(message)s")
@@ -17,26 +20,26 @@ def input_thread(loop):
 async def input_loop(character, emotion):
     """持续接收用户输入并返回AI的响应"""
     logger.info("开始语音输入，请说话，输入'退出'结束程序：")
-    while True:
-        audio_buffer = await record_audio()  # 获取用户的语音输入
-        if audio_buffer is not None:
-            user_input = await transcribe_audio(audio_buffer)  # 转录音频为文本
-            logger.info(f"用户输入: {user_input}")
+    # 播放回复期间不读取麦克风，积压的帧含有回复的回声；播放结束后从当前位置继续，之前的帧丢弃
+    resume_at = 0
+    speech_events = microphone.speech_events(skip_before=lambda: resume_at, echo_gate=playback_scheduler.is_playing)
+    # 边说边识别，说话结束时得到最终结果
+    async for kind, user_input in transcribe_stream(speech_events):
+        if kind == "partial":
+            logger.info(f"识别中: {user_input}")
+            continue
+        logger.info(f"用户输入: {user_input}")
 
-            if user_input.lower() == '退出。':
-                logger.info("退出程序。")
-                break
-            
-            # 获取AI响应
-            logger.info("\n正在调用模型生成回复...")
-            response = await get_response(user_input)  # 使用异步获取AI的回复
-            logger.info(f"AI回复: {response}")
-
-            # 使用TTS模块进行语音播放
-            logger.info("\n生成的模型回复将以语音输出...")
-            await text_to_speech(response, character, emotion)
-        else:
-            logger.info("没有检测到有效声音输入，重试...")
+        if user_input.lower() == '退出。':
+            logger.info("退出程序。")
+            break
+        
+        # 流式获取AI响应，逐句合成并播放
+        logger.info("\n正在调用模型生成回复，回复将逐句以语音输出...")
+        sentences = adaptive_chunks(conversations.get("cli", character).stream_reply(user_input), character)
+        response = await text_to_speech_stream(sentences, character, emotion)
+        resume_at = microphone.write_pos
+        logger.info(f"AI回复: {response}")
 
 async def main():
     """主函数，接受用户输入并启动TTS流程"""
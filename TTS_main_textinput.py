@@ -1,8 +1,9 @@
 import asyncio
 import threading
 import logging
-from TTS_gptsovits_voice import get_characters_and_emotions, text_to_speech
-from TTS_run_model import get_response  # 导入 get_response 函数
+from TTS_gptsovits_voice import get_characters_and_emotions, text_to_speech_stream
+from TTS_conversation import conversations  # 带对话记忆的流式模型请求
+from TTS_text_chunker import adaptive_chunks
 
 # 初始化日志
 logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(message)s")
@@ -23,15 +24,12 @@ async def input_loop(character, emotion):
             logger.info("退出程序。")
             break
         
-        # 获取AI响应
-        logger.info("\n正在调用模型生成回复...")
-        response = await get_response(user_input)  # 使用异步获取AI的回复
+        # 流式获取AI响应，逐句合成并播放
+        logger.info("\n正在调用模型生成回复，回复将逐句以语音输出...")
+        sentences = adaptive_chunks(conversations.get("cli", character).stream_reply(user_input), character)
+        response = await text_to_speech_stream(sentences, character, emotion)
         logger.info(f"AI回复: {response}")
 
-        # 使用TTS模块进行语音播放
-        logger.info("\n生成的模型回复将以语音输出...")
-        await text_to_speech(response, character, emotion)
-
 async def main():
     """主函数，接受用户输入并启动TTS流程"""
     
@@ -0,0 +1,160 @@
+# TTS_model_residency.py
+# 角色模型常驻管理：在内存/显存预算内保留最近使用的角色，超出时按 LRU 卸载，支持后台预加载
+import logging
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+# 常驻设置
+MODEL_MEMORY_BUDGET_MB = 6144  # 所有常驻角色模型占用的内存/显存上限
+
+
+class ModelResidency:
+    """角色模型常驻管理器
+
+    loader(角色) 加载并返回模型；memory_probe() 返回当前已占用的字节数（例如显存），
+    用加载前后的差值作为该角色的占用，无法测量时使用 estimate(角色)。
+    同一角色同时只加载一次：请求合成的线程和预加载线程会等待同一次加载。
+    """
+
+    def __init__(self, loader, budget_bytes=MODEL_MEMORY_BUDGET_MB * 1024 * 1024,
+                 memory_probe=None, estimate=None, after_evict=None):
+        self.loader = loader
+        self.budget_bytes = budget_bytes
+        self.memory_probe = memory_probe
+        self.estimate = estimate
+        self.after_evict = after_evict
+        self.lock = threading.Lock()
+        self.models = OrderedDict()  # 角色 -> (模型, 占用字节数)，按最近使用排序
+        self.loading = {}  # 角色 -> 加载中的 Future
+        self.total_bytes = 0
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="tts-model-loader")
+        self.hits = 0
+        self.misses = 0  # 请求时角色未加载，需要等待加载
+        self.prefetches = 0
+        self.loads = 0
+        self.evictions = 0
+        self.load_time = 0.0  # 累计加载耗时 (秒)
+        self.stall_time = 0.0  # 合成请求累计等待加载的时间 (秒)
+
+    def get(self, character):
+        """返回角色模型，未加载时在当前线程加载（或等待正在进行的加载）"""
+        start = time.perf_counter()
+        with self.lock:
+            entry = self.models.get(character)
+            if entry is not None:
+                self.models.move_to_end(character)
+                self.hits += 1
+                return entry[0]
+            self.misses += 1
+            future = self.loading.get(character)
+            owner = future is None
+            if owner:
+                future = self._start_load(character)
+        if owner:
+            self._run_load(character, future)
+        model = future.result()
+        stall = time.perf_counter() - start
+        with self.lock:
+            self.stall_time += stall
+        logger.info(f"角色 {character or '默认'} 未常驻，等待加载 {stall:.2f} s")
+        return model
+
+    def prefetch(self, character):
+        """在后台加载角色，已常驻或正在加载时返回 False"""
+        with self.lock:
+            if character in self.models:
+                self.models.move_to_end(character)
+                return False
+            if character in self.loading:
+                return False
+            future = self._start_load(character)
+            self.prefetches += 1
+        logger.info(f"预加载角色 {character or '默认'}")
+        self.executor.submit(self._run_load, character, future)
+        return True
+
+    def _start_load(self, character):
+        future = Future()
+        self.loading[character] = future
+        return future
+
+    def _run_load(self, character, future):
+        try:
+            future.set_result(self._load(character))
+        except Exception as e:
+            logger.error(f"加载角色 {character or '默认'} 失败: {e}")
+            future.set_exception(e)
+        finally:
+            with self.lock:
+                self.loading.pop(character, None)
+
+    def _probe(self):
+        if self.memory_probe is None:
+            return None
+        try:
+            return self.memory_probe()
+        except Exception:
+            return None
+
+    def _load(self, character):
+        start = time.perf_counter()
+        before = self._probe()
+        model = self.loader(character)
+        after = self._probe()
+        size = after - before if before is not None and after is not None else 0
+        if size <= 0 and self.estimate is not None:
+            size = self.estimate(character)
+        elapsed = time.perf_counter() - start
+        with self.lock:
+            self.models[character] = (model, size)
+            self.total_bytes += size
+            self.loads += 1
+            self.load_time += elapsed
+            evicted = self._evict()
+        logger.info(f"角色 {character or '默认'} 已加载，耗时 {elapsed:.2f} s，"
+                    f"占用 {size / 1024 / 1024:.0f} MB，常驻 {len(self.models)} 个")
+        for name in evicted:
+            logger.info(f"卸载角色 {name or '默认'}（最久未使用）")
+        if evicted and self.after_evict is not None:
+            # 被卸载模型的引用已全部释放，由调用方回收显存
+            self.after_evict()
+        return model
+
+    def _evict(self):
+        """超过预算时卸载最久未使用的角色，至少保留刚加载的一个"""
+        evicted = []
+        while self.total_bytes > self.budget_bytes and len(self.models) > 1:
+            character, (_, size) = self.models.popitem(last=False)
+            self.total_bytes -= size
+            self.evictions += 1
+            evicted.append(character)
+        return evicted
+
+    def resident(self):
+        with self.lock:
+            return list(self.models)
+
+    def stats(self):
+        with self.lock:
+            return {"resident": list(self.models),
+                    "bytes": self.total_bytes,
+                    "budget_bytes": self.budget_bytes,
+                    "hits": self.hits,
+                    "misses": self.misses,
+                    "prefetches": self.prefetches,
+                    "loads": self.loads,
+                    "evictions": self.evictions,
+                    "load_time_s": self.load_time,
+                    "stall_time_s": self.stall_time}
+
+    def summary(self, stats=None):
+        """stats 为 None 时使用本进程的统计，也可以传入工作进程回报的统计"""
+        stats = stats or self.stats()
+        return (f"角色模型: 常驻 {len(stats['resident'])} 个, {stats['bytes'] / 1024 / 1024:.0f} / "
+                f"{stats['budget_bytes'] / 1024 / 1024:.0f} MB, 命中 {stats['hits']}, 未命中 {stats['misses']}, "
+                f"预加载 {stats['prefetches']}, 加载 {stats['loads']} 次共 {stats['load_time_s']:.1f} s, "
+                f"等待加载 {stats['stall_time_s']:.1f} s, 卸载 {stats['evictions']}")
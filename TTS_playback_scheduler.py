@@ -0,0 +1,177 @@
+# TTS_playback_scheduler.py
+# 常驻播放调度器：独占输出设备，按优先级排队播放，支持立即停止
+import heapq
+import itertools
+import logging
+import threading
+import time
+from TTS_audio_output import audio_output
+
+logger = logging.getLogger(__name__)
+
+# 优先级，数值越小越先播放
+PRIORITY_HIGH = 0
+PRIORITY_NORMAL = 1
+PRIORITY_LOW = 2
+
+# 调度设置
+WRITE_CHUNK_MS = 100  # 每次写入输出缓冲区的音频长度 (毫秒)
+MAX_AHEAD_MS = 300  # 输出缓冲区中最多预先写入的音频长度 (毫秒)
+
+
+class PlaybackItem:
+    """一段排队等待播放的音频"""
+
+    def __init__(self, frame, priority, on_done, generation):
+        self.frame = frame
+        self.priority = priority
+        self.on_done = on_done
+        self.generation = generation
+        self.written = 0  # 已写入输出缓冲区的样本数
+        self.output_start = None  # 第一个样本在输出流中的位置
+
+    @property
+    def remaining(self):
+        return len(self.frame) - self.written
+
+
+class PlaybackScheduler:
+    """播放调度器
+
+    单个常驻线程从优先队列中取出音频，按小块写入 AudioOutput，
+    输出缓冲区中只预先写入 MAX_AHEAD_MS，因此高优先级音频可以插到尚未写入的音频之前，
+    stop_now() 也只需丢弃很少的数据。不再为每次播放创建线程或事件循环。
+    """
+
+    def __init__(self, output=audio_output, write_chunk_ms=WRITE_CHUNK_MS, max_ahead_ms=MAX_AHEAD_MS):
+        self.output = output
+        self.write_chunk_ms = write_chunk_ms
+        self.max_ahead_ms = max_ahead_ms
+        self.cond = threading.Condition()
+        self.queue = []  # (优先级, 序号, PlaybackItem)
+        self.counter = itertools.count()
+        self.current = None  # 正在写入输出缓冲区的音频
+        self.tail = None  # 已全部写入、尚未播放完的音频
+        self.generation = 0  # 每次 stop_now 加一，旧的音频不再写入
+        self.interrupt_latencies = []
+        self.thread = None  # 第一次加入播放队列时启动，只导入模块的进程不创建线程
+
+    def enqueue(self, frame, priority=PRIORITY_NORMAL, on_done=None):
+        """加入播放队列
+
+        on_done(completed) 在音频播放完毕 (completed=True) 或被 stop_now 丢弃
+        (completed=False) 时在后台线程中调用。
+        """
+        with self.cond:
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._run, name="playback-scheduler", daemon=True)
+                self.thread.start()
+            item = PlaybackItem(frame, priority, on_done, self.generation)
+            heapq.heappush(self.queue, (priority, next(self.counter), item))
+            self.cond.notify_all()
+        return item
+
+    def stop_now(self, on_silenced=None):
+        """立即停止播放并清空队列，不等待扬声器静音
+
+        返回是否丢弃了输出缓冲区中的音频。丢弃时由输出回调记录打断延迟，
+        并在开始输出静音时调用 on_silenced(静音时刻)，静音时刻为 time.perf_counter() 的值。
+        """
+        with self.cond:
+            self.generation += 1
+            dropped = [item for _, _, item in self.queue]
+            if self.current is not None:
+                dropped.append(self.current)
+                self.current = None
+            self.queue.clear()
+            # 持有 self.cond 时调度线程不会写入，清空后不会再有旧音频进入输出缓冲区；
+            # 已写入的音频由输出回调以 played=False 通知
+            dropped_samples = self.output.clear(lambda clear_latency: self._silenced(clear_latency, on_silenced))
+            self.cond.notify_all()
+        for item in dropped:
+            self._finish(item, False)
+        return dropped_samples > 0
+
+    def _silenced(self, clear_latency, on_silenced):
+        """输出回调线程：打断后开始输出静音"""
+        silenced_at = time.perf_counter()
+        latency = clear_latency + self.output.output_latency()
+        self.interrupt_latencies.append(latency)
+        logger.info(f"播放已打断，静音延迟 {latency * 1000:.1f} ms")
+        if on_silenced is not None:
+            try:
+                on_silenced(silenced_at)
+            except Exception as e:
+                logger.error(f"静音回调出错: {e}")
+
+    def position(self):
+        """返回当前音频的播放进度 (秒) 和总时长 (秒)，没有播放时返回 None"""
+        with self.cond:
+            item = self.tail or self.current
+            if item is None or item.output_start is None:
+                return None
+            played = self.output.read_pos - item.output_start
+            rate = item.frame.sample_rate
+            return max(0, min(played, len(item.frame))) / rate, item.frame.duration
+
+    def queued_duration(self):
+        """尚未播放的音频总时长 (秒)：输出缓冲区 + 当前音频未写入部分 + 队列"""
+        with self.cond:
+            seconds = self.output.queued_samples() / self.output.sample_rate
+            if self.current is not None:
+                seconds += self.current.remaining / self.current.frame.sample_rate
+            seconds += sum(item.frame.duration for _, _, item in self.queue)
+            return seconds
+
+    def is_playing(self):
+        with self.cond:
+            return self.current is not None or bool(self.queue) or self.output.queued_samples() > 0
+
+    def _finish(self, item, completed):
+        if self.tail is item:
+            self.tail = None
+        if item.on_done is not None:
+            try:
+                item.on_done(completed)
+            except Exception as e:
+                logger.error(f"播放完成回调出错: {e}")
+
+    def _run(self):
+        while True:
+            with self.cond:
+                while not self.queue:
+                    self.cond.wait()
+                _, _, item = heapq.heappop(self.queue)
+                if item.generation != self.generation:
+                    continue
+                self.current = item
+            self._play(item)
+
+    def _play(self, item):
+        """分块写入一段音频，写完最后一块后由输出回调通知播放完毕"""
+        rate = item.frame.sample_rate
+        chunk = max(1, rate * self.write_chunk_ms // 1000)
+        max_ahead = rate * self.max_ahead_ms // 1000
+        while True:
+            self.output.wait_below(max_ahead, timeout=0.1)
+            with self.cond:
+                if self.current is not item:
+                    return  # 已被 stop_now 丢弃
+                if self.output.queued_samples() >= max_ahead:
+                    continue
+                if item.output_start is None:
+                    self.output.start(rate)
+                    item.output_start = self.output.write_pos
+                end = min(item.written + chunk, len(item.frame))
+                final = end == len(item.frame)
+                on_done = (lambda played: self._finish(item, played)) if final else None
+                self.output.write(item.frame.slice(item.written, end), final=final, on_done=on_done)
+                item.written = end
+                if final:
+                    self.current = None
+                    self.tail = item
+                    return
+
+
+# 全局播放调度器
+playback_scheduler = PlaybackScheduler()
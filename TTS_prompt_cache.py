@@ -0,0 +1,206 @@
+# TTS_prompt_cache.py
+# 参考音频 / 提示文本特征的磁盘缓存：每个 (角色, 情感) 只计算一次，保存在 cache 目录中
+import os
+import json
+import shutil
+import hashlib
+import logging
+import threading
+import weakref
+import numpy as np
+import torch
+
+logger = logging.getLogger(__name__)
+
+# 缓存设置
+CACHE_DIR = os.path.join(os.getcwd(), "cache", "prompt_features")  # 不写入用户的模型目录
+FORMAT_VERSION = 1
+# 合成流水线对象可能的属性名，其 prompt_cache 字典保存当前参考音频的特征
+PIPELINE_ATTRIBUTES = ("tts_pipline", "tts_pipeline", "tts_instance", "tts")
+
+
+def find_prompt_cache(synthesizer):
+    """找到合成器内部保存参考音频特征的字典，找不到返回 None"""
+    for owner in (synthesizer,) + tuple(getattr(synthesizer, name, None) for name in PIPELINE_ATTRIBUTES):
+        prompt_cache = getattr(owner, "prompt_cache", None)
+        if isinstance(prompt_cache, dict):
+            return prompt_cache
+    return None
+
+
+def _file_signature(path):
+    try:
+        stat = os.stat(path)
+    except (OSError, TypeError):
+        return None
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+def _encode(value):
+    """把特征值拆分为 (描述, numpy 数组或 None)；无法保存时抛出 TypeError"""
+    if isinstance(value, torch.Tensor):
+        tensor = value.detach().cpu()
+        dtype = str(tensor.dtype)
+        if tensor.dtype == torch.bfloat16:
+            tensor = tensor.float()
+        return {"type": "tensor", "dtype": dtype, "cuda": value.is_cuda}, tensor.numpy()
+    if isinstance(value, np.ndarray):
+        return {"type": "ndarray"}, value
+    json.dumps(value)  # 字符串、数字、列表等直接写入 meta.json
+    return {"type": "json", "value": value}, None
+
+
+def _decode(spec, array, device):
+    if spec["type"] == "json":
+        return spec["value"]
+    if spec["type"] == "ndarray":
+        return array
+    dtype = getattr(torch, spec["dtype"].replace("torch.", ""))
+    # 缓存的数组会被多次写回，复制一份再交给合成器
+    tensor = torch.from_numpy(np.array(array)).to(dtype)
+    return tensor.to(device) if spec["cuda"] else tensor
+
+
+class PromptFeatureCache:
+    """参考音频特征缓存
+
+    合成器只在参考音频或提示文本变化时重新提取特征（SSL 特征、语义 token、提示文本的音素和 BERT 特征），
+    并且只保存最近一个情感的结果。这里把每个情感第一次提取的结果保存到
+    cache/prompt_features/<角色哈希>/<情感哈希>/，切换情感时直接写回合成器的 prompt_cache，
+    每次请求只需要处理目标文本。参考音频或角色模型变化后缓存自动失效。
+    数组读入内存而不是内存映射，Windows 上被映射的文件无法在更新缓存时删除。
+    """
+
+    def __init__(self, registry, version_of=None, device="cpu", cache_dir=CACHE_DIR):
+        self.registry = registry
+        self.version_of = version_of  # 角色 -> 模型版本字符串
+        self.device = device
+        self.cache_dir = cache_dir
+        self.lock = threading.Lock()
+        self.entries = {}  # (角色, 情感) -> (meta, {字段: 数组})
+        # 合成器 -> 当前写入其 prompt_cache 的 (角色, 情感)；弱引用，合成器释放后条目随之消失，不会被新对象误用
+        self.current = weakref.WeakKeyDictionary()
+        self.restored = 0
+        self.computed = 0
+        self.saved = 0
+
+    def _entry_dir(self, character, emotion):
+        if self.registry.get_path(character) is None:
+            return None
+        character_name = hashlib.sha256(character.encode("utf-8")).hexdigest()[:16]
+        emotion_name = hashlib.sha256(emotion.encode("utf-8")).hexdigest()[:16]
+        return os.path.join(self.cache_dir, character_name, emotion_name)
+
+    def _version(self, character):
+        return self.version_of(character) if self.version_of is not None else ""
+
+    def _load_entry(self, character, emotion):
+        """读取磁盘缓存"""
+        key = (character, emotion)
+        with self.lock:
+            if key in self.entries:
+                return self.entries[key]
+        entry_dir = self._entry_dir(character, emotion)
+        if entry_dir is None or not os.path.isdir(entry_dir):
+            return None
+        try:
+            with open(os.path.join(entry_dir, "meta.json"), "r", encoding="utf-8") as f:
+                meta = json.load(f)
+            arrays = {field: np.load(os.path.join(entry_dir, f"{field}.npy"))
+                      for field, spec in meta["fields"].items() if spec["type"] != "json"}
+        except (OSError, ValueError, KeyError) as e:
+            logger.warning(f"读取参考音频特征缓存失败 {entry_dir}: {e}")
+            return None
+        with self.lock:
+            self.entries[key] = (meta, arrays)
+        return meta, arrays
+
+    def _valid(self, meta, character):
+        return (meta.get("format") == FORMAT_VERSION
+                and meta.get("version") == self._version(character)
+                and meta.get("ref_audio") is not None
+                and meta.get("ref_audio") == _file_signature(meta.get("ref_audio_path")))
+
+    def preload(self):
+        """启动时读取所有角色已有的特征缓存"""
+        count = 0
+        for character, emotions in self.registry.characters().items():
+            for emotion in emotions:
+                if self._load_entry(character, emotion) is not None:
+                    count += 1
+        logger.info(f"参考音频特征缓存: 已读取 {count} 个情感")
+
+    def prepare(self, synthesizer, character, emotion):
+        """合成前调用：有缓存时把该情感的特征写回合成器，返回是否已写回"""
+        prompt_cache = find_prompt_cache(synthesizer)
+        if prompt_cache is None:
+            return False
+        key = (character, emotion)
+        if self.current.get(synthesizer) == key:
+            return True
+        entry = self._load_entry(character, emotion)
+        if entry is not None and not self._valid(entry[0], character):
+            logger.info(f"参考音频或角色模型已变化，忽略旧的特征缓存: {character} {emotion}")
+            with self.lock:
+                self.entries.pop(key, None)
+            entry = None
+        if entry is None:
+            self.current.pop(synthesizer, None)
+            return False
+        meta, arrays = entry
+        prompt_cache.update({field: _decode(spec, arrays.get(field), self.device)
+                             for field, spec in meta["fields"].items()})
+        self.current[synthesizer] = key
+        self.restored += 1
+        return True
+
+    def store(self, synthesizer, character, emotion):
+        """合成后调用：该情感还没有缓存时，保存合成器刚提取的特征"""
+        prompt_cache = find_prompt_cache(synthesizer)
+        if prompt_cache is None or self.current.get(synthesizer) == (character, emotion):
+            return
+        self.computed += 1
+        ref_audio_path = prompt_cache.get("ref_audio_path")
+        entry_dir = self._entry_dir(character, emotion)
+        if _file_signature(ref_audio_path) is None or entry_dir is None:
+            return
+        try:
+            encoded = {field: _encode(value) for field, value in prompt_cache.items()}
+        except TypeError as e:
+            logger.warning(f"参考音频特征无法保存: {e}")
+            return
+        meta = {"format": FORMAT_VERSION,
+                "version": self._version(character),
+                "ref_audio_path": ref_audio_path,
+                "ref_audio": _file_signature(ref_audio_path),
+                "fields": {field: spec for field, (spec, _) in encoded.items()}}
+        tmp_dir = f"{entry_dir}.{threading.get_ident()}.tmp"
+        try:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            os.makedirs(os.path.dirname(entry_dir), exist_ok=True)
+            os.makedirs(tmp_dir)
+            for field, (_, array) in encoded.items():
+                if array is not None:
+                    np.save(os.path.join(tmp_dir, f"{field}.npy"), array)
+            with open(os.path.join(tmp_dir, "meta.json"), "w", encoding="utf-8") as f:
+                json.dump(meta, f, ensure_ascii=False)
+            shutil.rmtree(entry_dir, ignore_errors=True)
+            os.replace(tmp_dir, entry_dir)
+        except OSError as e:
+            logger.warning(f"写入参考音频特征缓存失败 {entry_dir}: {e}")
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            return
+        with self.lock:
+            self.entries.pop((character, emotion), None)
+        self.current[synthesizer] = (character, emotion)
+        self.saved += 1
+        logger.info(f"已保存参考音频特征: {character} {emotion}")
+
+    def stats(self):
+        return {"restored": self.restored, "computed": self.computed, "saved": self.saved}
+
+    def summary(self, stats=None):
+        """stats 为 None 时使用本进程的统计，也可以传入工作进程回报的统计"""
+        stats = stats or self.stats()
+        return (f"参考音频特征缓存: 复用 {stats['restored']} 次, 重新提取 {stats['computed']} 次, "
+                f"保存 {stats['saved']} 个")
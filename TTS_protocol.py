@@ -0,0 +1,130 @@
+# TTS_protocol.py
+# 客户端与服务端之间的 TCP 分帧协议
+#
+# 每一帧由 9 字节的帧头和负载组成:
+#   负载长度 (4 字节, 大端) | 消息类型 (1 字节) | 请求 ID (4 字节, 大端) | 负载
+# 音频帧的负载为原始二进制，其余消息的负载为 UTF-8 编码的 JSON。
+# 同一连接上可以连续发送多个请求，响应通过请求 ID 对应，不要求按发送顺序返回。
+import asyncio
+import json
+import struct
+
+HEADER = struct.Struct("!IBI")
+HEADER_SIZE = HEADER.size
+MAX_PAYLOAD_SIZE = 16 * 1024 * 1024  # 单帧负载上限，防止异常长度耗尽内存
+
+# 消息类型
+MSG_CHAT = 1  # 客户端 -> 服务端: {"character", "emotion", "text", "delivery": "local" | "stream"}
+MSG_COMMAND = 2  # 客户端 -> 服务端: {"command": "LIST_CHARACTERS" | "PREFETCH" | "STATS" | "DISCONNECT"}
+MSG_RESULT = 3  # 服务端 -> 客户端: 请求的结果 (JSON)
+MSG_ERROR = 4  # 服务端 -> 客户端: {"error": 错误信息}
+MSG_AUDIO = 5  # 服务端 -> 客户端: 二进制音频数据
+MSG_AUDIO_FORMAT = 6  # 服务端 -> 客户端: {"sample_rate", "text"}，之后的音频帧为该采样率的 int16 PCM
+
+BINARY_TYPES = (MSG_AUDIO,)
+
+
+class ProtocolError(ValueError):
+    """收到不符合协议的数据"""
+
+
+class PayloadError(ProtocolError):
+    """帧头和长度正确、只有负载无法解析；帧已完整读出，连接可以继续使用"""
+
+    def __init__(self, message, msg_type, request_id):
+        super().__init__(message)
+        self.msg_type = msg_type
+        self.request_id = request_id
+
+
+def encode_payload(msg_type, payload):
+    """把负载编码为字节；二进制消息原样返回（不复制）"""
+    if msg_type in BINARY_TYPES:
+        return payload
+    return json.dumps(payload, ensure_ascii=False).encode("utf-8")
+
+
+def decode_payload(msg_type, payload):
+    if msg_type in BINARY_TYPES:
+        return payload
+    try:
+        return json.loads(bytes(payload).decode("utf-8"))
+    except (UnicodeDecodeError, json.JSONDecodeError) as e:
+        raise ProtocolError(f"无效的 JSON 负载: {e}")
+
+
+def encode_frame(msg_type, request_id, payload):
+    """编码一帧，返回 (帧头, 负载)，分开发送可避免拼接大块二进制数据"""
+    data = encode_payload(msg_type, payload)
+    size = len(memoryview(data).cast("B"))
+    if size > MAX_PAYLOAD_SIZE:
+        raise ProtocolError(f"负载过大: {size} 字节")
+    return HEADER.pack(size, msg_type, request_id), data
+
+
+def _parse_header(header):
+    size, msg_type, request_id = HEADER.unpack(header)
+    if size > MAX_PAYLOAD_SIZE:
+        raise ProtocolError(f"负载过大: {size} 字节")
+    return size, msg_type, request_id
+
+
+async def read_frame(reader):
+    """从 asyncio StreamReader 读取一帧，返回 (消息类型, 请求 ID, 负载)；连接关闭时返回 None
+
+    帧头无效时抛出 ProtocolError；负载无法解析时抛出 PayloadError，此时这一帧已完整读出。
+    """
+    try:
+        header = await reader.readexactly(HEADER_SIZE)
+        size, msg_type, request_id = _parse_header(header)
+        payload = await reader.readexactly(size) if size else b""
+    except asyncio.IncompleteReadError:
+        return None
+    try:
+        return msg_type, request_id, decode_payload(msg_type, payload)
+    except ProtocolError as e:
+        raise PayloadError(str(e), msg_type, request_id)
+
+
+def write_frame(writer, msg_type, request_id, payload):
+    """把一帧写入 asyncio StreamWriter 的发送缓冲区，调用方负责 await writer.drain()
+
+    两次 write 之间没有 await，多个任务共用同一连接时帧不会交错。
+    """
+    header, data = encode_frame(msg_type, request_id, payload)
+    writer.write(header)
+    if len(data):
+        writer.write(data)
+
+
+def send_frame(sock, msg_type, request_id, payload):
+    """通过阻塞套接字发送一帧"""
+    header, data = encode_frame(msg_type, request_id, payload)
+    sock.sendall(header)
+    if len(data):
+        sock.sendall(data)
+
+
+class FrameDecoder:
+    """增量解码器：把任意切分的字节流还原为完整的帧，用于阻塞套接字的接收线程"""
+
+    def __init__(self):
+        self.buffer = bytearray()
+
+    def feed(self, data):
+        """输入收到的字节，返回其中所有完整的帧 [(消息类型, 请求 ID, 负载)]"""
+        self.buffer.extend(data)
+        frames = []
+        offset = 0
+        while len(self.buffer) - offset >= HEADER_SIZE:
+            size, msg_type, request_id = _parse_header(self.buffer[offset:offset + HEADER_SIZE])
+            end = offset + HEADER_SIZE + size
+            if len(self.buffer) < end:
+                break
+            payload = bytes(self.buffer[offset + HEADER_SIZE:end])
+            frames.append((msg_type, request_id, decode_payload(msg_type, payload)))
+            offset = end
+        if offset:
+            del self.buffer[:offset]
+        return frames
+
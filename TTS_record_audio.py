@@ -1,64 +1,166 @@
+import asyncio
+import logging
+import threading
 import pyaudio
 import numpy as np
-import time
-import io
-import wave  # 添加 wave 模块的导入
+from TTS_vad import Endpointer, UTTERANCE_END
+from TTS_audio_frame import AudioFrame
+
+logger = logging.getLogger(__name__)
 
 # 音频设置
-CHUNK = 1024  # 每个缓冲区的音频帧数
+CHUNK = 320  # 每个缓冲区的音频帧数，20ms
 FORMAT = pyaudio.paInt16  # 采样位深，16位
 CHANNELS = 1  # 单声道
 RATE = 16000  # 采样率，16kHz
-SILENCE_THRESHOLD = 500  # 静默检测阈值
-SILENCE_DURATION = 3  # 静默持续时长 (秒)
+RING_SECONDS = 30  # 环形缓冲区可容纳的音频时长 (秒)
+# 每个订阅者最多积压的帧通知数；超过环形缓冲区容量的帧已被覆盖，积压再多也读不到
+SUBSCRIBER_QUEUE_SIZE = RATE * RING_SECONDS // CHUNK
+
+
+class MicrophoneCapture:
+    """常驻麦克风采集服务
+
+    使用 PortAudio 回调模式采集音频，回调线程把数据写入预分配的 numpy 环形缓冲区，
+    再把新数据的位置通知给各个订阅者的事件循环。设备只打开一次，读取不会阻塞事件循环。
+    订阅者集合在回调线程和事件循环线程中都会修改，写时复制并由 subscribers_lock 保护；
+    回调线程遍历时只读取当前集合的引用，不需要加锁。
+    """
+
+    def __init__(self, rate=RATE, chunk=CHUNK, ring_seconds=RING_SECONDS):
+        self.rate = rate
+        self.chunk = chunk
+        self.ring = np.zeros(rate * ring_seconds, dtype=np.int16)
+        self.write_pos = 0  # 累计写入的样本数
+        self.overruns = 0  # 订阅者读取过慢导致丢弃的次数
+        self.lock = threading.Lock()
+        self.subscribers_lock = threading.Lock()
+        self.subscribers = frozenset()  # (事件循环, asyncio.Queue)，写时复制
+        self._pa = None
+        self._stream = None
+
+    def start(self):
+        """打开音频设备（只在第一次调用时生效）"""
+        with self.lock:
+            if self._stream is not None:
+                return
+            self._pa = pyaudio.PyAudio()
+            self._stream = self._pa.open(format=FORMAT,
+                                         channels=CHANNELS,
+                                         rate=self.rate,
+                                         input=True,
+                                         frames_per_buffer=self.chunk,
+                                         stream_callback=self._callback)
+            self._stream.start_stream()
+        logger.info("麦克风采集服务已启动")
+
+    def stop(self):
+        """关闭音频设备"""
+        with self.lock:
+            if self._stream is None:
+                return
+            self._stream.stop_stream()
+            self._stream.close()
+            self._pa.terminate()
+            self._stream = None
+            self._pa = None
+        logger.info("麦克风采集服务已停止")
+
+    def _callback(self, in_data, frame_count, time_info, status):
+        """PortAudio 回调线程：写入环形缓冲区并通知订阅者"""
+        samples = np.frombuffer(in_data, dtype=np.int16)
+        size = len(self.ring)
+        start = self.write_pos
+        offset = start % size
+        first = min(len(samples), size - offset)
+        self.ring[offset:offset + first] = samples[:first]
+        self.ring[:len(samples) - first] = samples[first:]
+        self.write_pos = start + len(samples)
+
+        for loop, queue in self.subscribers:
+            try:
+                loop.call_soon_threadsafe(self._deliver, queue, (start, len(samples)))
+            except RuntimeError:
+                # 订阅者的事件循环已关闭
+                self._unsubscribe((loop, queue))
+        return (None, pyaudio.paContinue)
+
+    def _deliver(self, queue, item):
+        """在订阅者的事件循环中投递帧通知；队列已满时丢弃最旧的通知"""
+        if queue.full():
+            queue.get_nowait()
+            self.overruns += 1
+        queue.put_nowait(item)
+
+    def _subscribe(self, subscriber):
+        with self.subscribers_lock:
+            self.subscribers = self.subscribers | {subscriber}
+
+    def _unsubscribe(self, subscriber):
+        with self.subscribers_lock:
+            self.subscribers = self.subscribers - {subscriber}
+
+    def _read(self, start, length, copy=True):
+        """从环形缓冲区读取一段音频，数据已被覆盖时返回 None
+
+        copy=False 时尽量返回环形缓冲区上的视图，调用方必须在数据被覆盖前用完。
+        """
+        size = len(self.ring)
+        if self.write_pos - start > size:
+            return None
+        offset = start % size
+        first = min(length, size - offset)
+        if first == length:
+            view = self.ring[offset:offset + length]
+            return view.copy() if copy else view
+        return np.concatenate((self.ring[offset:], self.ring[:length - first]))
+
+    async def frames(self, copy=True, skip_before=None):
+        """异步迭代采集到的音频帧 (AudioFrame，int16)
+
+        skip_before 为可选的回调，返回累计样本位置 (write_pos)；早于该位置采集的帧直接丢弃，
+        例如调用方播放回复期间没有读取、积压下来的含回声的帧。
+        """
+        self.start()
+        subscriber = (asyncio.get_running_loop(), asyncio.Queue(maxsize=SUBSCRIBER_QUEUE_SIZE))
+        self._subscribe(subscriber)
+        try:
+            while True:
+                start, length = await subscriber[1].get()
+                if skip_before is not None and start < skip_before():
+                    continue
+                samples = self._read(start, length, copy)
+                if samples is None:
+                    self.overruns += 1
+                    logger.warning("音频帧读取过慢，已被环形缓冲区覆盖")
+                    continue
+                yield AudioFrame(samples, self.rate)
+        finally:
+            self._unsubscribe(subscriber)
+
+    async def speech_events(self, skip_before=None, **endpointer_options):
+        """异步迭代端点检测事件 (事件类型, Utterance)，语音段一结束就产出；skip_before 见 frames"""
+        endpointer = Endpointer(rate=self.rate, **endpointer_options)
+        # 端点检测器会立即把音频写入自己的缓冲区，这里直接读取环形缓冲区视图
+        async for frame in self.frames(copy=False, skip_before=skip_before):
+            for event in endpointer.push(frame.samples):
+                yield event
+
+    async def utterances(self, **endpointer_options):
+        """异步迭代完整的语音片段，每段为带有语音段边界的 Utterance"""
+        async for event, utterance in self.speech_events(**endpointer_options):
+            if event == UTTERANCE_END:
+                yield utterance
+
+
+# 全局采集服务实例
+microphone = MicrophoneCapture()
+
 
 async def record_audio():
-    """异步录制音频并返回音频数据"""
-    p = pyaudio.PyAudio()
-    stream = p.open(format=FORMAT,
-                    channels=CHANNELS,
-                    rate=RATE,
-                    input=True,
-                    frames_per_buffer=CHUNK)
-
-    frames = []
-    silent_start_time = None
-    has_sound = False  # 记录是否有有效声音输入
-
-    while True:
-        data = stream.read(CHUNK)
-        frames.append(data)
-
-        # 将数据转换为 numpy 数组进行音量检测
-        audio_data = np.frombuffer(data, dtype=np.int16)
-        volume = np.abs(audio_data).mean()
-
-        if volume < SILENCE_THRESHOLD:
-            if silent_start_time is None:
-                silent_start_time = time.time()  # 记录开始静默的时间
-            
-            # 计算静默的持续时间
-            silent_duration = time.time() - silent_start_time
-            if silent_duration >= SILENCE_DURATION:
-                break
-        else:
-            has_sound = True
-            silent_start_time = None  # 检测到声音，重置静默计时
-
-    # 停止录音并关闭流
-    stream.stop_stream()
-    stream.close()
-    p.terminate()
-
-    if not has_sound:
-        return None
-
-    # 将录音数据存储到内存中的 BytesIO 对象
-    audio_buffer = io.BytesIO()
-    wf = wave.open(audio_buffer, 'wb')
-    wf.setnchannels(CHANNELS)
-    wf.setsampwidth(p.get_sample_size(FORMAT))
-    wf.setframerate(RATE)
-    wf.writeframes(b''.join(frames))
-    audio_buffer.seek(0)  # 返回到开头
-    return audio_buffer  # 返回音频数据流
+    """异步录制一段语音并返回音频数据"""
+    utterances = microphone.utterances()
+    try:
+        return await utterances.__anext__()
+    finally:
+        await utterances.aclose()
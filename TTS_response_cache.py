@@ -0,0 +1,245 @@
+# TTS_response_cache.py
+# 大模型回复缓存：按 (模型, 规范化的提问, 对话上下文哈希) 缓存回复，TTL + LRU 淘汰，可选 SQLite 持久化
+import os
+import re
+import json
+import time
+import queue
+import asyncio
+import sqlite3
+import hashlib
+import logging
+import threading
+import unicodedata
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+# 缓存设置
+RESPONSE_CACHE_SIZE = 512  # 内存中保留的回复条数
+RESPONSE_CACHE_TTL_S = 24 * 3600  # 回复的有效期 (秒)
+RESPONSE_CACHE_DB = os.path.join(os.getcwd(), "cache", "llm_responses.sqlite3")  # 为 None 时只缓存在内存中
+RESPONSE_DB_MAX_ENTRIES = 10000  # 数据库中保留的回复条数上限
+DB_TRIM_INTERVAL = 100  # 每写入多少条检查一次数据库容量
+DB_TOUCH_FLUSH_S = 5.0  # 命中时的 last_used 更新先记在内存中，每隔这段时间由数据库线程一次写入
+# 与时间、日期或实时信息有关的提问不使用缓存
+TIME_SENSITIVE_PATTERN = re.compile(
+    r"现在|几点|时间|今天|明天|昨天|今年|本周|这周|星期|礼拜|日期|几号|天气|气温|新闻|最新|实时|股价|汇率|"
+    r"\b(?:now|today|tomorrow|yesterday|time|date|weather|news|latest)\b",
+    re.IGNORECASE,
+)
+
+
+def normalize_prompt(prompt):
+    """规范化提问：全角转半角、统一大小写，去掉空白和标点，"你是谁？" 与 "你是谁" 视为同一个问题"""
+    prompt = unicodedata.normalize("NFKC", prompt).lower()
+    return "".join(ch for ch in prompt if not (ch.isspace() or unicodedata.category(ch).startswith("P")))
+
+
+def context_hash(context):
+    """对话上下文（消息列表）的哈希，没有上下文时为空字符串"""
+    if not context:
+        return ""
+    return hashlib.sha256(json.dumps(context, ensure_ascii=False, sort_keys=True).encode("utf-8")).hexdigest()[:16]
+
+
+def is_time_sensitive(prompt):
+    return TIME_SENSITIVE_PATTERN.search(prompt) is not None
+
+
+def _set_future(future, result):
+    """在事件循环线程中设置 future 的结果"""
+    if not future.done():
+        future.set_result(result)
+
+
+class ResponseCache:
+    """大模型回复缓存
+
+    键为模型、规范化的提问、对话上下文哈希和回复长度上限的哈希；值为回复文本、写入时间和当初生成的耗时。
+    内存中按 LRU 淘汰，过期条目在读取时丢弃；配置了数据库时写穿到 SQLite，重启后仍可命中。
+    与时间有关的提问和调用方要求绕过的请求既不读也不写缓存。
+    数据库的读写都在单独的线程中执行，内存命中不访问数据库，事件循环不会被磁盘 I/O 阻塞；
+    命中时的 last_used 更新攒起来每 DB_TOUCH_FLUSH_S 秒写入一次。
+    """
+
+    def __init__(self, max_entries=RESPONSE_CACHE_SIZE, ttl_s=RESPONSE_CACHE_TTL_S, db_path=RESPONSE_CACHE_DB):
+        self.max_entries = max_entries
+        self.ttl = ttl_s
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()  # 键 -> (提问, 回复, 写入时间, 生成耗时)
+        self.hits = 0
+        self.exact_hits = 0
+        self.misses = 0
+        self.bypassed = 0
+        self.saved_seconds = 0.0
+        self.writes = 0
+        self.db_path = db_path
+        self.db = None  # 只在数据库线程中使用
+        self.requests = queue.Queue()  # 数据库线程的请求：("load", 键, 事件循环, future) 或 ("put", 行)
+        self.touched = {}  # 键 -> 最近一次命中的时间，尚未写入数据库
+        self.thread = None  # 第一次访问数据库时启动
+
+    def _submit(self, request):
+        with self.lock:
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._run, name="response-cache-db", daemon=True)
+                self.thread.start()
+        self.requests.put(request)
+
+    def _open(self):
+        try:
+            os.makedirs(os.path.dirname(self.db_path), exist_ok=True)
+            self.db = sqlite3.connect(self.db_path)
+            self.db.execute("CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, prompt TEXT, "
+                            "response TEXT, created REAL, latency REAL, last_used REAL)")
+            self.db.execute("DELETE FROM responses WHERE created < ?", (time.time() - self.ttl,))
+            self.db.commit()
+        except (OSError, sqlite3.Error) as e:
+            logger.warning(f"回复缓存数据库不可用，只缓存在内存中: {e}")
+            self.db = None
+            self.db_path = None
+
+    def _run(self):
+        """数据库线程：按顺序执行读取和写入，定期批量写入 last_used"""
+        self._open()
+        flushed_at = time.monotonic()
+        while True:
+            try:
+                request = self.requests.get(timeout=DB_TOUCH_FLUSH_S)
+            except queue.Empty:
+                request = None
+            if request is not None and request[0] == "load":
+                _, key, loop, future = request
+                try:
+                    loop.call_soon_threadsafe(_set_future, future, self._select(key))
+                except RuntimeError:
+                    pass  # 请求方的事件循环已关闭
+            elif request is not None:
+                self._insert(request[1])
+            if time.monotonic() - flushed_at >= DB_TOUCH_FLUSH_S:
+                self._flush_touched()
+                flushed_at = time.monotonic()
+
+    def _select(self, key):
+        if self.db is None:
+            return None
+        try:
+            row = self.db.execute("SELECT prompt, response, created, latency FROM responses WHERE key = ?",
+                                  (key,)).fetchone()
+        except sqlite3.Error as e:
+            logger.warning(f"读取回复缓存失败: {e}")
+            return None
+        return tuple(row) if row is not None else None
+
+    def _insert(self, row):
+        if self.db is None:
+            return
+        try:
+            self.db.execute("INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?)", row)
+            self.writes += 1
+            if self.writes % DB_TRIM_INTERVAL == 0:
+                # 按最近使用时间裁剪前先写入攒下的命中时间
+                self._flush_touched()
+                self.db.execute("DELETE FROM responses WHERE key NOT IN "
+                                "(SELECT key FROM responses ORDER BY last_used DESC LIMIT ?)",
+                                (RESPONSE_DB_MAX_ENTRIES,))
+            self.db.commit()
+        except sqlite3.Error as e:
+            logger.warning(f"写入回复缓存失败: {e}")
+
+    def _flush_touched(self):
+        with self.lock:
+            touched, self.touched = self.touched, {}
+        if not touched or self.db is None:
+            return
+        try:
+            self.db.executemany("UPDATE responses SET last_used = ? WHERE key = ?",
+                                [(used, key) for key, used in touched.items()])
+            self.db.commit()
+        except sqlite3.Error as e:
+            logger.warning(f"更新回复缓存使用时间失败: {e}")
+
+    @staticmethod
+    def key(model, prompt, context=None, max_tokens=None):
+        raw = json.dumps([model, normalize_prompt(prompt), context_hash(context), max_tokens], ensure_ascii=False)
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def bypass(self, prompt, use_cache=True):
+        """该提问是否绕过缓存；绕过的次数计入统计"""
+        if use_cache and not is_time_sensitive(prompt):
+            return False
+        with self.lock:
+            self.bypassed += 1
+        return True
+
+    async def _load(self, key):
+        """内存中没有时由数据库线程读取"""
+        if self.db_path is None:
+            return None
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._submit(("load", key, loop, future))
+        return await future
+
+    async def get(self, key, prompt):
+        """返回缓存的回复，未命中或已过期返回 None；内存命中时不等待数据库"""
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                self.entries.move_to_end(key)
+        if entry is None:
+            entry = await self._load(key)
+        if entry is None or time.time() - entry[2] > self.ttl:
+            with self.lock:
+                self.entries.pop(key, None)
+                self.misses += 1
+            return None
+        with self.lock:
+            self.entries[key] = entry
+            self._evict()
+            self.hits += 1
+            self.exact_hits += entry[0] == prompt
+            self.saved_seconds += entry[3]
+            if self.db_path is not None:
+                self.touched[key] = time.time()
+        return entry[1]
+
+    def put(self, key, prompt, response, latency):
+        """写入一条回复；latency 为这次生成的耗时，命中时计为节省的时间"""
+        if not response:
+            return
+        entry = (prompt, response, time.time(), latency)
+        with self.lock:
+            self.entries[key] = entry
+            self.entries.move_to_end(key)
+            self._evict()
+        if self.db_path is not None:
+            # 由数据库线程写入，调用方不等待
+            self._submit(("put", (key,) + entry + (entry[2],)))
+
+    def _evict(self):
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {"entries": len(self.entries),
+                    "hits": self.hits,
+                    "exact_hits": self.exact_hits,
+                    "normalized_hits": self.hits - self.exact_hits,
+                    "misses": self.misses,
+                    "bypassed": self.bypassed,
+                    "hit_rate": self.hits / lookups if lookups else 0.0,
+                    "saved_seconds": self.saved_seconds}
+
+    def summary(self):
+        stats = self.stats()
+        return (f"回复缓存: 命中率 {stats['hit_rate']:.1%} ({stats['hits']}/{stats['hits'] + stats['misses']}, "
+                f"其中规范化匹配 {stats['normalized_hits']}), 绕过 {stats['bypassed']} 次, "
+                f"节省 {stats['saved_seconds']:.1f} s, {stats['entries']} 条")
+
+
+# 全局回复缓存
+response_cache = ResponseCache()
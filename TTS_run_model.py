@@ -1,26 +1,87 @@
 import os
 import asyncio
+import time
 from openai import AsyncOpenAI
 import platform
 import sys
+from TTS_response_cache import response_cache
 
 client = AsyncOpenAI(
     api_key=os.getenv("DASHSCOPE_API_KEY"),
     base_url="https://dashscope.aliyuncs.com/compatible-mode/v1",
 )
 
-async def get_response(message):
-    """根据用户输入的消息获取AI的响应"""
+MODEL = "qwen-plus"
+
+def _limits(max_tokens):
+    """max_tokens 为 None 时不限制回复长度"""
+    return {} if max_tokens is None else {"max_tokens": max_tokens}
+
+def _messages(message, context):
+    """context 为之前的对话消息列表"""
+    return list(context or []) + [{"role": "user", "content": message}]
+
+async def get_response(message, max_tokens=None, context=None, use_cache=True):
+    """根据用户输入的消息获取AI的响应；重复的提问直接返回缓存的回复，use_cache=False 时绕过缓存"""
+    bypass = response_cache.bypass(message, use_cache)
+    key = response_cache.key(MODEL, message, context, max_tokens)
+    if not bypass:
+        cached = await response_cache.get(key, message)
+        if cached is not None:
+            return cached
+
+    start = time.perf_counter()
     response = await client.chat.completions.create(
-        messages=[{"role": "user", "content": message}],
-        model="qwen-plus",
+        messages=_messages(message, context),
+        model=MODEL,
+        **_limits(max_tokens),
     )
     
     # print(response.model_dump_json())
     # print("_____________")
     content = response.choices[0].message.content
+    if not bypass:
+        response_cache.put(key, message, content, time.perf_counter() - start)
     return content
 
+async def get_response_stream(message, max_tokens=None, context=None, use_cache=True, usage=None):
+    """以流式方式获取AI的响应，逐个产出文本片段；命中缓存时一次产出完整回复
+
+    usage 为字典时，写入模型服务报告的 prompt_tokens 和 completion_tokens（命中缓存时不写入）。
+    """
+    bypass = response_cache.bypass(message, use_cache)
+    key = response_cache.key(MODEL, message, context, max_tokens)
+    if not bypass:
+        cached = await response_cache.get(key, message)
+        if cached is not None:
+            yield cached
+            return
+
+    start = time.perf_counter()
+    stream = await client.chat.completions.create(
+        messages=_messages(message, context),
+        model=MODEL,
+        stream=True,
+        stream_options={"include_usage": True},
+        **_limits(max_tokens),
+    )
+
+    parts = []
+    async for chunk in stream:
+        # 最后一个数据块没有 choices，只带本次请求的 token 用量
+        if usage is not None and getattr(chunk, "usage", None) is not None:
+            usage["prompt_tokens"] = chunk.usage.prompt_tokens
+            usage["completion_tokens"] = chunk.usage.completion_tokens
+        if not chunk.choices:
+            continue
+        content = chunk.choices[0].delta.content
+        if content:
+            parts.append(content)
+            yield content
+    # 只缓存完整接收的回复，中途取消或出错时不会执行到这里
+    if not bypass:
+        response_cache.put(key, message, "".join(parts), time.perf_counter() - start)
+
 async def input_loop():
     """持续接收用户输入并返回AI的响应"""
     print("请输入你的问题，输入'退出'结束程序：")
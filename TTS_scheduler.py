@@ -0,0 +1,208 @@
+# TTS_scheduler.py
+# 多客户端共享模型资源时的公平调度：按阶段限制并发，各会话轮流获得资源
+import asyncio
+import collections
+import contextlib
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+# 阶段名称
+STAGE_LLM = "llm"
+STAGE_TTS = "tts"
+
+# 并发设置
+LLM_MAX_IN_FLIGHT = 4  # 同时进行的模型请求数
+TTS_SLOTS = 4  # 同时提交到 TTS 合批队列的句子数，与单批句子数上限一致，不同会话的句子可以合成一批
+TIMING_SAMPLES = 500  # 统计等待时间和占用时间时保留的最近样本数
+
+
+def _percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+class Stage:
+    """一个共享资源阶段：最多 capacity 个任务同时占用，其余按会话排队"""
+
+    def __init__(self, name, capacity):
+        self.name = name
+        self.capacity = capacity
+        self.in_use = 0
+        self.waiters = {}  # 会话 -> 等待中的 future 队列
+        self.rotation = collections.deque()  # 有等待任务的会话，队首为当前轮到的会话
+        self.turn_grants = 0  # 队首会话在本轮已获得的次数
+        self.wait_times = collections.deque(maxlen=TIMING_SAMPLES)  # 排队等待时间 (秒)
+        self.service_times = collections.deque(maxlen=TIMING_SAMPLES)  # 占用资源的时间 (秒)
+        self.granted = 0
+        self.cancelled = 0
+
+    def queue_depth(self):
+        return sum(len(queue) for queue in self.waiters.values())
+
+    def stats(self):
+        stats = {"capacity": self.capacity,
+                 "in_use": self.in_use,
+                 "queue_depth": self.queue_depth(),
+                 "sessions_waiting": len(self.rotation),
+                 "granted": self.granted,
+                 "cancelled": self.cancelled}
+        for key, values in (("wait", self.wait_times), ("service", self.service_times)):
+            if values:
+                stats[f"{key}_avg_ms"] = sum(values) / len(values) * 1000
+                stats[f"{key}_p95_ms"] = _percentile(values, 0.95) * 1000
+                stats[f"{key}_max_ms"] = max(values) * 1000
+        return stats
+
+
+class RequestScheduler:
+    """按阶段限制并发的公平调度器
+
+    资源空出时在有等待任务的会话之间轮转分配，每个会话每轮最多连续获得 weight 次，
+    因此一个连续发送请求的客户端不会占满合成器。客户端断开时取消它所有排队中的任务。
+    所有方法都在同一个事件循环中调用。
+    """
+
+    def __init__(self, capacities):
+        self.stages = {name: Stage(name, capacity) for name, capacity in capacities.items()}
+        self.weights = {}  # 会话 -> 权重
+
+    def register_session(self, session, weight=1):
+        self.weights[session] = max(1, int(weight))
+
+    def close_session(self, session):
+        """会话结束：取消它在所有阶段中排队的任务"""
+        self.weights.pop(session, None)
+        for stage in self.stages.values():
+            queue = stage.waiters.pop(session, None)
+            if queue is None:
+                continue
+            self._remove_from_rotation(stage, session)
+            for future in queue:
+                future.cancel()
+
+    @contextlib.asynccontextmanager
+    async def slot(self, stage_name, session):
+        """占用一个阶段的资源：async with scheduler.slot(STAGE_TTS, session): ..."""
+        stage = self.stages[stage_name]
+        start = time.perf_counter()
+        if stage.in_use < stage.capacity and not stage.rotation:
+            stage.in_use += 1
+        else:
+            future = asyncio.get_running_loop().create_future()
+            queue = stage.waiters.setdefault(session, collections.deque())
+            if not queue:
+                stage.rotation.append(session)
+            queue.append(future)
+            try:
+                # 分配时由 _grant 计入 in_use
+                await future
+            except asyncio.CancelledError:
+                stage.cancelled += 1
+                if future.done() and not future.cancelled():
+                    # 刚分配到资源就被取消，交给下一个任务
+                    self._release(stage)
+                else:
+                    self._remove(stage, session, future)
+                raise
+        granted_at = time.perf_counter()
+        stage.wait_times.append(granted_at - start)
+        stage.granted += 1
+        try:
+            yield
+        finally:
+            stage.service_times.append(time.perf_counter() - granted_at)
+            self._release(stage)
+
+    async def hold(self, stage_name, session, stream):
+        """在生成流式结果期间占用资源，用于流式的模型请求
+
+        后台任务占用资源并把整个流读入无界队列，生成结束立即释放资源；
+        调用方按自己的节奏（例如合成和播放的速度）从队列中读取，不会让其他会话等它播放完。
+        调用方提前关闭迭代时取消后台任务；只是丢弃迭代器时，后台任务读完流后照常释放资源。
+        """
+        queue = asyncio.Queue()
+        task = asyncio.create_task(self._pump(stage_name, session, stream, queue))
+        try:
+            while True:
+                done, item = await queue.get()
+                if done:
+                    if item is not None:
+                        raise item
+                    return
+                yield item
+        finally:
+            if not task.done():
+                task.cancel()
+                await asyncio.gather(task, return_exceptions=True)
+
+    async def _pump(self, stage_name, session, stream, queue):
+        """占用资源期间把流中的每一项放入队列，结束时放入 (True, 异常或 None)"""
+        try:
+            async with self.slot(stage_name, session):
+                async for item in stream:
+                    queue.put_nowait((False, item))
+            queue.put_nowait((True, None))
+        except asyncio.CancelledError:
+            # 会话关闭时排队中的请求被取消，调用方同样收到取消
+            queue.put_nowait((True, asyncio.CancelledError()))
+            raise
+        except Exception as e:
+            queue.put_nowait((True, e))
+        finally:
+            aclose = getattr(stream, "aclose", None)
+            if aclose is not None:
+                await aclose()
+
+    def _release(self, stage):
+        stage.in_use -= 1
+        self._grant(stage)
+
+    def _grant(self, stage):
+        while stage.in_use < stage.capacity and stage.rotation:
+            session = stage.rotation[0]
+            queue = stage.waiters[session]
+            future = queue.popleft()
+            stage.in_use += 1
+            future.set_result(None)
+            stage.turn_grants += 1
+            if not queue:
+                del stage.waiters[session]
+                stage.rotation.popleft()
+                stage.turn_grants = 0
+            elif stage.turn_grants >= self.weights.get(session, 1):
+                # 本轮次数用完，排到队尾
+                stage.rotation.rotate(-1)
+                stage.turn_grants = 0
+
+    def _remove(self, stage, session, future):
+        queue = stage.waiters.get(session)
+        if queue is None or future not in queue:
+            return
+        queue.remove(future)
+        if not queue:
+            del stage.waiters[session]
+            self._remove_from_rotation(stage, session)
+
+    def _remove_from_rotation(self, stage, session):
+        if stage.rotation and stage.rotation[0] == session:
+            stage.turn_grants = 0
+        stage.rotation.remove(session)
+
+    def stats(self):
+        return {name: stage.stats() for name, stage in self.stages.items()}
+
+    def summary(self):
+        parts = []
+        for name, stats in self.stats().items():
+            part = (f"{name}: 占用 {stats['in_use']}/{stats['capacity']}, 排队 {stats['queue_depth']} "
+                    f"({stats['sessions_waiting']} 个会话), 已分配 {stats['granted']}, 已取消 {stats['cancelled']}")
+            if "wait_avg_ms" in stats:
+                part += f", 等待 平均 {stats['wait_avg_ms']:.0f} ms / p95 {stats['wait_p95_ms']:.0f} ms"
+            parts.append(part)
+        return "调度器 " + "; ".join(parts)
+
+
+# 全局调度器
+request_scheduler = RequestScheduler({STAGE_LLM: LLM_MAX_IN_FLIGHT, STAGE_TTS: TTS_SLOTS})
@@ -0,0 +1,70 @@
+# TTS_sentence_splitter.py
+# 将大模型流式输出的文本片段切分为可以立即合成的句子/分句
+
+# 句末标点：遇到即切分
+SENTENCE_ENDINGS = "。！？!?；;\n…"
+# 分句标点：当前片段足够长时才切分，避免过短的片段影响韵律
+CLAUSE_ENDINGS = "，,、：:"
+MIN_CLAUSE_LENGTH = 8  # 分句切分的最小字符数
+# 紧跟在句末标点后的闭合符号，应归入当前句子
+CLOSING_MARKS = "”’\"')）】」』"
+
+
+def _find_break(buffer):
+    """返回 buffer 中第一个可切分位置（切分点之后的下标），没有则返回 -1"""
+    for i, ch in enumerate(buffer):
+        if ch in SENTENCE_ENDINGS:
+            end = i + 1
+        elif ch == "." and i + 1 < len(buffer) and buffer[i + 1].isspace():
+            # 英文句号只有后面跟空白时才视为句末，避免切断小数和缩写
+            end = i + 1
+        elif ch in CLAUSE_ENDINGS and len(buffer[:i].strip()) >= MIN_CLAUSE_LENGTH:
+            end = i + 1
+        else:
+            continue
+        # 把连续的标点和闭合符号一起带上，例如 "！！" 或 "。」"
+        while end < len(buffer) and (buffer[end] in SENTENCE_ENDINGS or buffer[end] in CLOSING_MARKS):
+            end += 1
+        if end == len(buffer):
+            # 标点位于末尾时，后续片段可能还有闭合符号，除非是换行
+            if buffer[-1] != "\n":
+                return -1
+        return end
+    return -1
+
+
+def _pop_sentences(buffer):
+    """从 buffer 中切出所有完整的句子，返回 (句子列表, 剩余文本)"""
+    sentences = []
+    while True:
+        end = _find_break(buffer)
+        if end < 0:
+            break
+        sentence = buffer[:end].strip()
+        buffer = buffer[end:]
+        if sentence:
+            sentences.append(sentence)
+    return sentences, buffer
+
+
+def split_text(text):
+    """将完整文本切分为句子列表"""
+    sentences, rest = _pop_sentences(text)
+    rest = rest.strip()
+    if rest:
+        sentences.append(rest)
+    return sentences
+
+
+async def split_sentences(token_stream):
+    """异步切分流式文本，每当一个句子/分句闭合时立即产出"""
+    buffer = ""
+    async for token in token_stream:
+        buffer += token
+        sentences, buffer = _pop_sentences(buffer)
+        for sentence in sentences:
+            yield sentence
+
+    # 流结束，输出剩余文本
+    for sentence in split_text(buffer):
+        yield sentence
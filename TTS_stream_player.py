@@ -0,0 +1,120 @@
+# TTS_stream_player.py
+# 客户端播放服务端发来的流式音频，带抖动缓冲
+import logging
+import threading
+import time
+import numpy as np
+from TTS_audio_frame import AudioFrame
+from TTS_audio_output import AudioOutput
+
+logger = logging.getLogger(__name__)
+
+# 抖动缓冲设置
+JITTER_BUFFER_MS = 150  # 开始播放（以及欠载后恢复播放）前至少缓冲的音频长度 (毫秒)
+
+
+class StreamPlayer:
+    """按请求接收音频块并播放
+
+    收到第一个音频块后先缓冲 JITTER_BUFFER_MS 再开始写入输出设备，吸收网络抖动；
+    播放中缓冲区被读空（数据没有及时到达）时重新进入缓冲状态。
+    同一时刻只播放一个请求的音频，新请求的音频到达时丢弃旧请求未播放的部分。
+    请求 ID 递增分配，ID 较小的请求是旧回复，之后再到达的音频直接忽略，不会打断新回复。
+    """
+
+    def __init__(self, jitter_buffer_ms=JITTER_BUFFER_MS):
+        self.jitter_buffer_ms = jitter_buffer_ms
+        self.output = AudioOutput()
+        self.lock = threading.Lock()
+        self.request_id = None  # 当前播放的请求
+        self.latest_id = None  # 开始播放过的最新请求，更早的请求不再播放
+        self.sample_rate = None
+        self.pending = []  # 缓冲中、尚未写入输出设备的音频块
+        self.pending_samples = 0
+        self.buffering = True
+        self.sent_at = {}  # 请求 ID -> 发送时刻，用于统计首块延迟
+        self.first_chunk_latencies = []  # 发送请求到开始播放的时间 (秒)
+        self.rebuffers = 0
+
+    def request_sent(self, request_id):
+        """记录请求发送时刻"""
+        with self.lock:
+            self.sent_at[request_id] = time.perf_counter()
+
+    def begin(self, request_id, sample_rate):
+        """一个新句子开始，之后的音频块为该采样率"""
+        with self.lock:
+            if self.latest_id is not None and request_id < self.latest_id:
+                return  # 旧回复的句子，已被更新的回复取代
+            self.latest_id = request_id
+            if request_id != self.request_id:
+                if self.request_id is not None:
+                    # 新的回复到达，丢弃旧回复
+                    self.output.clear()
+                self.request_id = request_id
+                self.pending = []
+                self.pending_samples = 0
+                self.buffering = True
+            elif sample_rate != self.sample_rate:
+                self._flush(final=True)
+            self.sample_rate = sample_rate
+
+    def feed(self, request_id, data):
+        """收到一个 int16 PCM 音频块"""
+        with self.lock:
+            if request_id != self.request_id or self.sample_rate is None:
+                return  # 已被更新的回复取代
+            frame = AudioFrame.from_bytes(data, self.sample_rate)
+            if not self.buffering and self.output.queued_samples() == 0:
+                # 播放已追上接收，重新缓冲
+                self.rebuffers += 1
+                self.buffering = True
+            if not self.buffering:
+                self.output.write(frame, final=False)
+                return
+            self.pending.append(frame)
+            self.pending_samples += len(frame)
+            if self.pending_samples * 1000 >= self.jitter_buffer_ms * self.sample_rate:
+                self._flush(final=False)
+
+    def finish(self, request_id):
+        """该请求的音频已全部收到，播放缓冲中剩余的部分"""
+        with self.lock:
+            if request_id == self.request_id:
+                self._flush(final=True)
+                self.request_id = None
+            self.sent_at.pop(request_id, None)
+
+    def _flush(self, final):
+        sent_at = self.sent_at.pop(self.request_id, None)
+        if sent_at is not None and self.pending:
+            latency = time.perf_counter() - sent_at
+            self.first_chunk_latencies.append(latency)
+            logger.info(f"请求 {self.request_id} 开始播放，首块延迟 {latency * 1000:.0f} ms")
+        for index, frame in enumerate(self.pending):
+            self.output.write(frame, final=final and index == len(self.pending) - 1)
+        if final and not self.pending:
+            self.output.write(AudioFrame(np.zeros(0, dtype=np.int16), self.output.sample_rate), final=True)
+        self.pending = []
+        self.pending_samples = 0
+        self.buffering = False
+
+    def stop(self):
+        """立即停止播放"""
+        with self.lock:
+            self.request_id = None
+            self.pending = []
+            self.pending_samples = 0
+            self.output.clear()
+
+    def summary(self):
+        latencies = sorted(self.first_chunk_latencies)
+        if not latencies:
+            return "流式播放: 无"
+        return (f"流式播放: 首块延迟 中位数 {latencies[len(latencies) // 2] * 1000:.0f} ms, "
+                f"重新缓冲 {self.rebuffers} 次, 输出欠载 {self.output.underruns} 次")
+
+    def close(self):
+        self.stop()
+        self.output.close()
+        logger.info(self.summary())
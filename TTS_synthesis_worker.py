@@ -0,0 +1,398 @@
+# TTS_synthesis_worker.py
+# TTS 工作进程：合成在独立进程中执行，任务经有界队列分发，PCM 通过共享内存返回，进程退出或卡死后自动重启
+import itertools
+import logging
+import multiprocessing
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from multiprocessing import shared_memory
+import numpy as np
+from TTS_audio_frame import AudioFrame
+
+logger = logging.getLogger(__name__)
+
+# 工作进程设置
+TTS_WORKER_PROCESSES = 1  # 工作进程数，每个进程各自加载模型；为 0 时在服务进程内合成
+TTS_WORKER_QUEUE_SIZE = 2  # 每个工作进程排队的任务数上限，队列都满时提交方等待
+TTS_WORKER_TASK_TIMEOUT_S = 120  # 工作进程开始执行任务后超过该时间仍未返回，视为卡死，结束并重启工作进程
+TTS_WORKER_RESTART_DELAY_S = 1.0  # 工作进程退出后重启前的等待时间，避免反复崩溃时占满 CPU
+SUPERVISE_INTERVAL_S = 0.5
+CONTROL_POLL_S = 0.2  # 空闲的工作进程每隔多久检查控制队列（预加载请求、已读取的共享内存块）
+WORKER_STATS_INTERVAL_S = 5.0  # 工作进程忙碌时最多每隔这段时间回报一次统计，空闲时立即回报
+
+# 任务类型
+TASK_SYNTHESIZE = "synthesize"
+TASK_STREAM = "stream"
+# 服务进程发给工作进程的控制消息，经无界的控制队列发送，不占任务队列的位置
+CONTROL_RELEASE = "release"  # 服务进程已读取该共享内存块
+CONTROL_PREFETCH = "prefetch"  # 后台预加载角色模型
+# 工作进程回报的消息类型
+RESULT_STARTED = "started"  # 开始执行任务，超时从此刻计算
+RESULT_BATCH = "batch"  # 一批的全部结果和纯合成耗时
+RESULT_CHUNK = "chunk"  # 流式合成的一段音频
+RESULT_END = "end"  # 流式合成结束，附纯合成耗时
+RESULT_ERROR = "error"
+RESULT_STATS = "stats"  # 工作进程中模型常驻、参考音频特征和文本前端缓存的统计
+
+
+def _export_frame(frame):
+    """把 PCM 写入新建的共享内存块，返回 (共享内存块, (块名, dtype, 形状, 采样率))
+
+    调用方要保持块打开，直到接收方确认已读取：Windows 上最后一个句柄关闭时块即被释放，
+    先关闭的话服务进程打开时块已经不存在。
+    """
+    samples = np.ascontiguousarray(frame.samples)
+    block = shared_memory.SharedMemory(create=True, size=max(1, samples.nbytes))
+    np.ndarray(samples.shape, samples.dtype, buffer=block.buf)[:] = samples
+    return block, (block.name, samples.dtype.str, samples.shape, frame.sample_rate)
+
+
+def _drain_control(worker_id, control, exported, prefetch):
+    """处理控制队列：关闭服务进程已确认读取的共享内存块，执行预加载请求（同一角色只执行一次）"""
+    characters = {}
+    while True:
+        try:
+            kind, value = control.get_nowait()
+        except queue.Empty:
+            break
+        if kind == CONTROL_RELEASE:
+            block = exported.pop(value, None)
+            if block is not None:
+                block.close()
+        else:
+            characters[value] = None
+    if prefetch is None:
+        return
+    for character in characters:
+        try:
+            prefetch(character)
+        except Exception as e:
+            logger.warning(f"工作进程 {worker_id} 预加载失败 {character}: {e}")
+
+
+def _merge_stats(values):
+    """汇总各工作进程的统计：数值相加，列表拼接，命中率按合计的命中和未命中重新计算"""
+    first = values[0]
+    if isinstance(first, dict):
+        merged = {key: _merge_stats([value[key] for value in values if key in value]) for key in first}
+        if "hit_rate" in merged and "hits" in merged and "misses" in merged:
+            lookups = merged["hits"] + merged["misses"]
+            merged["hit_rate"] = merged["hits"] / lookups if lookups else 0.0
+        return merged
+    if isinstance(first, list):
+        return [item for value in values for item in value]
+    if isinstance(first, (int, float)) and not isinstance(first, bool):
+        return sum(values)
+    return first
+
+
+def _import_frame(spec):
+    """从共享内存块复制出 AudioFrame，并删除该块的名字；之后由发送方关闭自己的句柄"""
+    name, dtype, shape, sample_rate = spec
+    block = shared_memory.SharedMemory(name=name)
+    try:
+        samples = np.array(np.ndarray(shape, np.dtype(dtype), buffer=block.buf))
+    finally:
+        block.close()
+        block.unlink()
+    return AudioFrame(samples, sample_rate)
+
+
+def _worker_main(worker_id, tasks, control, results, synthesize_batch, stream, prefetch, stats):
+    """工作进程主循环：逐个执行任务，音频写入共享内存，只把块名回报给服务进程
+
+    服务进程读取音频后把块名放入 control，这里再关闭对应的共享内存块；预加载请求也经 control 送达。
+    stats() 的结果在任务完成后回报给服务进程。
+    """
+    exported = {}  # 块名 -> 尚未确认读取的共享内存块
+    reported_at = time.monotonic()
+    dirty = True  # 上次回报后统计是否可能有变化
+
+    def export(frame):
+        # 长时间的流式任务中也及时关闭已读取的块
+        _drain_control(worker_id, control, exported, prefetch)
+        block, spec = _export_frame(frame)
+        exported[block.name] = block
+        return spec
+
+    while True:
+        _drain_control(worker_id, control, exported, prefetch)
+        try:
+            task = tasks.get(timeout=CONTROL_POLL_S)
+        except queue.Empty:
+            task = False
+        if stats is not None and dirty and (task is False or time.monotonic() - reported_at >= WORKER_STATS_INTERVAL_S):
+            try:
+                results.put((worker_id, None, RESULT_STATS, stats()))
+            except Exception as e:
+                logger.warning(f"工作进程 {worker_id} 统计失败: {e}")
+            reported_at = time.monotonic()
+            dirty = False
+        if task is False:
+            continue
+        if task is None:
+            break
+        task_id, kind, payload = task
+        dirty = True
+        results.put((worker_id, task_id, RESULT_STARTED, None))
+        # 合成函数把不含排队和模型加载的纯合成耗时写入 timing["seconds"]
+        timing = {}
+        try:
+            if kind == TASK_STREAM:
+                # 合成器每生成一段就回报，服务进程不必等整句合成完
+                for frame in stream(payload, timing):
+                    results.put((worker_id, task_id, RESULT_CHUNK, export(frame)))
+                results.put((worker_id, task_id, RESULT_END, timing.get("seconds")))
+            else:
+                items = [("error", str(result)) if isinstance(result, Exception) else ("ok", export(result))
+                         for result in synthesize_batch(payload, timing)]
+                results.put((worker_id, task_id, RESULT_BATCH, (items, timing.get("seconds"))))
+        except Exception as e:
+            results.put((worker_id, task_id, RESULT_ERROR, str(e)))
+
+
+class _Worker:
+    """一个工作进程及其任务队列和未完成任务"""
+
+    def __init__(self, worker_id):
+        self.id = worker_id
+        self.process = None
+        self.tasks = None
+        self.control = None  # 控制消息（已读取的共享内存块、预加载请求），无界
+        self.synthesis_stats = None  # 工作进程最近一次回报的统计
+        self.in_flight = {}  # 任务编号 -> [future, 开始执行或最近一次收到音频的时间（排队中为 None）, 流式音频回调]
+        self.completed = 0
+        self.restarts = 0
+
+
+class SynthesisWorkerPool:
+    """TTS 工作进程池
+
+    synthesize_batch(请求列表, timing) 在工作进程中执行，返回与请求一一对应的 AudioFrame 或异常；
+    stream(请求, timing) 在工作进程中逐段产出 AudioFrame；两者把纯合成耗时写入 timing["seconds"]。
+    prefetch(角色) 在工作进程中预加载模型；stats() 返回工作进程中的统计，由 stats() 汇总。
+    它们都必须是可按名称导入的模块级函数。
+    服务进程只负责分发任务和接收结果，事件循环不会被推理或 GIL 阻塞；
+    工作进程异常退出或卡死时，其未完成的任务以 RuntimeError 结束，进程随后重启。
+    """
+
+    def __init__(self, synthesize_batch, stream=None, prefetch=None, stats=None, processes=TTS_WORKER_PROCESSES,
+                 queue_size=TTS_WORKER_QUEUE_SIZE, task_timeout_s=TTS_WORKER_TASK_TIMEOUT_S,
+                 restart_delay_s=TTS_WORKER_RESTART_DELAY_S):
+        self.synthesize_batch = synthesize_batch
+        self.stream_fn = stream
+        self.prefetch_fn = prefetch
+        self.stats_fn = stats
+        self.queue_size = queue_size
+        self.task_timeout = task_timeout_s
+        self.restart_delay = restart_delay_s
+        # CUDA 不能在 fork 出的子进程中使用，统一用 spawn
+        self.context = multiprocessing.get_context("spawn")
+        self.lock = threading.Lock()
+        self.slots = threading.BoundedSemaphore(max(1, processes * queue_size))
+        self.workers = [_Worker(worker_id) for worker_id in range(processes)]
+        self.task_ids = itertools.count()
+        self.results = None
+        self.started = False
+        self.failed = 0
+
+    def start(self):
+        """第一次使用时启动工作进程和结果接收、监控线程"""
+        with self.lock:
+            if self.started:
+                return
+            self.results = self.context.Queue()
+            for worker in self.workers:
+                worker.tasks = self.context.Queue(self.queue_size)
+                worker.control = self.context.Queue()
+                self._spawn(worker)
+            self.started = True
+        threading.Thread(target=self._receive, name="tts-worker-results", daemon=True).start()
+        threading.Thread(target=self._supervise, name="tts-worker-supervisor", daemon=True).start()
+
+    def _spawn(self, worker):
+        worker.process = self.context.Process(
+            target=_worker_main,
+            args=(worker.id, worker.tasks, worker.control, self.results,
+                  self.synthesize_batch, self.stream_fn, self.prefetch_fn, self.stats_fn),
+            name=f"tts-worker-{worker.id}",
+            daemon=True,
+        )
+        worker.process.start()
+        logger.info(f"TTS 工作进程 {worker.id} 已启动, pid {worker.process.pid}")
+
+    def _submit(self, kind, payload, on_chunk=None):
+        self.start()
+        # 所有工作进程的队列都满时在这里等待，压力传回提交方
+        self.slots.acquire()
+        future = Future()
+        future.add_done_callback(lambda _: self.slots.release())
+        with self.lock:
+            worker = min(self.workers, key=lambda worker: len(worker.in_flight))
+            task_id = next(self.task_ids)
+            worker.in_flight[task_id] = [future, None, on_chunk]
+            try:
+                worker.tasks.put_nowait((task_id, kind, payload))
+            except queue.Full:
+                del worker.in_flight[task_id]
+                future.set_exception(RuntimeError("TTS 工作进程队列已满"))
+        return future.result()
+
+    def run(self, batch, timing=None):
+        """在工作进程中合成一批，阻塞到结果返回；不能在事件循环线程中调用
+
+        传入 timing 时，工作进程报告的纯合成耗时写入 timing["seconds"]。
+        """
+        outputs, seconds = self._submit(TASK_SYNTHESIZE, batch)
+        if timing is not None and seconds is not None:
+            timing["seconds"] = seconds
+        return outputs
+
+    def stream(self, data, on_chunk, timing=None):
+        """在工作进程中流式合成一句，每收到一段音频调用 on_chunk(AudioFrame)，阻塞到合成结束"""
+        seconds = self._submit(TASK_STREAM, data, on_chunk)
+        if timing is not None and seconds is not None:
+            timing["seconds"] = seconds
+
+    def prefetch(self, character):
+        """让所有工作进程在后台加载角色模型；经控制队列发送，不占任务队列的位置，不阻塞调用方"""
+        self.start()
+        with self.lock:
+            for worker in self.workers:
+                worker.control.put((CONTROL_PREFETCH, character))
+        return True
+
+    def _receive(self):
+        """接收工作进程的结果，从共享内存取出音频，完成对应的 future"""
+        while True:
+            worker_id, task_id, kind, value = self.results.get()
+            worker = self.workers[worker_id]
+            if kind == RESULT_STATS:
+                worker.synthesis_stats = value
+                continue
+            if kind == RESULT_STARTED:
+                with self.lock:
+                    entry = worker.in_flight.get(task_id)
+                    if entry is not None:
+                        entry[1] = time.monotonic()
+                continue
+            if kind == RESULT_CHUNK:
+                try:
+                    frame = self._import(worker, value)
+                except (OSError, ValueError) as e:
+                    logger.error(f"读取共享内存失败: {e}")
+                    continue
+                with self.lock:
+                    entry = worker.in_flight.get(task_id)
+                    if entry is not None:
+                        entry[1] = time.monotonic()  # 流式任务持续有输出，不算卡死
+                if entry is not None:
+                    entry[2](frame)
+                continue
+            if kind == RESULT_BATCH:
+                items, seconds = value
+                outputs = []
+                for status, item in items:
+                    try:
+                        outputs.append(self._import(worker, item) if status == "ok" else RuntimeError(item))
+                    except (OSError, ValueError) as e:
+                        outputs.append(RuntimeError(f"读取共享内存失败: {e}"))
+                outcome = (outputs, seconds)
+            elif kind == RESULT_END:
+                outcome = value
+            else:
+                outcome = RuntimeError(value)
+            with self.lock:
+                entry = worker.in_flight.pop(task_id, None)
+                if entry is not None:
+                    worker.completed += 1
+            if entry is None:
+                continue  # 任务已因超时被放弃
+            if isinstance(outcome, Exception):
+                entry[0].set_exception(outcome)
+            else:
+                entry[0].set_result(outcome)
+
+    def _import(self, worker, spec):
+        """读取工作进程写入的音频，并通知它关闭该共享内存块"""
+        try:
+            return _import_frame(spec)
+        finally:
+            worker.control.put((CONTROL_RELEASE, spec[0]))
+
+    def _supervise(self):
+        """定期检查工作进程，退出或卡死的进程重启"""
+        while True:
+            time.sleep(SUPERVISE_INTERVAL_S)
+            now = time.monotonic()
+            for worker in self.workers:
+                if worker.process.is_alive():
+                    with self.lock:
+                        # 只计算已开始执行的任务，排在其他任务之后等待的时间不算
+                        oldest = min((entry[1] for entry in worker.in_flight.values() if entry[1] is not None),
+                                     default=now)
+                    if now - oldest <= self.task_timeout:
+                        continue
+                    logger.error(f"TTS 工作进程 {worker.id} 超过 {self.task_timeout} s 未返回，结束进程")
+                    worker.process.kill()
+                    worker.process.join()
+                else:
+                    logger.error(f"TTS 工作进程 {worker.id} 已退出, 退出码 {worker.process.exitcode}")
+                self._restart(worker)
+
+    def _restart(self, worker):
+        with self.lock:
+            failed = worker.in_flight
+            worker.in_flight = {}
+            # 旧队列可能留有未读数据，换新队列；重启等待期间提交的任务进入新队列，进程启动后执行
+            old_tasks = worker.tasks
+            worker.tasks = self.context.Queue(self.queue_size)
+            # 旧进程持有的共享内存块随进程退出释放，统计随进程重新开始
+            worker.control = self.context.Queue()
+            worker.synthesis_stats = None
+            worker.restarts += 1
+            self.failed += len(failed)
+        old_tasks.cancel_join_thread()
+        old_tasks.close()
+        for future, _, _ in failed.values():
+            future.set_exception(RuntimeError("TTS 工作进程退出或超时，请求未完成"))
+        time.sleep(self.restart_delay)
+        with self.lock:
+            self._spawn(worker)
+
+    def close(self):
+        """通知工作进程退出"""
+        if not self.started:
+            return
+        for worker in self.workers:
+            try:
+                worker.tasks.put_nowait(None)
+            except queue.Full:
+                worker.process.terminate()
+        for worker in self.workers:
+            worker.process.join(timeout=5)
+
+    def stats(self):
+        with self.lock:
+            workers = [{"id": worker.id,
+                        "pid": worker.process.pid if worker.process is not None else None,
+                        "alive": worker.process is not None and worker.process.is_alive(),
+                        "in_flight": len(worker.in_flight),
+                        "completed": worker.completed,
+                        "restarts": worker.restarts,
+                        "synthesis": worker.synthesis_stats} for worker in self.workers]
+            reported = [worker["synthesis"] for worker in workers if worker["synthesis"] is not None]
+            return {"workers": workers,
+                    "completed": sum(worker["completed"] for worker in workers),
+                    "in_flight": sum(worker["in_flight"] for worker in workers),
+                    "restarts": sum(worker["restarts"] for worker in workers),
+                    "failed": self.failed,
+                    "synthesis": _merge_stats(reported) if reported else None}
+
+    def summary(self):
+        stats = self.stats()
+        alive = sum(1 for worker in stats["workers"] if worker["alive"])
+        return (f"TTS 工作进程: {alive}/{len(stats['workers'])} 个运行中, 完成 {stats['completed']} 个任务, "
+                f"进行中 {stats['in_flight']}, 重启 {stats['restarts']} 次, 因进程退出失败 {stats['failed']} 个任务")
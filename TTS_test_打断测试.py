@@ -1,9 +1,14 @@
 import asyncio
 import threading
 import logging
-from Gptsovit_tts import get_characters_and_emotions, text_to_speech, sound_lock, current_sound 
-from Run_model import get_response  # 导入 get_response 函数
-from Funasr_recognize import record_audio, transcribe_audio  # 导入录音和转录函数
+import time
+from TTS_gptsovits_voice import get_characters_and_emotions, text_to_speech_stream
+from TTS_run_model import get_response_stream  # 导入流式 get_response 函数
+from TTS_sentence_splitter import split_sentences
+from TTS_Funasr import transcribe_stream  # 导入流式转录函数
+from TTS_record_audio import microphone  # 导入常驻麦克风采集服务
+from TTS_playback_scheduler import playback_scheduler  # 导入播放调度器
+from TTS_vad import SPEECH_START
 
 # 初始化日志
 logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(message)s")
@@ -16,54 +21,104 @@ def input_thread(loop):
 
 # TTS_test_打断测试.py
 
-async def input_loop(character, emotion):
-    """持续接收用户输入并返回AI的响应"""
-    logger.info("开始语音输入，请说话，输入'退出'结束程序：")
-    while True:
-        audio_buffer = await record_audio()  # 获取用户的语音输入
-        if audio_buffer is not None:
-            # 停止当前音频播放
-            with sound_lock:
-                if current_sound is not None:
-                    current_sound.stop()
-
-            user_input = await transcribe_audio(audio_buffer)  # 转录音频为文本
+class BargeInSession:
+    """支持打断的语音对话
+
+    播放回复时麦克风保持开启，端点检测在播放期间提高阈值（回声门限），
+    一旦检测到用户开始说话，立即停止播放、取消正在进行的模型请求和语音合成，
+    并继续录入用户的新一轮输入。
+    """
+
+    def __init__(self, character, emotion):
+        self.character = character
+        self.emotion = emotion
+        self.reply_task = None
+        self.cancel_latencies = []  # 检测到说话到扬声器静音的时间 (秒)
+
+    def reply_active(self):
+        return self.reply_task is not None and not self.reply_task.done()
+
+    async def reply(self, user_input):
+        """获取AI响应并逐句播放"""
+        logger.info("\n正在调用模型生成回复，回复将逐句以语音输出...")
+        try:
+            sentences = split_sentences(get_response_stream(user_input))
+            response = await text_to_speech_stream(sentences, self.character, self.emotion)
+            logger.info(f"AI回复: {response}")
+        except asyncio.CancelledError:
+            logger.info("回复已取消")
+            raise
+        except Exception as e:
+            logger.error(f"生成回复时出错: {e}")
+
+    def barge_in(self, detected_at):
+        """打断当前回复：先静音，再取消模型请求和待合成的句子"""
+        # 回调开始输出静音时记录耗时：检测到说话到静音的时间，再加上设备的输出延迟
+        if not playback_scheduler.stop_now(lambda silenced_at: self._record_latency(silenced_at - detected_at)):
+            self._record_latency(time.perf_counter() - detected_at)
+        self.reply_task.cancel()
+
+    def _record_latency(self, elapsed):
+        latency = elapsed + playback_scheduler.output.output_latency()
+        self.cancel_latencies.append(latency)
+        logger.info(f"检测到用户说话，已打断回复，打断到静音耗时 {latency * 1000:.1f} ms")
+
+    async def watch(self, speech_events):
+        """透传端点检测事件，在回复进行中检测到开始说话时触发打断"""
+        async for event, utterance in speech_events:
+            if event == SPEECH_START and self.reply_active():
+                self.barge_in(time.perf_counter())
+            yield event, utterance
+
+    async def run(self):
+        """持续接收用户输入并返回AI的响应"""
+        logger.info("开始语音输入，请说话，AI说话时可随时打断，说'退出'结束程序：")
+        speech_events = microphone.speech_events(echo_gate=playback_scheduler.is_playing)
+        async for kind, user_input in transcribe_stream(self.watch(speech_events)):
+            if kind == "partial":
+                logger.info(f"识别中: {user_input}")
+                continue
             logger.info(f"用户输入: {user_input}")
 
             if user_input.lower() == '退出。':
                 logger.info("退出程序。")
                 break
 
-            # 获取AI响应
-            logger.info("\n正在调用模型生成回复...")
-            response = await get_response(user_input)  # 使用异步获取AI的回复
-            logger.info(f"AI回复: {response}")
+            if self.reply_active():
+                # 说话过短未触发打断时，也以新的输入为准
+                self.barge_in(time.perf_counter())
+            self.reply_task = asyncio.create_task(self.reply(user_input))
 
-            # 使用TTS模块进行语音播放
-            logger.info("\n生成的模型回复将以语音输出...")
-            await text_to_speech(response, character, emotion)
-        else:
-            logger.info("没有检测到有效声音输入，重试...")
+        if self.reply_active():
+            self.reply_task.cancel()
+        if self.cancel_latencies:
+            latencies = sorted(self.cancel_latencies)
+            logger.info(f"打断 {len(latencies)} 次, 打断到静音耗时 中位数 "
+                        f"{latencies[len(latencies) // 2] * 1000:.1f} ms, 最大 {latencies[-1] * 1000:.1f} ms")
+
+async def input_loop(character, emotion):
+    """持续接收用户输入并返回AI的响应，支持打断"""
+    await BargeInSession(character, emotion).run()
 
 async def main():
     """主函数，接受用户输入并启动TTS流程"""
-    
+
     # 初始化角色和情感字典
     characters_and_emotions_dict = get_characters_and_emotions()
-    
+
     # 列出角色
     character_names = list(characters_and_emotions_dict.keys())
     logger.info(f"\n可用角色：{character_names}")
-    
+
     # 用户选择角色
     character = input("选择角色（按回车键选择默认角色）：")
     if character not in character_names:
         character = character_names[0] if character_names else ""
-    
+
     # 用户选择情感
     emotion_options = characters_and_emotions_dict.get(character, ["default"])
     logger.info(f"\n{character} 可用情感：{emotion_options}")
-    
+
     emotion = input("选择情感（按回车键选择默认情感）：")
     if emotion not in emotion_options:
         emotion = "default"
@@ -74,14 +129,14 @@ async def main():
 if __name__ == "__main__":
     # 创建事件循环
     loop = asyncio.new_event_loop()
-    
+
     # 启动输入线程
     thread = threading.Thread(target=input_thread, args=(loop,))
     thread.start()
-    
+
     # 运行主函数
     asyncio.run(main())
-    
+
     # 停止输入线程
     loop.call_soon_threadsafe(loop.stop)
     thread.join()
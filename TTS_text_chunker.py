@@ -0,0 +1,280 @@
+# TTS_text_chunker.py
+# 自适应文本分块：去掉 markdown 和不能朗读的符号，第一块短、之后按合成器实测的实时率逐渐加长
+import re
+import hashlib
+import threading
+import unicodedata
+from collections import OrderedDict, deque
+from TTS_sentence_splitter import SENTENCE_ENDINGS, CLAUSE_ENDINGS, CLOSING_MARKS
+
+# 分块长度 (字符数)
+FIRST_CHUNK_CHARS = 8  # 第一块达到该长度就送去合成，尽早开始播放
+MIN_CHUNK_CHARS = 8
+MAX_CHUNK_CHARS = 80  # 过长的块首块延迟大，出错时损失也大
+# 下一块的合成时间不超过上一块音频时长的这个比例，给调度和网络留出余量
+UNDERRUN_SAFETY = 0.7
+# 实时率 (合成耗时 / 音频时长) 估计
+INITIAL_RTF = 0.5  # 还没有测量数据时的假设值
+RTF_SMOOTHING = 0.3  # 指数滑动平均中新测量值的权重
+CHUNK_HISTORY = 200  # 保留的分块长度记录数
+CHUNK_PLAN_CACHE_SIZE = 256  # 记住最近多少段完整回复的分块结果
+
+# 按行处理的 markdown 标记
+CODE_FENCE = "```"
+LINE_MARKUP = (
+    re.compile(r"^\s{0,3}#{1,6}\s*"),  # 标题
+    re.compile(r"^\s{0,3}>\s?"),  # 引用
+    re.compile(r"^\s*(?:[-*+]|\d+[.)、])\s+"),  # 列表标记
+    re.compile(r"^[\s|:\-=*_]{3,}$"),  # 分隔线和表格的对齐行
+)
+# 行内 markdown 和不能朗读的内容 (模式, 替换)
+INLINE_MARKUP = (
+    (re.compile(r"!\[([^\]]*)\]\([^)]*\)"), r"\1"),  # 图片只保留说明文字
+    (re.compile(r"\[([^\]]+)\]\([^)]*\)"), r"\1"),  # 链接只保留文字
+    (re.compile(r"(?:https?|ftp)://\S+|www\.\S+"), ""),
+    (re.compile(r"<[^>\n]+>"), ""),  # HTML 标签
+    (re.compile(r"`([^`]*)`"), r"\1"),  # 行内代码保留内容
+    (re.compile(r"\s*\|\s*"), "，"),  # 表格分隔符读作停顿
+)
+# 已有停顿的结尾字符
+PAUSE_MARKS = set(SENTENCE_ENDINGS + CLAUSE_ENDINGS + CLOSING_MARKS + ".,")
+# 去掉 markdown 后仍然残留的标记符号
+MARKUP_SYMBOLS = set("#*_`|~^[]{}\\")
+
+
+def _speakable(ch):
+    """emoji、装饰符号和不可见的格式字符不朗读；数学和货币符号交给合成器的文本规范化处理"""
+    if ch in MARKUP_SYMBOLS:
+        return False
+    category = unicodedata.category(ch)
+    return category not in ("So", "Sk", "Cf", "Co", "Cs", "Cn") and ch != "\ufe0f"
+
+
+def clean_for_speech(text):
+    """去掉一段文本中的 markdown 标记和不能朗读的符号"""
+    for pattern in LINE_MARKUP:
+        text = pattern.sub("", text)
+    for pattern, replacement in INLINE_MARKUP:
+        text = pattern.sub(replacement, text)
+    text = "".join(ch for ch in text if _speakable(ch))
+    return text.strip().lstrip("，")
+
+
+def _find_piece(buffer):
+    """返回 buffer 中第一个分句结束的位置（之后的下标），没有则返回 -1；任何标点都可以切分，由分块合并"""
+    for i, ch in enumerate(buffer):
+        if ch == ":" and buffer[i + 1:i + 3] in ("//", "/", ""):
+            continue  # 网址中的冒号，例如 https://
+        if ch in SENTENCE_ENDINGS or ch in CLAUSE_ENDINGS:
+            end = i + 1
+        elif ch == "." and i + 1 < len(buffer) and buffer[i + 1].isspace() and i > 0 and not buffer[i - 1].isdigit():
+            # 英文句号后跟空白才切分；"1. " 是列表标记，不切分
+            end = i + 1
+        else:
+            continue
+        while end < len(buffer) and (buffer[end] in SENTENCE_ENDINGS or buffer[end] in CLOSING_MARKS):
+            end += 1
+        if end == len(buffer) and buffer[-1] != "\n":
+            return -1  # 后续片段可能还有闭合符号
+        return end
+    return -1
+
+
+def _split_point(buffer, limit):
+    """没有标点的长文本强制切分的位置：limit 之内最后一个空白之后，没有空白时为 limit"""
+    space = buffer.rfind(" ", 0, limit)
+    return space + 1 if space > 0 else limit
+
+
+class ChunkSizer:
+    """按角色在线估计合成的实时率，并据此决定下一块的长度
+
+    播放第 k 块时合成第 k+1 块，只要第 k+1 块的合成时间不超过第 k 块的音频时长，播放就不会中断。
+    合成时间约为 实时率 × 音频时长，音频时长与字数成正比，所以下一块最多
+    UNDERRUN_SAFETY × 上一块字数 / 实时率 个字。实时率低的角色分块很快变长，韵律更自然。
+    """
+
+    def __init__(self, first_chunk_chars=FIRST_CHUNK_CHARS, min_chunk_chars=MIN_CHUNK_CHARS,
+                 max_chunk_chars=MAX_CHUNK_CHARS, safety=UNDERRUN_SAFETY):
+        self.first_chunk_chars = first_chunk_chars
+        self.min_chunk_chars = min_chunk_chars
+        self.max_chunk_chars = max_chunk_chars
+        self.safety = safety
+        self.lock = threading.Lock()
+        self.estimates = {}  # 角色 -> {"rtf", "audio_per_char", "observations"}
+        self.chunks = deque(maxlen=CHUNK_HISTORY)  # (角色, 第几块, 目标长度, 实际长度)
+        self.plans = OrderedDict()  # (角色, 原文哈希) -> 分块列表
+        self.plan_hits = 0
+
+    def observe(self, character, synthesis_seconds, audio_seconds, chars):
+        """记录一次合成（缓存命中不要记录）的耗时和音频时长"""
+        if audio_seconds <= 0 or chars <= 0:
+            return
+        with self.lock:
+            estimate = self.estimates.setdefault(character, {"rtf": INITIAL_RTF, "audio_per_char": 0.0,
+                                                             "observations": 0})
+            rtf = synthesis_seconds / audio_seconds
+            audio_per_char = audio_seconds / chars
+            if estimate["observations"] == 0:
+                estimate["rtf"], estimate["audio_per_char"] = rtf, audio_per_char
+            else:
+                estimate["rtf"] += RTF_SMOOTHING * (rtf - estimate["rtf"])
+                estimate["audio_per_char"] += RTF_SMOOTHING * (audio_per_char - estimate["audio_per_char"])
+            estimate["observations"] += 1
+
+    def rtf(self, character):
+        with self.lock:
+            estimate = self.estimates.get(character)
+            return estimate["rtf"] if estimate is not None else INITIAL_RTF
+
+    def target(self, character, index, previous_chars):
+        """第 index 块（从 0 开始）的目标长度"""
+        if index == 0:
+            return self.first_chunk_chars
+        chars = int(self.safety * previous_chars / max(self.rtf(character), 1e-3))
+        return max(self.min_chunk_chars, min(self.max_chunk_chars, chars))
+
+    @staticmethod
+    def _plan_key(character, text):
+        return character, hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+    def plan(self, character, text):
+        """同一段回复再次出现时（例如命中回复缓存）返回上次的分块，分块相同才能命中 TTS 音频缓存"""
+        key = self._plan_key(character, text)
+        with self.lock:
+            plan = self.plans.get(key)
+            if plan is not None:
+                self.plans.move_to_end(key)
+                self.plan_hits += 1
+            return plan
+
+    def remember(self, character, text, chunks):
+        key = self._plan_key(character, text)
+        with self.lock:
+            self.plans[key] = list(chunks)
+            self.plans.move_to_end(key)
+            while len(self.plans) > CHUNK_PLAN_CACHE_SIZE:
+                self.plans.popitem(last=False)
+
+    def record(self, character, index, target, chars):
+        with self.lock:
+            self.chunks.append((character, index, target, chars))
+
+    def stats(self):
+        with self.lock:
+            estimates = {character: dict(estimate) for character, estimate in self.estimates.items()}
+            chunks = list(self.chunks)
+        first = [chars for _, index, _, chars in chunks if index == 0]
+        later = [chars for _, index, _, chars in chunks if index > 0]
+        return {"rtf": estimates,
+                "chunks": len(chunks),
+                "first_chunk_average": sum(first) / len(first) if first else 0.0,
+                "later_chunk_average": sum(later) / len(later) if later else 0.0,
+                "plan_hits": self.plan_hits,
+                "recent": [{"character": character, "index": index, "target": target, "chars": chars}
+                           for character, index, target, chars in chunks[-10:]]}
+
+    def summary(self):
+        stats = self.stats()
+        rtf = ", ".join(f"{character or '默认'} {estimate['rtf']:.2f}" for character, estimate in stats["rtf"].items())
+        return (f"自适应分块: 实时率 {rtf or '无测量'}; 共 {stats['chunks']} 块, "
+                f"首块平均 {stats['first_chunk_average']:.1f} 字, 后续平均 {stats['later_chunk_average']:.1f} 字")
+
+
+# 全局分块长度估计，合成管线记录实测耗时
+chunk_sizer = ChunkSizer()
+
+
+async def adaptive_chunks(token_stream, character="", sizer=chunk_sizer):
+    """把模型流式输出的文本切分为适合合成的块并逐块产出
+
+    先按标点切成分句，每个分句去掉 markdown 和不能朗读的符号（代码块整体跳过），
+    再把分句合并到当前块的目标长度；没有标点的长文本按最大长度强制切分。
+    第一个片段是之前完整分块过的回复时（回复缓存命中时整段回复一次到达）直接沿用上次的分块。
+    """
+    raw = []
+    chunks = []
+    buffer = ""
+    chunk = ""
+    index = 0
+    target = sizer.target(character, 0, 0)
+    in_code = False
+
+    def add(piece):
+        nonlocal in_code
+        if CODE_FENCE in piece:
+            # 代码块的起止行，两者之间的内容不朗读
+            in_code = in_code != (piece.count(CODE_FENCE) % 2 == 1)
+            return ""
+        if in_code:
+            return ""
+        text = clean_for_speech(piece)
+        if text and piece.rstrip(" \t").endswith("\n") and text[-1] not in PAUSE_MARKS:
+            text += "。"  # 标题、列表项等没有标点的行，行尾读作句末停顿
+        return text
+
+    def emit():
+        nonlocal chunk, index, target
+        text, chunk = chunk, ""
+        sizer.record(character, index, target, len(text))
+        index += 1
+        target = sizer.target(character, index, len(text))
+        chunks.append(text)
+        return text
+
+    async for token in token_stream:
+        raw.append(token)
+        plan = sizer.plan(character, token) if len(raw) == 1 else None
+        if plan is not None:
+            for text in plan:
+                chunk = text
+                yield emit()
+            continue
+        buffer += token
+        while True:
+            end = _find_piece(buffer)
+            if end < 0 and len(buffer) >= 2 * sizer.max_chunk_chars:
+                # 长时间没有标点，在空白处或最大长度处强制切分
+                end = _split_point(buffer, sizer.max_chunk_chars)
+            if end < 0:
+                break
+            piece, buffer = add(buffer[:end]), buffer[end:]
+            if not any(ch.isalnum() for ch in piece):
+                # 只剩标点时并入当前块，保留停顿
+                chunk += piece if chunk else ""
+                continue
+            if chunk and piece[0].isascii() and piece[0].isalnum():
+                chunk += " "  # 英文分句之间保留空格
+            chunk += piece
+            ends_sentence = chunk[-1] in SENTENCE_ENDINGS or chunk[-1] in CLOSING_MARKS
+            # 达到目标长度，或已过半且正好在句末时送去合成
+            if len(chunk) >= target or (ends_sentence and len(chunk) * 2 >= target and index > 0):
+                yield emit()
+
+    # 流结束，剩余文本同样按最大长度在空白处切分，每块都不超过 max_chunk_chars
+    while buffer.strip():
+        end = len(buffer) if len(buffer) <= sizer.max_chunk_chars else _split_point(buffer, sizer.max_chunk_chars)
+        tail, buffer = add(buffer[:end]), buffer[end:]
+        if not any(ch.isalnum() for ch in tail):
+            chunk += tail if chunk else ""
+            continue
+        if chunk and len(chunk) + len(tail) > sizer.max_chunk_chars and any(ch.isalnum() for ch in chunk):
+            yield emit()
+        chunk += (" " if chunk and tail[0].isascii() and tail[0].isalnum() else "") + tail
+        if len(chunk) >= target:
+            yield emit()
+    if any(ch.isalnum() for ch in chunk):
+        yield emit()
+    if chunks:
+        sizer.remember(character, "".join(raw), chunks)
+
+
+async def _iterate(items):
+    for item in items:
+        yield item
+
+
+async def chunk_text(text, character="", sizer=chunk_sizer):
+    """把一段完整文本切分为适合合成的块"""
+    async for chunk in adaptive_chunks(_iterate([text]), character, sizer):
+        yield chunk
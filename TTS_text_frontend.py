@@ -0,0 +1,152 @@
+# TTS_text_frontend.py
+# 文本前端记忆化：分词、G2P、数字转写等结果按词和按句缓存，回复中重复的词和句子不再重新处理
+import functools
+import logging
+import threading
+from collections import OrderedDict
+from importlib import import_module
+
+logger = logging.getLogger(__name__)
+
+# 缓存容量
+WORD_CACHE_SIZE = 20000  # 词级结果（拼音、声韵母）的条目数
+SENTENCE_CACHE_SIZE = 256  # 句级结果的条目数，句级结果包含 BERT 特征，占用较大
+
+# 记忆化的模块级函数 (模块, 函数名, 级别)，不存在的会跳过
+MODULE_TARGETS = (
+    ("text.chinese", "lazy_pinyin", "word"),
+    ("text.chinese", "_get_initials_finals", "word"),
+    ("text.chinese2", "lazy_pinyin", "word"),
+    ("text.chinese2", "_get_initials_finals", "word"),
+    ("cn2an", "transform", "sentence"),
+)
+# 合成器文本预处理对象上记忆化的方法，整句的音素和 BERT 特征
+PREPROCESSOR_METHODS = ("get_phones_and_bert",)
+PIPELINE_ATTRIBUTES = ("tts_pipline", "tts_pipeline", "tts_instance", "tts")
+
+
+def _fresh(value):
+    """复制结果中的列表、元组和字典，其中的字符串、张量等元素共享
+
+    GPT-SoVITS 会原地修改前端返回的列表（例如变调规则改写 _get_initials_finals 返回的韵母），
+    每次返回新的容器，缓存中的结果才不会被上一句的变调污染。
+    """
+    if isinstance(value, list):
+        return [_fresh(item) for item in value]
+    if isinstance(value, tuple):
+        return tuple(_fresh(item) for item in value)
+    if isinstance(value, dict):
+        return {key: _fresh(item) for key, item in value.items()}
+    return value
+
+
+class LRUMemo:
+    """有容量上限的 LRU 结果缓存，命中和未命中时都返回结果容器的副本"""
+
+    def __init__(self, name, maxsize):
+        self.name = name
+        self.maxsize = maxsize
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.uncacheable = 0  # 参数不可哈希，未缓存的调用
+
+    def call(self, fn, args, kwargs):
+        key = (fn.__qualname__, args, tuple(sorted(kwargs.items())))
+        try:
+            with self.lock:
+                if key in self.entries:
+                    self.entries.move_to_end(key)
+                    self.hits += 1
+                    return _fresh(self.entries[key])
+        except TypeError:
+            with self.lock:
+                self.uncacheable += 1
+            return fn(*args, **kwargs)
+        result = fn(*args, **kwargs)
+        with self.lock:
+            self.misses += 1
+            self.entries[key] = result
+            if len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+        return _fresh(result)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {"entries": len(self.entries),
+                    "hits": self.hits,
+                    "misses": self.misses,
+                    "uncacheable": self.uncacheable,
+                    "hit_rate": self.hits / lookups if lookups else 0.0}
+
+
+def memoize(fn, memo):
+    """用 memo 包装函数，已包装过的直接返回"""
+    if getattr(fn, "__memoized__", False):
+        return fn
+
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        return memo.call(fn, args, kwargs)
+
+    wrapper.__memoized__ = True
+    return wrapper
+
+
+class TextFrontendMemo:
+    """合成器文本前端的词级和句级缓存
+
+    文本前端来自合成器，不随本仓库发布，这里只包装能找到的函数，找不到时合成照常进行。
+    返回的列表、元组和字典是副本，调用方可以原地修改；张量等其他对象与缓存共享。
+    """
+
+    def __init__(self, word_size=WORD_CACHE_SIZE, sentence_size=SENTENCE_CACHE_SIZE):
+        self.memos = {"word": LRUMemo("word", word_size), "sentence": LRUMemo("sentence", sentence_size)}
+        self.installed = []
+
+    def install_modules(self, targets=MODULE_TARGETS):
+        """包装模块级的前端函数，对所有合成器实例生效"""
+        for module_name, name, level in targets:
+            try:
+                module = import_module(module_name)
+            except Exception:
+                continue
+            fn = getattr(module, name, None)
+            if not callable(fn) or getattr(fn, "__memoized__", False):
+                continue
+            setattr(module, name, memoize(fn, self.memos[level]))
+            self.installed.append(f"{module_name}.{name}")
+        logger.info(f"文本前端缓存: 已包装 {self.installed or '无'}")
+
+    def install(self, synthesizer):
+        """包装一个合成器实例的文本预处理方法"""
+        for owner in (synthesizer,) + tuple(getattr(synthesizer, name, None) for name in PIPELINE_ATTRIBUTES):
+            preprocessor = getattr(owner, "text_preprocessor", None)
+            if preprocessor is None:
+                continue
+            for name in PREPROCESSOR_METHODS:
+                method = getattr(preprocessor, name, None)
+                if callable(method) and not getattr(method, "__memoized__", False):
+                    # 实例属性覆盖同名方法
+                    setattr(preprocessor, name, memoize(method, self.memos["sentence"]))
+                    self.installed.append(f"{type(preprocessor).__name__}.{name}")
+
+    def stats(self):
+        return {level: memo.stats() for level, memo in self.memos.items()}
+
+    def summary(self, stats=None):
+        """stats 为 None 时使用本进程的统计，也可以传入工作进程回报的统计"""
+        stats = stats or self.stats()
+        parts = [f"{level} 命中率 {item['hit_rate']:.1%} ({item['hits']}/{item['hits'] + item['misses']}), "
+                 f"{item['entries']} 条" for level, item in stats.items()]
+        return "文本前端缓存: " + "; ".join(parts)
+
+
+# 全局文本前端缓存
+text_frontend_memo = TextFrontendMemo()
@@ -0,0 +1,172 @@
+# TTS_vad.py
+# 基于能量和过零率的逐帧语音端点检测
+import collections
+import numpy as np
+from TTS_audio_frame import AudioFrame
+
+# 端点检测设置
+FRAME_MS = 20  # 帧长 (毫秒)
+ENERGY_THRESHOLD = 500  # 语音帧的最小 RMS 能量
+NOISE_RATIO = 3.0  # 语音能量需高于背景噪声估计的倍数
+ZCR_THRESHOLD = 0.25  # 能量偏低但过零率高于该值时视为清辅音
+ONSET_MS = 60  # 连续多少毫秒的语音帧才判定为开始说话
+PAUSE_MS = 300  # 句内停顿超过该时长时结束当前语音段
+HANGOVER_MS = 800  # 静默超过该时长时结束整句话
+PRE_ROLL_MS = 200  # 语音开始前保留的音频，避免切掉首字
+MIN_SPEECH_MS = 200  # 短于该时长的语音视为噪声丢弃
+MAX_UTTERANCE_S = 30  # 单句最长时长 (秒)，超出后强制结束
+ECHO_GATE_RATIO = 3.0  # 播放期间语音能量阈值的放大倍数，避免把扬声器回声当作用户说话
+ECHO_ONSET_MS = 160  # 播放期间判定开始说话所需的连续语音时长 (毫秒)
+
+# 事件类型
+SPEECH_START = "speech_start"  # 开始说话（用于打断播放）
+SEGMENT_END = "segment_end"  # 一个语音段结束（句内停顿）
+UTTERANCE_END = "utterance_end"  # 整句话结束
+UTTERANCE_DROP = "utterance_drop"  # 语音过短被当作噪声丢弃
+
+
+class Utterance(AudioFrame):
+    """一句话的音频及其中各语音段的边界（样本下标，左闭右开）"""
+
+    __slots__ = ("segments",)
+
+    def __init__(self, samples, sample_rate, segments):
+        super().__init__(samples, sample_rate)
+        self.segments = segments
+
+    def segment_frames(self, segments=None):
+        """返回各语音段的音频帧（视图）"""
+        if segments is None:
+            segments = self.segments
+        return [self.slice(start, end) for start, end in segments]
+
+
+class Endpointer:
+    """流式端点检测器
+
+    逐帧判断语音/静默：能量超过阈值，或能量偏低但过零率较高（清辅音）即为语音帧。
+    阈值随背景噪声自适应。语音开始后把音频写入预分配的缓冲区，
+    短停顿结束一个语音段，长静默（hangover）结束整句话。
+    echo_gate 为可选的回调，返回 True 表示扬声器正在播放，此时提高阈值并要求更长的起始语音。
+    """
+
+    def __init__(self, rate=16000, frame_ms=FRAME_MS, energy_threshold=ENERGY_THRESHOLD,
+                 noise_ratio=NOISE_RATIO, zcr_threshold=ZCR_THRESHOLD, onset_ms=ONSET_MS,
+                 pause_ms=PAUSE_MS, hangover_ms=HANGOVER_MS, pre_roll_ms=PRE_ROLL_MS,
+                 min_speech_ms=MIN_SPEECH_MS, max_utterance_s=MAX_UTTERANCE_S,
+                 echo_gate=None, echo_gate_ratio=ECHO_GATE_RATIO, echo_onset_ms=ECHO_ONSET_MS):
+        self.rate = rate
+        self.frame_len = rate * frame_ms // 1000
+        self.energy_threshold = energy_threshold
+        self.noise_ratio = noise_ratio
+        self.zcr_threshold = zcr_threshold
+        self.onset_frames = max(1, onset_ms // frame_ms)
+        self.echo_gate = echo_gate
+        self.echo_gate_ratio = echo_gate_ratio
+        self.echo_onset_frames = max(self.onset_frames, echo_onset_ms // frame_ms)
+        self.pause_frames = max(1, pause_ms // frame_ms)
+        self.hangover_frames = max(self.pause_frames, hangover_ms // frame_ms)
+        self.min_speech_frames = max(1, min_speech_ms // frame_ms)
+        self.buffer = np.zeros(int(rate * max_utterance_s), dtype=np.int16)
+        self.pre_roll = collections.deque(maxlen=max(1, pre_roll_ms // frame_ms))
+        self.remainder = np.zeros(0, dtype=np.int16)
+        self.noise_floor = None
+        self.reset()
+
+    def reset(self):
+        """丢弃当前句子，回到静默状态"""
+        self.in_speech = False
+        self.length = 0  # 缓冲区中已写入的样本数
+        self.speech_run = 0  # 连续语音帧数
+        self.silence_run = 0  # 连续静默帧数
+        self.speech_frames = 0  # 当前句子中的语音帧总数
+        self.segments = []
+        self.segment_start = None
+        self.pre_roll.clear()
+
+    def is_speech(self, frame, echo=False):
+        """判断一帧是否为语音，并在静默时更新背景噪声估计；echo 表示扬声器正在播放"""
+        samples = frame.astype(np.float32)
+        rms = float(np.sqrt(np.mean(samples * samples)))
+        zcr = float(np.mean(np.signbit(frame[1:]) != np.signbit(frame[:-1])))
+        floor = self.noise_floor if self.noise_floor is not None else rms
+        threshold = max(self.energy_threshold, floor * self.noise_ratio)
+        if echo:
+            threshold *= self.echo_gate_ratio
+        speech = rms >= threshold or (rms >= threshold / 2 and zcr >= self.zcr_threshold)
+        if not speech and not echo:
+            # 播放期间麦克风里是回声，不用来估计背景噪声
+            self.noise_floor = rms if self.noise_floor is None else 0.95 * self.noise_floor + 0.05 * rms
+        return speech
+
+    def push(self, samples):
+        """输入任意长度的 int16 音频，返回本次产生的事件列表 [(事件类型, Utterance)]
+
+        语音段事件中的 Utterance 直接引用内部缓冲区，需要在下一句开始前使用完毕。
+        """
+        if len(self.remainder):
+            samples = np.concatenate((self.remainder, samples))
+        events = []
+        count = len(samples) // self.frame_len
+        for i in range(count):
+            frame = samples[i * self.frame_len:(i + 1) * self.frame_len]
+            event = self._push_frame(frame)
+            if event is not None:
+                events.append(event)
+        self.remainder = samples[count * self.frame_len:].copy()
+        return events
+
+    def _append(self, frame):
+        end = self.length + len(frame)
+        self.buffer[self.length:end] = frame
+        self.length = end
+
+    def _utterance(self):
+        return Utterance(self.buffer[:self.length], self.rate, list(self.segments))
+
+    def _push_frame(self, frame):
+        echo = self.echo_gate is not None and self.echo_gate()
+        speech = self.is_speech(frame, echo)
+
+        if not self.in_speech:
+            self.pre_roll.append(frame)
+            self.speech_run = self.speech_run + 1 if speech else 0
+            if self.speech_run < (self.echo_onset_frames if echo else self.onset_frames):
+                return None
+            # 开始说话：写入预留音频
+            self.in_speech = True
+            for pre_frame in self.pre_roll:
+                self._append(pre_frame)
+            self.pre_roll.clear()
+            self.segment_start = 0
+            self.speech_frames = self.speech_run
+            self.silence_run = 0
+            return (SPEECH_START, None)
+
+        self._append(frame)
+        if speech:
+            self.speech_frames += 1
+            self.silence_run = 0
+            if self.segment_start is None:
+                # 停顿后重新开口，新语音段从上一段结尾开始，保留停顿作为上下文
+                self.segment_start = self.segments[-1][1] if self.segments else 0
+        else:
+            self.silence_run += 1
+
+        event = None
+        if self.segment_start is not None and self.silence_run >= self.pause_frames:
+            self.segments.append((self.segment_start, self.length))
+            self.segment_start = None
+            event = (SEGMENT_END, self._utterance())
+
+        full = self.length + self.frame_len > len(self.buffer)
+        if self.silence_run >= self.hangover_frames or full:
+            if self.segment_start is not None:
+                self.segments.append((self.segment_start, self.length))
+            utterance = self._utterance() if self.speech_frames >= self.min_speech_frames else None
+            # 缓冲区会被下一句复用，交出去的整句音频需要复制一次
+            if utterance is not None:
+                utterance.samples = utterance.samples.copy()
+            self.reset()
+            return (UTTERANCE_END, utterance) if utterance is not None else (UTTERANCE_DROP, None)
+        return event
@@ -1,10 +1,18 @@
 import asyncio
 import logging
-import os
-import json
 # from TTS_gptsovits_voice import text_to_speech
-from TTS_gptsovits_voice import text_to_speech
-from TTS_run_model import get_response
+from TTS_gptsovits_voice import (text_to_speech_stream, synthesize_sentences, prefetch_character, synthesis_stats,
+                                 synthesis_summary, tts_batcher, synthesis_workers, stream_latency)
+from TTS_synthesis_worker import TTS_WORKER_PROCESSES
+from TTS_audio_frame import AudioFrame
+from TTS_scheduler import request_scheduler, STAGE_LLM
+from TTS_admission import admission, Overloaded
+from TTS_character_registry import character_registry
+from TTS_text_chunker import adaptive_chunks, chunk_sizer
+from TTS_response_cache import response_cache
+from TTS_conversation import conversations
+from TTS_protocol import (MSG_CHAT, MSG_COMMAND, MSG_RESULT, MSG_ERROR, MSG_AUDIO, MSG_AUDIO_FORMAT, ProtocolError,
+                          PayloadError, read_frame, write_frame)
 
 # 初始化日志
 logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(message)s")
@@ -16,83 +24,178 @@ clients = []
 shutdown_flag = False
 # 服务端是否正在关闭的标志
 server_shutting_down = False
+# 发送给客户端的每个音频帧的长度 (毫秒)
+AUDIO_CHUNK_MS = 100
+# 服务端本机播放的回复依次播放，不互相打断；在事件循环中创建
+local_playback = None
 
-def load_character_and_emotion():
-    """读取角色和情感列表"""
-    character_data = {}
-    base_dir = 'trained'
-    for root, dirs, files in os.walk(base_dir):
-        if 'infer_config.json' in files:
-            character_name = os.path.basename(root)
-            config_file = os.path.join(root, 'infer_config.json')
-            try:
-                with open(config_file, 'r', encoding='utf-8') as f:
-                    config = json.load(f)
-                    emotion_list = list(config.get('emotion_list', {}).keys())
-                    character_data[character_name] = emotion_list
-            except Exception as e:
-                logger.error(f"Error loading {config_file}: {e}")
-    return character_data
+async def stream_audio(writer, request_id, sentences, character, emotion, session, mode):
+    """每合成完一句就把 PCM 分块发送给客户端
+
+    每块发送后等待 writer.drain()，客户端接收慢时这里暂停，预合成队列满后合成也随之暂停。
+    """
+    previous = None
+    async for sentence, audio_frame in synthesize_sentences(sentences, character, emotion, session=session,
+                                                            cache_only=mode["cache_only"], chunk_ms=AUDIO_CHUNK_MS):
+        pcm = AudioFrame(audio_frame.as_int16(), audio_frame.sample_rate)
+        if mode["sample_rate"]:
+            pcm = pcm.downsample(mode["sample_rate"])
+        # 流式合成的第一句分多块到达，只在新句子开始时发送格式帧
+        if sentence != previous:
+            write_frame(writer, MSG_AUDIO_FORMAT, request_id, {"sample_rate": pcm.sample_rate, "text": sentence})
+            previous = sentence
+        chunk = pcm.sample_rate * AUDIO_CHUNK_MS // 1000
+        for start in range(0, len(pcm), chunk):
+            write_frame(writer, MSG_AUDIO, request_id, pcm.slice(start, start + chunk).buffer())
+            await writer.drain()
+
+async def reply(writer, session, request_id, request, mode):
+    """按处理模式生成回复，返回回复文本"""
+    character = request.get("character", "")
+    emotion = request.get("emotion", "default")
+    content = request.get("text", "")
+    delivery = request.get("delivery", "local")  # local: 服务端本机播放; stream: 音频发送给客户端
+
+    # 模型请求带上该客户端的对话记忆；模型请求和每句合成都经过调度器，多个客户端轮流使用
+    conversation = conversations.get(session, character)
+    tokens = request_scheduler.hold(STAGE_LLM, session, conversation.stream_reply(content, mode["max_tokens"]))
+    if mode["text_only"]:
+        return "".join([token async for token in tokens])
+
+    # 流式获取AI响应，去掉 markdown 后按自适应长度分块，每块闭合就立即合成语音
+    sentences = adaptive_chunks(tokens, character)
+    if delivery == "stream":
+        # 记录句子流经过的全部句子，cache_only 时没有音频的句子也要出现在回复文本中
+        spoken = []
+        await stream_audio(writer, request_id, _record(sentences, spoken), character, emotion, session, mode)
+        return "".join(spoken)
+    # 本机只有一个扬声器：同一客户端连续发送的请求和其他客户端的请求排队播放，不打断正在播放的回复
+    async with local_playback:
+        return await text_to_speech_stream(sentences, character, emotion, session=session,
+                                           cache_only=mode["cache_only"], interrupt=False)
+
+async def _record(sentences, spoken):
+    async for sentence in sentences:
+        spoken.append(sentence)
+        yield sentence
+
+async def handle_chat(writer, session, request_id, request):
+    """处理一条对话请求，完成后按请求 ID 返回AI响应"""
+    logger.info(f"请求 {request_id} 角色: {request.get('character')}, 情感: {request.get('emotion')}, "
+                f"消息: {request.get('text')}")
+    try:
+        async with admission.admit() as mode:
+            if mode["steps"]:
+                logger.info(f"请求 {request_id} 降级处理: {mode['steps']}")
+            response = await reply(writer, session, request_id, request, mode)
+        logger.info(f"请求 {request_id} AI回复: {response}")
+        write_frame(writer, MSG_RESULT, request_id, {"text": response, "degraded": mode["steps"]})
+    except asyncio.CancelledError:
+        raise
+    except Overloaded as e:
+        write_frame(writer, MSG_ERROR, request_id, {"error": str(e), "retry_after": e.retry_after})
+    except Exception as e:
+        logger.error(f"处理请求 {request_id} 时出错: {e}")
+        write_frame(writer, MSG_ERROR, request_id, {"error": str(e)})
+    await writer.drain()
+    logger.info(request_scheduler.summary())
+    logger.info(admission.summary())
+    logger.info(response_cache.summary())
+    logger.info(conversations.summary())
+    if TTS_WORKER_PROCESSES:
+        logger.info(synthesis_workers.summary())
+    logger.info(synthesis_summary())
 
 async def handle_client(reader, writer):
-    """处理客户端的消息并生成AI响应"""
+    """读取客户端发来的帧，每个对话请求在独立的任务中处理，响应可以乱序返回"""
     addr = writer.get_extra_info('peername')
     clients.append(writer)
+    tasks = set()
+    session = f"{addr}#{id(writer)}"
+    request_scheduler.register_session(session)
     
     try:
         logger.info(f"新连接来自 {addr}")
         
         while True:
             try:
-                data = await reader.read(1024)
-                if not data:
-                    break
-                
-                message = data.decode('utf-8')
-                logger.info(f"收到消息: {message}")
-
-                character, emotion, content = message.split(',', 2)
-                
-                # 处理系统命令
-                if character == "SYSTEM" and emotion == "COMMAND":
-                    if content == "LIST_CHARACTERS":
-                        character_data = load_character_and_emotion()
-                        response = json.dumps(character_data)
-                        writer.write(response.encode('utf-8'))
-                        await writer.drain()
-                        continue
-                    elif content == "DISCONNECT":
-                        logger.info(f"客户端 {addr} 请求断开连接")
-                        break
-                    else:
-                        logger.warning(f"收到未知命令: {content}")
-                        continue
-                
-                # 处理普通消息
-                logger.info(f"角色: {character}, 情感: {emotion}, 消息: {content}")
-                
-                # 获取AI响应
-                response = await get_response(content)
-                logger.info(f"AI回复: {response}")
-                
-                # 使用TTS生成语音
-                await text_to_speech(response, character, emotion)
-                
-                # 发送响应给客户端
-                writer.write(response.encode('utf-8'))
+                frame = await read_frame(reader)
+            except PayloadError as e:
+                # 帧本身完整，只拒绝这一条请求，连接保持
+                logger.warning(f"请求 {e.request_id} 的负载无法解析: {e}")
+                write_frame(writer, MSG_ERROR, e.request_id, {"error": str(e)})
+                await writer.drain()
+                continue
+            except ProtocolError as e:
+                # 帧头或长度无效，帧边界已无法确定，只能断开连接
+                logger.error(f"从客户端收到的数据格式无效: {e}")
+                break
+            if frame is None:
+                break
+            msg_type, request_id, payload = frame
+
+            if msg_type in (MSG_CHAT, MSG_COMMAND) and not isinstance(payload, dict):
+                # 帧本身完整，只拒绝这一条请求，连接保持
+                logger.warning(f"请求 {request_id} 的内容不是 JSON 对象")
+                write_frame(writer, MSG_ERROR, request_id, {"error": "请求内容必须是 JSON 对象"})
                 await writer.drain()
+                continue
 
-            except ValueError:
-                logger.error("从客户端收到的消息格式无效")
+            if msg_type == MSG_CHAT:
+                task = asyncio.create_task(handle_chat(writer, session, request_id, payload))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
                 continue
-            except Exception as e:
-                logger.error(f"处理消息时出错: {e}")
+
+            if msg_type != MSG_COMMAND:
+                logger.warning(f"收到未知消息类型: {msg_type}")
+                write_frame(writer, MSG_ERROR, request_id, {"error": f"未知消息类型 {msg_type}"})
+                await writer.drain()
                 continue
 
+            # 处理系统命令
+            command = payload.get("command")
+            if command == "LIST_CHARACTERS":
+                character_data = character_registry.characters()
+                write_frame(writer, MSG_RESULT, request_id, {"characters": character_data})
+                await writer.drain()
+            elif command == "PREFETCH":
+                # 客户端选中了角色，后台加载该角色的模型
+                prefetching = prefetch_character(payload.get("character", ""))
+                write_frame(writer, MSG_RESULT, request_id, {"prefetching": prefetching})
+                await writer.drain()
+            elif command == "STATS":
+                # 模型常驻、参考音频特征和文本前端缓存在实际合成的进程中统计，使用工作进程时由工作进程回报
+                synthesis = synthesis_stats() or {}
+                write_frame(writer, MSG_RESULT, request_id, {"scheduler": request_scheduler.stats(),
+                                                             "admission": admission.stats(),
+                                                             "models": synthesis.get("models"),
+                                                             "prompt_features": synthesis.get("prompt_features"),
+                                                             "text_frontend": synthesis.get("text_frontend"),
+                                                             "tts_batching": tts_batcher.stats(),
+                                                             "tts_workers": synthesis_workers.stats(),
+                                                             "stream_latency": stream_latency.stats(),
+                                                             "chunking": chunk_sizer.stats(),
+                                                             "responses": response_cache.stats(),
+                                                             "conversation": conversations.stats().get(session)})
+                await writer.drain()
+            elif command == "DISCONNECT":
+                logger.info(f"客户端 {addr} 请求断开连接")
+                break
+            else:
+                logger.warning(f"收到未知命令: {command}")
+                write_frame(writer, MSG_ERROR, request_id, {"error": f"未知命令 {command}"})
+                await writer.drain()
+
     except Exception as e:
         logger.error(f"处理客户端 {addr} 时出错: {e}")
     finally:
         logger.info(f"关闭与 {addr} 的连接")
+        # 取消该客户端排队中和进行中的请求
+        request_scheduler.close_session(session)
+        conversations.close(session)
+        for task in list(tasks):
+            task.cancel()
         if writer in clients:
             clients.remove(writer)
         writer.close()
@@ -104,7 +207,8 @@ async def handle_client(reader, writer):
 
 async def main():
     """创建并启动服务器"""
-    global server_shutting_down
+    global server_shutting_down, local_playback
+    local_playback = asyncio.Lock()
     
     server = await asyncio.start_server(
         handle_client, '127.0.0.1', 5555
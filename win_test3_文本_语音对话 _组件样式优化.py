@@ -2,7 +2,7 @@
 import sys
 import socket
 import threading
-import json
+import itertools
 import asyncio
 import logging
 from PyQt5.QtWidgets import (
@@ -10,8 +10,11 @@ from PyQt5.QtWidgets import (
     QLabel, QScrollArea, QFrame, QComboBox, QSizePolicy
 )
 from PyQt5.QtCore import Qt, pyqtSignal, QThread
-from TTS_Funasr import transcribe_audio  # 导入语音识别相关功能
-from TTS_record_audio import record_audio   # 导入录音相关功能
+from TTS_Funasr import transcribe_stream  # 导入流式语音识别
+from TTS_record_audio import microphone   # 导入常驻麦克风采集服务
+from TTS_protocol import (MSG_CHAT, MSG_COMMAND, MSG_RESULT, MSG_ERROR, MSG_AUDIO, MSG_AUDIO_FORMAT,
+                          FrameDecoder, send_frame)  # 导入分帧协议
+from TTS_stream_player import StreamPlayer  # 导入流式音频播放器
 
 # 初始化日志
 logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(message)s")
@@ -19,26 +22,43 @@ logger = logging.getLogger(__name__)
 
 class VoiceInputThread(QThread):
     voice_input_signal = pyqtSignal(str)  # 语音输入信号
+    voice_partial_signal = pyqtSignal(str)  # 识别中的部分结果信号
 
     def __init__(self):
         super().__init__()
         self.is_running = True
+        self.loop = None
+        self.task = None
 
     def run(self):
-        asyncio.run(self.input_loop())
+        asyncio.run(self.main())
 
-    async def input_loop(self):
-        while self.is_running:
+    async def main(self):
+        self.loop = asyncio.get_running_loop()
+        self.task = asyncio.current_task()
+        try:
+            await self.input_loop()
+        except asyncio.CancelledError:
+            pass
+
+    def stop(self):
+        """停止语音输入，立即结束正在等待的采集"""
+        self.is_running = False
+        if self.loop is not None and self.task is not None:
             try:
-                audio_buffer = await record_audio()
-                if audio_buffer is not None:
-                    user_input = await transcribe_audio(audio_buffer)
-                    if user_input:
-                        logger.info(f"语音识别结果: {user_input}")
-                        self.voice_input_signal.emit(user_input)
-            except Exception as e:
-                logger.error(f"语音输入错误: {e}")
+                self.loop.call_soon_threadsafe(self.task.cancel)
+            except RuntimeError:
+                pass  # 事件循环已结束
+
+    async def input_loop(self):
+        async for kind, user_input in transcribe_stream(microphone.speech_events()):
+            if not self.is_running:
+                break
+            if kind == "partial":
+                self.voice_partial_signal.emit(user_input)
                 continue
+            logger.info(f"语音识别结果: {user_input}")
+            self.voice_input_signal.emit(user_input)
 
 
 class ChatClient(QWidget):
@@ -53,6 +73,10 @@ class ChatClient(QWidget):
         # 连接到服务器
         self.client_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         self.client_socket.connect(('127.0.0.1', 5555))  # 假设服务器运行在本地的 127.0.0.1:5555
+        self.decoder = FrameDecoder()  # 把收到的字节流还原为完整的帧
+        self.request_ids = itertools.count(1)
+        self.pending = {}  # 请求 ID -> 已发送、尚未收到回复的消息
+        self.player = StreamPlayer()  # 播放服务端发来的语音
 
         # 请求角色和情感数据
         self.request_character_and_emotion()
@@ -316,38 +340,60 @@ class ChatClient(QWidget):
         )
 
 
+    def send_frame(self, msg_type, payload):
+        """发送一帧，返回分配的请求 ID"""
+        request_id = next(self.request_ids)
+        send_frame(self.client_socket, msg_type, request_id, payload)
+        return request_id
+
     def request_character_and_emotion(self):
         """请求服务器返回角色和情感列表"""
         try:
-            # 使用完全匹配服务器期望的格式
-            init_message = "SYSTEM,COMMAND,LIST_CHARACTERS"  # 使用更明确的命令名称
-            self.client_socket.send(init_message.encode('utf-8'))
-            data = self.client_socket.recv(1024).decode('utf-8')
+            request_id = self.send_frame(MSG_COMMAND, {"command": "LIST_CHARACTERS"})
+
+            # 接收线程尚未启动，在这里阻塞读取直到收到对应的回复
+            while True:
+                chunk = self.client_socket.recv(4096)
+                if not chunk:
+                    logger.error("等待角色和情感数据时连接已关闭")
+                    return
+                frames = [frame for frame in self.decoder.feed(chunk) if frame[1] == request_id]
+                if frames:
+                    break
 
-            try:
-                # 解析JSON格式的角色和情感数据
-                characters_and_emotions = json.loads(data)
-                if isinstance(characters_and_emotions, dict):
-                    self.character_selector.addItems(characters_and_emotions.keys())
-                    
-                    # 默认选择第一个角色，更新对应情感
-                    if characters_and_emotions:
-                        self.character_selector.setCurrentIndex(0)
-                        self.update_emotions(characters_and_emotions)
-
-                    # 角色变更时动态更新情感选项
-                    self.character_selector.currentIndexChanged.connect(
-                        lambda: self.update_emotions(characters_and_emotions)
-                    )
-                else:
-                    logger.error(f"收到的数据格式不正确: {data}")
-            except json.JSONDecodeError:
-                logger.error(f"JSON解析失败，收到的数据: {data}")
+            msg_type, _, payload = frames[0]
+            characters_and_emotions = payload.get("characters") if msg_type == MSG_RESULT else None
+            if isinstance(characters_and_emotions, dict):
+                self.character_selector.addItems(characters_and_emotions.keys())
+
+                # 默认选择第一个角色，更新对应情感
+                if characters_and_emotions:
+                    self.character_selector.setCurrentIndex(0)
+                    self.update_emotions(characters_and_emotions)
+
+                # 角色变更时动态更新情感选项，并让服务端预加载该角色
+                self.character_selector.currentIndexChanged.connect(
+                    lambda: self.update_emotions(characters_and_emotions)
+                )
+                self.character_selector.currentIndexChanged.connect(self.prefetch_character)
+                self.prefetch_character()
+            else:
+                logger.error(f"收到的数据格式不正确: {payload}")
 
         except Exception as e:
             logger.error(f"请求角色和情感数据时出错: {e}")
 
 
+    def prefetch_character(self):
+        """通知服务端预加载当前选中的角色，发送第一条消息时不必等待加载模型"""
+        character = self.character_selector.currentText()
+        if not character or not self.is_connected:
+            return
+        try:
+            self.send_frame(MSG_COMMAND, {"command": "PREFETCH", "character": character})
+        except Exception as e:
+            logger.error(f"发送预加载请求时出错: {e}")
+
     def update_emotions(self, characters_and_emotions):
         """根据选中角色更新情感下拉框"""
         selected_character = self.character_selector.currentText()
@@ -361,10 +407,11 @@ class ChatClient(QWidget):
             self.voice_button.setText("停止语音")
             self.voice_thread = VoiceInputThread()
             self.voice_thread.voice_input_signal.connect(self.handle_voice_input)
+            self.voice_thread.voice_partial_signal.connect(self.message_entry.setText)
             self.voice_thread.start()
         else:
             self.voice_button.setText("语音输入")
-            self.voice_thread.is_running = False
+            self.voice_thread.stop()
             self.voice_thread = None
 
     def handle_voice_input(self, text):
@@ -388,9 +435,13 @@ class ChatClient(QWidget):
                 # 在聊天窗口显示消息
                 self.add_message_bubble(f"{message}", "right")
 
-                # 将消息发送给服务器
-                formatted_message = f"{character},{emotion},{message}"
-                self.client_socket.send(formatted_message.encode('utf-8'))
+                # 将消息发送给服务器，不必等待上一条的回复
+                request_id = self.send_frame(MSG_CHAT, {"character": character,
+                                                        "emotion": emotion,
+                                                        "text": message,
+                                                        "delivery": "stream"})
+                self.pending[request_id] = message
+                self.player.request_sent(request_id)
 
                 self.message_entry.clear()
             except Exception as e:
@@ -404,34 +455,30 @@ class ChatClient(QWidget):
                 if not self.client_socket:
                     break
 
-                # 首先接收消息长度
-                data = bytearray()
-                while self.is_connected:
-                    chunk = self.client_socket.recv(4096)  # 使用更大的缓冲区
-                    if not chunk:
-                        break
-                    data.extend(chunk)
-                    
-                    # 尝试解码已接收的数据
-                    try:
-                        message = data.decode('utf-8')
-                        # 如果成功解码，清空缓冲区并处理消息
-                        data.clear()
-                        
-                        if message.startswith('{') and message.endswith('}'):
-                            # 这可能是角色和情感的JSON数据
-                            try:
-                                json_data = json.loads(message)
-                                logger.info("收到角色和情感数据")
-                            except json.JSONDecodeError:
-                                self.message_received.emit(message)
-                        else:
-                            self.message_received.emit(message)
-                        
-                        break  # 成功处理一条完整消息后跳出内部循环
-                    except UnicodeDecodeError:
-                        # 如果解码失败，继续接收数据
+                chunk = self.client_socket.recv(4096)
+                if not chunk:
+                    break
+
+                # 回复可能乱序到达，按请求 ID 对应
+                for msg_type, request_id, payload in self.decoder.feed(chunk):
+                    if msg_type == MSG_AUDIO:
+                        self.player.feed(request_id, payload)
                         continue
+                    if msg_type == MSG_AUDIO_FORMAT:
+                        self.player.begin(request_id, payload["sample_rate"])
+                        continue
+                    message = self.pending.pop(request_id, None)
+                    self.player.finish(request_id)
+                    if msg_type == MSG_RESULT:
+                        if "text" in payload:
+                            self.message_received.emit(payload["text"])
+                    elif msg_type == MSG_ERROR:
+                        logger.error(f"请求 {request_id} ({message}) 处理失败: {payload.get('error')}")
+                        if "retry_after" in payload:
+                            # 服务器繁忙，在聊天窗口提示稍后重试
+                            self.message_received.emit(payload["error"])
+                    else:
+                        logger.warning(f"收到未知消息类型: {msg_type}")
 
             except socket.error as e:
                 if self.is_connected:  # 只在非正常关闭时记录错误
@@ -452,14 +499,13 @@ class ChatClient(QWidget):
             
             # 停止语音线程
             if self.voice_thread and self.voice_thread.isRunning():
-                self.voice_thread.is_running = False
+                self.voice_thread.stop()
                 self.voice_thread.wait()
 
             # 如果socket还在连接状态，发送关闭消息
             if self.client_socket:
                 try:
-                    close_message = "SYSTEM,COMMAND,DISCONNECT"
-                    self.client_socket.send(close_message.encode('utf-8'))
+                    self.send_frame(MSG_COMMAND, {"command": "DISCONNECT"})
                     # 等待一小段时间确保消息发送完成
                     import time
                     time.sleep(0.1)
@@ -473,6 +519,8 @@ class ChatClient(QWidget):
                     self.client_socket.close()
                     self.client_socket = None
 
+            self.player.close()
+
         except Exception as e:
             logger.error(f"关闭窗口时出错: {e}")
         finally: